@@ -0,0 +1,511 @@
+#!/usr/bin/env python3
+"""
+    Microbenchmarks of hot spots of the scraper comparing the current
+    implementations with the original ones on fixtures
+"""
+
+import os
+import re
+import copy
+import html
+import json
+import time
+import tempfile
+import argparse
+import contextlib
+
+import lxml.html
+import dateutil.parser
+import pytz
+
+import parse
+import scrapeutils
+import segmentation
+
+BASE_DIR = os.path.dirname(__file__)
+FIXTURES_DIR = os.path.join(BASE_DIR, 'fixtures')
+FIXED_DEBATES_DIR = os.path.join(BASE_DIR, 'fixed_debates')
+
+# registered benchmarks by name
+BENCHMARKS = {}
+
+
+def benchmark(func):
+    """Register the function as a benchmark."""
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def compare(name, old, new, args_list, repeat=7):
+    """Run `old` and `new` function on each tuple of arguments in
+    `args_list` (deep copied for every run), check that they give equal
+    results and print the best times of both. Caches are cleared before
+    each run, so that only repetitions within a run hit them."""
+    times = {'old': None, 'new': None}
+    results = {}
+    # alternate the implementations to spread noise of the machine evenly
+    for _ in range(repeat):
+        for label, func in (('old', old), ('new', new)):
+            copies = copy.deepcopy(args_list)
+            scrapeutils._normalize_short_text.cache_clear()
+            scrapeutils.parse_sk_date.cache_clear()
+            scrapeutils._utc_offset.cache_clear()
+            start = time.perf_counter()
+            results[label] = [func(*args) for args in copies]
+            elapsed = time.perf_counter() - start
+            times[label] = elapsed if times[label] is None else min(times[label], elapsed)
+    if results['old'] != results['new']:
+        raise AssertionError('%s: results of the old and new implementation differ' % name)
+    print('%-40s old %9.2f ms   new %9.2f ms   speedup %5.2fx' %
+        (name, times['old'] * 1000, times['new'] * 1000, times['old'] / times['new']))
+
+
+def load_fixtures():
+    """Return expected results of all parser fixtures."""
+    result = []
+    for filename in sorted(os.listdir(FIXTURES_DIR)):
+        with open(os.path.join(FIXTURES_DIR, filename), encoding='utf-8') as f:
+            result.extend(sample['expected'] for sample in json.load(f))
+    return result
+
+
+def load_transcript_lines():
+    """Return text content of paragraphs of the fixed term 1 debate."""
+    with open(os.path.join(FIXED_DEBATES_DIR, 'debate_198550.html')) as f:
+        content = f.read().replace('<o:p></o:p>', '')
+    return [par.text_content() for par in lxml.html.fromstring(content).findall('.//p')]
+
+
+def old_plaintext(obj, skip=None):
+    """The original implementation of `scrapeutils.plaintext`."""
+    if isinstance(obj, str):
+        obj = html.unescape(obj).replace('\xa0', ' ').strip()
+        obj = re.sub(r'\s{2,}', ' ', obj)
+    elif isinstance(obj, list):
+        for i, v in enumerate(obj):
+            obj[i] = old_plaintext(v)
+    elif isinstance(obj, dict):
+        for k, v in obj.items():
+            if isinstance(skip, (tuple, list)) and k in skip: continue
+            obj[k] = old_plaintext(v)
+    return obj
+
+
+def old_clear_hyphens(text, eol=''):
+    """The original implementation of `scrapeutils.clear_hyphens`."""
+    pattern = r'([%s])-%s([%s])' % (scrapeutils.CS_LOWERS, eol, scrapeutils.CS_LOWERS)
+    return re.sub(pattern, r'\1\2', text)
+
+
+@contextlib.contextmanager
+def replayed(pages):
+    """Serve the given pages (URL -> HTML) by `scrapeutils.download`
+    from a temporary archive in replay mode."""
+    saved = scrapeutils.ARCHIVE_MODE, scrapeutils.ARCHIVE_PATH
+    with tempfile.TemporaryDirectory() as tmpdir:
+        scrapeutils.use_archive('replay', os.path.join(tmpdir, 'archive.sqlite'))
+        try:
+            for url, content in pages.items():
+                scrapeutils._archive.put(scrapeutils.cache_key(url), content.encode('utf-8'))
+            yield
+        finally:
+            scrapeutils.use_archive(*saved)
+
+
+def page_chrome(body):
+    """Wrap the body into the page layout of NRSR web with its menus and
+    view state, so that pages have a realistic size."""
+    menu = ''.join('<li><a href="Default.aspx?sid=menu&amp;item=%s">Položka menu %s</a></li>\n' % (i, i)
+        for i in range(300))
+    return ('<html><head><title>NRSR</title><!-- layout --></head><body>\n'
+        '<form><input type="hidden" id="__VIEWSTATE" value="%s"/>\n<div id="menu"><ul>\n%s</ul></div>\n'
+        '%s\n</form></body></html>' % ('x' * 20000, menu, body))
+
+
+def render_motion(motion, votes=150):
+    """Render a motion page of NRSR web from the expected parser result
+    with the list of votes repeated to the given number."""
+    summary = ['<div><a href="%s">%s. schôdza</a></div>' %
+        (html.escape(motion['schôdza']['url'].replace('http://www.nrsr.sk/web/', '')), motion['schôdza']['číslo'])]
+    for key in ('dátum', 'číslo', 'názov', 'výsledok'):
+        summary.append('<div><strong>%s</strong> <span>%s</span></div>' % (key, html.escape(motion.get(key, ''))))
+    counts = ''
+    if 'súčty' in motion:
+        counts = ('<div id="_sectionLayoutContainer_ctl01_ctl00__resultsTablePanel"><div>%s</div></div>' %
+            ''.join('<div>%s <span>%s</span></div>' % (k, v) for k, v in motion['súčty'].items()))
+    cells = []
+    if motion.get('hlasy'):
+        club = None
+        for vote in (motion['hlasy'] * votes)[:votes]:
+            if vote['klub'] != club:
+                club = vote['klub']
+                cells.append('<td class="hpo_result_block_title">%s</td>' % club)
+            given_name, family_name = vote['meno'].split(' ', 1)
+            cells.append('<td>[%s] <a href="%s">%s, %s</a></td>' % (vote['hlas'].upper(),
+                html.escape(vote['url'].replace('http://www.nrsr.sk/web/', '')), family_name, given_name))
+    votes_table = '<div id="_sectionLayoutContainer_ctl01__bodyPanel"><table>%s</table></div>' % ''.join(
+        '<tr>%s</tr>\n' % ''.join(cells[i:i+4]) for i in range(0, len(cells), 4)) if cells else ''
+    documents = '<ul>%s</ul>' % ''.join('<li><img src="doc.gif"/><a href="%s">%s</a></li>' %
+        (d['url'].replace('http://www.nrsr.sk/web/', ''), d['názov']) for d in motion.get('dokumenty', []))
+    return page_chrome('<div id="_sectionLayoutContainer__panelContent">'
+        '<div class="voting_stats_summary_full">%s</div>%s%s%s</div>' %
+        (''.join(summary), counts, votes_table, documents))
+
+
+def old_motion(id):
+    """The original implementation of `parse.motion`."""
+    url = 'http://www.nrsr.sk/web/Default.aspx?sid=schodze/hlasovanie/hlasklub&ID=%s' % id
+    content = scrapeutils.download(url)
+    if 'Unexpected error!' in content:
+        raise RuntimeError("Motion with id '%s' does not exist" % id)
+    html = lxml.html.fromstring(content)
+
+    panel = html.find('.//div[@id="_sectionLayoutContainer__panelContent"]')
+    motion = panel.find('.//div[@class="voting_stats_summary_full"]')
+    session_link = motion.find('div[1]//a').get('href')
+    counts = panel.find('.//div[@id="_sectionLayoutContainer_ctl01_ctl00__resultsTablePanel"]/div')
+
+    result = {
+        'url': url,
+        'schôdza': {
+            'číslo': re.search(r'CisSchodze=(\d+)', session_link).group(1),
+            'obdobie': re.search(r'CisObdobia=(\d+)', session_link).group(1),
+            'url': 'http://www.nrsr.sk/web/' + session_link,
+        },
+        'dátum': motion.findtext('div[2]/span'),
+        'číslo': motion.findtext('div[3]/span'),
+        'názov': motion.findtext('div[4]/span'),
+    }
+    res = motion.findtext('div[5]/span')
+    if res:
+        result['výsledok'] = res
+    if counts is not None:
+        result['súčty'] = {
+            'prítomní': counts.findtext('div[1]/span'),
+            'hlasujúcich': counts.findtext('div[2]/span'),
+            '[z] za': counts.findtext('div[3]/span'),
+            '[p] proti': counts.findtext('div[4]/span'),
+            '[?] zdržalo sa': counts.findtext('div[5]/span'),
+            '[n] nehlasovalo': counts.findtext('div[6]/span'),
+            '[0] neprítomní': counts.findtext('div[7]/span'),
+        }
+
+    mps = panel.find('.//div[@id="_sectionLayoutContainer_ctl01__bodyPanel"]')
+    if mps is not None:
+        result['hlasy'] = []
+        for td in mps.findall('.//td'):
+            if td.get('class') == 'hpo_result_block_title':
+                parl_group = td.text.strip()
+            else:
+                if not td.text: continue
+                vote = td.text[1].lower()
+                a = td.find('a')
+                family_name, _, given_name = a.text.partition(',')
+                link = a.get('href')
+                id = re.search(r'PoslanecID=(\d+)', link)
+                mp = {
+                    'meno': given_name.strip() + ' ' + family_name.strip(),
+                    'klub': parl_group,
+                    'hlas': vote,
+                    'id': id.group(1),
+                    'url': 'http://www.nrsr.sk/web/' + link
+                }
+                result['hlasy'].append(mp)
+
+    related_docs = panel.findall('./ul/li[img]/a')
+    if related_docs:
+        result['dokumenty'] = [{
+            'názov': a.text.strip(),
+            'url': 'http://www.nrsr.sk/web/' + a.get('href')
+        } for a in related_docs]
+
+    return old_plaintext(result)
+
+
+@benchmark
+def motion():
+    with open(os.path.join(FIXTURES_DIR, 'motion.json'), encoding='utf-8') as f:
+        samples = json.load(f)
+    pages = {sample['expected']['url']: render_motion(sample['expected']) for sample in samples}
+    with replayed(pages):
+        ids = [(sample['id'],) for sample in samples] * 50
+        compare('motion: parse of synthetic pages (150 votes)', old_motion, parse.motion, ids)
+        contents = [(page,) for page in pages.values()] * 50
+        compare('motion: HTML parser only', lambda c: len(lxml.html.fromstring(c).xpath('//*')),
+            lambda c: len(parse._html(c).xpath('//*')), contents)
+
+
+@benchmark
+def plaintext():
+    fixtures = load_fixtures()
+    compare('plaintext: fixtures', old_plaintext, scrapeutils.plaintext, [(f,) for f in fixtures] * 20)
+
+    motion = next(f for f in fixtures if 'hlasy' in f)
+    motion = dict(motion, hlasy=[dict(vote, meno=' %s\xa0 ' % vote['meno'], klub='Klub&nbsp;SMER  – SD')
+        for vote in motion['hlasy'] * 150][:150])
+    compare('plaintext: motion with 150 votes', old_plaintext, scrapeutils.plaintext, [(motion,)] * 20)
+
+    lines = load_transcript_lines()
+    compare('plaintext: transcript lines', old_plaintext, scrapeutils.plaintext, [(line,) for line in lines])
+    compare('plaintext: transcript as a list', old_plaintext, scrapeutils.plaintext, [(lines,)])
+
+
+@benchmark
+def clear_hyphens():
+    lines = scrapeutils.plaintext(load_transcript_lines())
+    paragraphs = ['\n'.join(lines[i:i+10]) for i in range(0, len(lines), 10)]
+    compare('clear_hyphens: transcript paragraphs', old_clear_hyphens, scrapeutils.clear_hyphens,
+        [(p, '\n') for p in paragraphs])
+
+
+def old_transcript_lines(id):
+    """The original extraction of lines of a terms 5-6 transcript by
+    `parse.debate_of_terms56` and `lxml.html.fromstring` of each line and
+    of its heading."""
+    lines = []
+    for line in parse.debate_of_terms56(id)['riadky']:
+        heading = re.match(r'<strong>(.*?)</strong>', line)
+        lines.append((scrapeutils.plaintext(lxml.html.fromstring(line).text_content()) if line else '',
+            scrapeutils.plaintext(lxml.html.fromstring(heading.group(1)).text_content()) if heading else None))
+    return lines
+
+
+@benchmark
+def transcript_lines():
+    lines = load_transcript_lines()
+    body = []
+    for i in range(0, len(lines), 20):
+        body.append('<p><strong>Priezvisko, Meno, poslanec</strong><br>%s</p>' %
+            '<br>\n'.join(html.escape(line) for line in lines[i:i+20]))
+    url = 'http://tv.nrsr.sk/transcript?id=1'
+    with replayed({url: '<html><body><div>%s</div></body></html>' % '\n'.join(body)}):
+        compare('transcript_lines: term 1 debate as terms 5-6 transcript', old_transcript_lines,
+            lambda id: [tuple(line) for line in parse.debate_lines_of_terms56(id)['riadky']], [('1',)] * 5)
+
+
+@benchmark
+def segmentation_pool():
+    debates = [('3', '181190'), ('3', '182336'), ('4', '216412'), ('4', '225823'), ('4', '2010_02_03')]
+    args = [(parse.debate_of_terms234(id), term, {}.get, str) for term, id in debates]
+    compare('segmentation: fixed debates, serial vs. process pool',
+        lambda args: [segmentation.segment_old_debate(*a) for a in args],
+        lambda args: list(scrapeutils.iter_parallel(segmentation.segment_old_debate, args)), [(args,)], repeat=3)
+
+
+def old_normalized_parentheses(par):
+    """The original conversion of nested parentheses to brackets of the
+    old debates scraper."""
+    n = 1
+    while n >= 1:
+        (par, n) = re.subn(r'\((.*?)\((.*?)\)(.*?)\)', r'(\1[\2]\3)', par, flags=re.DOTALL)
+    return par
+
+
+@benchmark
+def nested_parentheses():
+    paragraphs = []
+    for filename in sorted(os.listdir(FIXED_DEBATES_DIR)):
+        if filename.endswith('.rtf'):
+            paragraphs.extend(parse.debate_of_terms234(filename[7:-4]))
+    paragraphs = [re.sub(r'\[(.*?)\]', r'(\1)', p.replace('\n', ' ').strip()) for p in paragraphs]
+    compare('nested_parentheses: fixed debates paragraphs', old_normalized_parentheses,
+        segmentation._normalized_parentheses, [(p,) for p in paragraphs])
+    deep = ['Hlas z pléna %s. ' % i for i in range(200)]
+    deep = '(%s%s)' % (''.join('(%s' % t for t in deep), ')' * len(deep))
+    compare('nested_parentheses: 200 levels of nesting', old_normalized_parentheses,
+        segmentation._normalized_parentheses, [(deep,)], repeat=3)
+
+
+# scene pattern of the original segmentation matching the rest of the paragraph
+OLD_SCENE = re.compile(r'(.*?)\(\s*([\d%s][^\(\)]{2,}[\.?!“])\s*\)(.*)$' % scrapeutils.CS_UPPERS, re.DOTALL)
+
+
+def old_segment_old_debate(paragraphs, term, speakers, to_utc, name_corrections=None):
+    """The original segmentation by a cascade of regexes per paragraph
+    and concatenation of strings."""
+    name_corrections = name_corrections or {}
+    records = []
+    text = ''
+    date = ''
+    speaker_id = speaker_name = attribution = None
+    last_speech = None
+
+    def flush(type):
+        nonlocal text, last_speech
+        if not text: return
+        text = text.strip().replace('[', '(').replace(']', ')')
+        if type == 'scene':
+            records.append(segmentation.Scene(text, date))
+        else:
+            records.append(segmentation.Speech(type, text, speaker_id, speaker_name, attribution and attribution.strip(), date))
+        last_speech = text
+        text = ''
+
+    within_scene = False
+    for par in segmentation._join_header(paragraphs, term):
+        par = par.replace('\n', ' ').strip()
+        if not par: continue
+
+        # fix last scene
+        if segmentation._FINAL_TIME.search(par):
+            if not par[0] in ('(', '[', '/'):
+                par = '(%s)' % par
+
+        # convert brackets to parentheses
+        par = segmentation._BRACKETS.sub(r'(\1)', par)
+        # slash pairs are converted to parentheses too in term 1
+        if term == '1':
+            par = segmentation._SLASH_PAIRS.sub(r'\1(\2)\3', par)
+        par = segmentation._normalized_parentheses(par)
+
+        # process eventual multiparagraph scene
+        if par.startswith('(') and par.count('(') > par.count(')'):
+            # save eventual previous speech
+            flush('speech')
+
+            text = '<p>%s</p>' % par[1:]
+            within_scene = True
+            continue
+        if within_scene:
+            if par.endswith(')') and par.count(')') > par.count('('):
+                text += '\n\n<p>%s</p>' % par[:-1]
+                flush('scene')
+                within_scene = False
+            else:
+                text += '\n\n<p>%s</p>' % par
+            continue
+
+        # process eventual header
+        hd = segmentation._HEADER.search(par)
+        if hd:
+            # save eventual previous speech
+            flush('speech')
+
+            sk_date = '%s. %s %s' % (hd.group(4), hd.group(5), hd.group(6))
+            initial_time = segmentation._INITIAL_TIME.search(hd.group(7))
+            if initial_time and initial_time.group(1) != '??':
+                h, m = initial_time.group(1).strip('.').split('.')
+                date = to_utc(sk_date + ' %s:%s:00' % (h.strip().zfill(2), m.strip().zfill(2)))
+            else:
+                date = to_utc(sk_date) + 'T00:00:00'
+            session_number = None if hd.group(1).startswith('sláv') else hd.group(3)
+            records.append(segmentation.Header(date, sk_date, session_number))
+            continue
+
+        # process eventual start of a speech
+        old_format = date < segmentation.NEW_SPEECH_START_DATE
+        sp = (segmentation._OLD_SPEECH_START if old_format else segmentation._SPEECH_START).match(par)
+        if sp:
+            # save eventual previous speech
+            flush('speech')
+
+            # identify speaker
+            if old_format:
+                name = '%s. %s' % (sp.group(2), sp.group(5))
+                if (sp.group(4)):
+                    name = name.replace(' ', ' %s. ' % sp.group(4))
+                attribution = sp.group(1)
+                par = ''
+            else:
+                name = '%s. %s' % (sp.group(1), sp.group(4))
+                if (sp.group(3)):
+                    name = name.replace(' ', ' %s. ' % sp.group(3))
+                attribution = sp.group(5)
+                par = sp.group(6)
+
+            speaker_name = name_corrections.get(name, name)
+            attribution = attribution[0].lower() + attribution[1:].strip()
+            speaker_id = speakers(speaker_name)
+
+        # recognize date(-time) stamps in transcripts
+        ds = segmentation._DATESTAMP.match(par)
+        if ds:
+            dt = ds.group(1).strip()
+            tm = re.search(r'o\s+(.*?)\s+', ds.group(2) or '')
+            try:
+                if tm:
+                    h, m = tm.group(1).strip('.').split('.')
+                    date = to_utc('%s %s:%s:00' % (dt, h.strip().zfill(2), m.strip().zfill(2)))
+                else:
+                    date = to_utc(dt) + 'T00:00:00'
+                records.append(segmentation.Timestamp(date))
+                continue
+            except ValueError:
+                pass
+
+        # process eventual scene in this paragraph
+        while True:
+            scene = OLD_SCENE.match(par)
+            if not scene: break
+            if scene.group(1):
+                text += '\n\n<p>%s</p>' % scene.group(1).strip()
+            flush('speech')
+            text = '<p>%s</p>' % scene.group(2).strip()
+            flush('scene')
+            par = scene.group(3)
+
+        if par:
+            text += '\n\n<p>%s</p>' % par.strip()
+
+    flush('speech')
+
+    # extract end time of the sitting
+    final_time = segmentation._FINAL_TIME.search(last_speech) if last_speech else None
+    if final_time:
+        tm = final_time.group(2)
+        tm = tm.replace('O', '0').replace(',', '.')
+        h, m = tm.strip('.').split('.')
+        final_date = '%s.%s.%s %s:%s:00' % (date[8:10], date[5:7], date[0:4], h.strip().zfill(2), m.strip().zfill(2))
+        records.append(segmentation.End(to_utc(final_date)))
+
+    return records
+
+
+@benchmark
+def segment_old_debate():
+    debates = [('2', '181459'), ('4', '182847'), ('2', '244909')]
+    args = [(parse.debate_of_terms234(id), term, {}.get, str) for term, id in debates]
+    compare('segment_old_debate: largest fixed debates and debate 244909', old_segment_old_debate,
+        segmentation.segment_old_debate, args)
+
+
+def old_sk_to_utc(dt_str):
+    """The original `scrape.sk_to_utc` by dateutil and pytz."""
+    match = re.search(scrapeutils.SK_MONTHS_REGEX, dt_str, re.IGNORECASE)
+    if match:
+        month = match.group(0)
+        dt_str = dt_str.replace(month, '%s.' % scrapeutils.SK_MONTHS[month[:3].lower()])
+    dt = dateutil.parser.parse(dt_str, dayfirst=True)
+    if ':' in dt_str:
+        return pytz.timezone(scrapeutils.TIMEZONE).localize(dt).astimezone(pytz.utc).strftime('%Y-%m-%dT%H:%M:%S')
+    else:
+        return dt.strftime('%Y-%m-%d')
+
+
+@benchmark
+def sk_to_utc():
+    # times of motions and debate parts of 200 sitting days, each day
+    # repeated as date of the sitting and start of its transcript
+    dates = []
+    for day in range(200):
+        date = '%s. %s. %s' % (day % 28 + 1, day // 28 % 12 + 1, 2006 + day // 100)
+        dates.append(date)
+        dates.extend('%s %s:%02d' % (date, 9 + i // 6, i * 7 % 60) for i in range(50))
+        dates.append('%s. %s %s' % (day % 28 + 1, ['januára', 'marca', 'mája', 'júla', 'septembra', 'novembra'][day % 6],
+            2006 + day // 100))
+    compare('sk_to_utc: 10400 dates and times of a term', lambda dates: [old_sk_to_utc(d) for d in dates],
+        lambda dates: [scrapeutils.parse_sk_date(d) or old_sk_to_utc(d) for d in dates], [(dates,)], repeat=3)
+    compare('sk_to_utc: the same dates repeated 5 times', lambda dates: [old_sk_to_utc(d) for d in dates],
+        lambda dates: [scrapeutils.parse_sk_date(d) or old_sk_to_utc(d) for d in dates], [(dates * 5,)], repeat=3)
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Runs microbenchmarks of the scraper.')
+    ap.add_argument('names', nargs='*', choices=[[]] + sorted(BENCHMARKS), help='benchmarks to run (default: all)')
+    args = ap.parse_args()
+    for name in args.names or BENCHMARKS:
+        BENCHMARKS[name]()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+"""
+    Pool of long-lived LibreOffice listener processes converting documents
+    by unoconv concurrently
+"""
+
+import os
+import time
+import queue
+import atexit
+import shutil
+import socket
+import logging
+import tempfile
+import threading
+import subprocess
+import concurrent.futures
+
+# command starting LibreOffice
+SOFFICE = 'soffice'
+# number of listeners in the shared pool (default: number of cores)
+POOL_SIZE = None
+# TCP port of the first listener, the others use the following ones
+FIRST_PORT = 2002
+# how long to wait for a started listener to accept connections (in seconds)
+STARTUP_TIMEOUT = 60
+# time limit of conversion of one document, a listener that exceeds it is
+# considered hung and restarted (in seconds)
+CONVERSION_TIMEOUT = 300
+# how many times conversion of a document is attempted
+CONVERSION_ATTEMPTS = 2
+
+
+class ConversionError(RuntimeError):
+    """Conversion of a document failed even after restart of the listener."""
+
+
+class Listener:
+    """LibreOffice process listening on its own port with its own user
+    profile, so that several of them may run at once."""
+
+    def __init__(self, port):
+        self.port = port
+        self.process = None
+        self.profile = tempfile.mkdtemp(prefix='soffice-%s-' % port)
+
+    @property
+    def connection(self):
+        """UNO connection string of the listener."""
+        return 'socket,host=127.0.0.1,port=%s;urp;StarOffice.ComponentContext' % self.port
+
+    def start(self):
+        """Start the listener and wait until it accepts connections."""
+        self.process = subprocess.Popen(
+            [SOFFICE, '--headless', '--invisible', '--nologo', '--nodefault', '--norestore',
+                '--accept=%s' % self.connection, '-env:UserInstallation=file://%s' % self.profile],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while not self.accepting():
+            if self.process.poll() is not None or time.monotonic() > deadline:
+                self.stop()
+                raise ConversionError('LibreOffice listener on port %s failed to start' % self.port)
+            time.sleep(0.2)
+
+    def stop(self):
+        """Stop the listener, kill it if it does not terminate in time."""
+        if self.process is None:
+            return
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+
+    def restart(self):
+        logging.warning('Restarting LibreOffice listener on port %s' % self.port)
+        self.stop()
+        self.start()
+
+    def accepting(self):
+        """Return True if the listener accepts connections."""
+        try:
+            with socket.create_connection(('127.0.0.1', self.port), timeout=1):
+                return True
+        except OSError:
+            return False
+
+    def healthy(self):
+        """Return True if the listener process runs and accepts connections."""
+        return self.process is not None and self.process.poll() is None and self.accepting()
+
+    def convert(self, filename, format='html'):
+        """Convert the document to the given format and return the result
+        as bytes. Hung or failing listener is restarted and conversion
+        attempted again."""
+        if not self.healthy():
+            self.restart()
+        for attempt in range(CONVERSION_ATTEMPTS):
+            try:
+                return subprocess.run(
+                    ['unoconv', '--connection', self.connection, '--no-launch', '-f', format, '--stdout', filename],
+                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=CONVERSION_TIMEOUT, check=True).stdout
+            except (subprocess.TimeoutExpired, subprocess.CalledProcessError) as e:
+                if attempt == CONVERSION_ATTEMPTS - 1:
+                    raise ConversionError("Conversion of '%s' failed: %s" % (filename, e)) from e
+                logging.warning("Conversion of '%s' failed: %s" % (filename, e))
+                self.restart()
+
+    def close(self):
+        """Stop the listener and delete its profile."""
+        self.stop()
+        shutil.rmtree(self.profile, ignore_errors=True)
+
+
+class Pool:
+    """Pool of at most `size` (default: number of cores) listeners started
+    on demand and kept running until the pool is closed."""
+
+    def __init__(self, size=None, first_port=None):
+        self.size = size or os.cpu_count() or 1
+        self.first_port = first_port or FIRST_PORT
+        self._listeners = []
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        """Return an idle listener, start a new one if there is none and
+        the pool is not full, otherwise wait for one."""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            listener = None
+            if len(self._listeners) < self.size:
+                # the lowest port not used by a listener, ports of listeners
+                # that failed to start are reused
+                ports = {l.port for l in self._listeners}
+                port = self.first_port
+                while port in ports:
+                    port += 1
+                listener = Listener(port)
+                self._listeners.append(listener)
+        if listener is None:
+            return self._idle.get()
+        try:
+            listener.start()
+        except BaseException:
+            with self._lock:
+                self._listeners.remove(listener)
+            listener.close()
+            raise
+        return listener
+
+    def convert(self, filename, format='html'):
+        """Convert the document by an idle listener of the pool and return
+        the result as bytes."""
+        listener = self._acquire()
+        try:
+            return listener.convert(filename, format)
+        finally:
+            self._idle.put(listener)
+
+    def convert_all(self, filenames, format='html'):
+        """Convert the documents concurrently by all listeners of the pool
+        and return the results in order."""
+        filenames = list(filenames)
+        if not filenames:
+            return []
+        with concurrent.futures.ThreadPoolExecutor(min(self.size, len(filenames))) as executor:
+            return list(executor.map(lambda f: self.convert(f, format), filenames))
+
+    def close(self):
+        """Stop all listeners of the pool."""
+        with self._lock:
+            listeners, self._listeners = self._listeners, []
+            self._idle = queue.Queue()
+        for listener in listeners:
+            listener.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def pool():
+    """Return the pool shared by the whole run, it is closed on exit."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = Pool(POOL_SIZE)
+            atexit.register(_pool.close)
+        return _pool
@@ -5,11 +5,14 @@
 
 import re
 import lxml.html
+from lxml import etree
 import os.path
-import subprocess
-import requests
+import logging
+from collections import namedtuple
 
+import libreoffice
 import scrapeutils
+import webcache
 
 BASE_DIR = os.path.dirname(__file__)
 
@@ -23,16 +26,236 @@ terms = {
     '7': {'start_date': '2016-03-07', 'end_date': None}
 }
 
+# cache of paragraphs of transcripts keyed by SHA-256 hash of their source,
+# bump PARSER_VERSION on any change of the transcript parsers to invalidate it
+USE_PARAGRAPHS_CACHE = True
+PARAGRAPHS_CACHE_PATH = os.path.join(scrapeutils.WEBCACHE_PATH, 'paragraphs.sqlite')
+PARSER_VERSION = 1
+
+# parser of structural pages (lists, profiles, motions); transcripts are
+# parsed by the default parser as whitespace matters there
+HTML_PARSER = lxml.html.HTMLParser(remove_comments=True)
+
+
+class XPaths:
+    """Named XPath expressions of a page type compiled once on import.
+    Expressions return lists, use `_first` and `_text` to get a single
+    element or its text like `find` and `findtext` do."""
+    def __init__(self, **paths):
+        for name, path in paths.items():
+            setattr(self, name, etree.XPath(path, smart_strings=False))
+
+
+FORM = XPaths(
+    viewstate='.//input[@id="__VIEWSTATE"]/@value',
+    eventvalidation='.//input[@id="__EVENTVALIDATION"]/@value',
+)
+GRID = XPaths(
+    current_page='.//table[@id=$grid]/tr[1]//span',
+    # the grid of new debates has its pager in the first row of a nested table
+    nested_current_page='.//table[@id=$grid]//tr[1]//span',
+    rows='.//table[@id=$grid]/tr[not(@class="pager" or @class="tab_zoznam_header")]',
+)
+MP_LIST = XPaths(
+    mps='.//div[@class="mps_list"]//li/a',
+)
+SESSION_LIST = XPaths(
+    items='.//div[@id="_sectionLayoutContainer__panelContent"]//ul//li',
+)
+SESSION = XPaths(
+    cells='td',
+    link='a',
+)
+MOTION = XPaths(
+    panel='.//div[@id="_sectionLayoutContainer__panelContent"]',
+    summary='.//div[@class="voting_stats_summary_full"]',
+    session_link='div[1]//a/@href',
+    counts='.//div[@id="_sectionLayoutContainer_ctl01_ctl00__resultsTablePanel"]/div',
+    field='div[$i]/span',
+    votes='.//div[@id="_sectionLayoutContainer_ctl01__bodyPanel"]',
+    cells='.//td',
+    link='a',
+    documents='./ul/li[img]/a',
+)
+NEW_DEBATES_LIST = XPaths(
+    cells='td',
+    speaker_name='strong',
+    speaker_link='a',
+    links='td[5]/a',
+    image='img/@src',
+)
+
+
+def _first(nodes):
+    """Return the first of the nodes found by an XPath expression or None."""
+    return nodes[0] if nodes else None
+
+
+def _text(nodes):
+    """Return text of the first of the nodes found by an XPath expression
+    (empty string if it has no text) or None if nothing was found."""
+    return (nodes[0].text or '') if nodes else None
+
+
+def _html(content):
+    """Parse content of a structural page to HTML tree."""
+    return lxml.html.document_fromstring(content, parser=HTML_PARSER)
+
+
+# fingerprint and size of the placeholder photo of MPs without a photo
+_dummy_image = None
+
+
+def _dummy_image_fingerprint():
+    """Return fingerprint and size of the placeholder photo, read it
+    from disk on first use."""
+    global _dummy_image
+    if _dummy_image is None:
+        with open(os.path.join(BASE_DIR, 'dummy-image.jpg'), 'rb') as f:
+            content = f.read()
+        _dummy_image = webcache.fingerprint(content), len(content)
+    return _dummy_image
+
+
+# postback targets of grids whose pages cannot be requested directly
+_serial_grids = set()
+
+
+def _current_page(html, target, pager):
+    """Return element with the current page number found by the XPath
+    `pager` in the grid with the given postback target or None if there
+    is no pager."""
+    return _first(pager(html, grid=target.replace('$', '_')))
+
+
+def _page_data(html, target, page, fields):
+    """Return form data of a postback requesting the given page of the
+    grid from the page state of `html`."""
+    data = {
+        '__EVENTTARGET': target,
+        '__EVENTARGUMENT': 'Page$%s' % page,
+        '__VIEWSTATE': _first(FORM.viewstate(html)),
+        '__EVENTVALIDATION': _first(FORM.eventvalidation(html)),
+    }
+    data.update(fields)
+    return data
+
+
+def _grid_pages(url, html, target, fields, ext, pager=GRID.current_page):
+    """Generator of all pages of an ASP.NET grid with pager as parsed
+    HTML, starting with the already parsed first page `html`.
+
+    The pages are requested concurrently by postbacks jumping directly
+    from the first page (see `_direct_pages`). If the server rejects the
+    jumps, the remaining pages are walked serially as by clicking
+    through the pager. `target` is the postback target of the grid,
+    `fields` are additional form fields of the postbacks, `ext` is a
+    prefix of their cache key extensions and `pager` is the XPath of the
+    current page number.
+    """
+    yield html
+    page = 1
+    if target not in _serial_grids:
+        for html in _direct_pages(url, html, target, fields, ext, pager):
+            page += 1
+            yield html
+
+    while True:
+        current_page = _current_page(html, target, pager)
+        if current_page is None: break
+        next_page = current_page.getparent().getnext()
+        if next_page is None: break
 
+        # POST request to emulate pager click
+        page += 1
+        data = _page_data(html, target, page, fields)
+        content = scrapeutils.download(url, 'POST', data, '%s|%s' % (ext, page))
+        html = _html(content)
+        yield html
+
+
+def _direct_pages(url, html, target, fields, ext, pager):
+    """Generator of the second and further pages of a grid requested
+    concurrently by `Page$N` postbacks from the page state of the first
+    page `html`.
+
+    The last page is requested first as a probe (by a `Page$Last`
+    postback if the pager does not show all pages) to learn the total
+    number of pages and whether the server accepts the jumps at all. The
+    probe is not retried and does not count towards the circuit breaker
+    of the host, so that a server rejecting the jumps is not hammered.
+
+    Each page is checked to be the requested one. If it is not or the
+    server refuses the request, the generator stops and the grid is
+    remembered to be walked serially.
+    """
+    def reject(reason):
+        logging.warning('Direct paging of %s rejected (%s), falling back to serial walk' % (target, reason))
+        _serial_grids.add(target)
+
+    def request(page):
+        data = _page_data(html, target, page, fields)
+        return {'url': url, 'method': 'POST', 'data': data, 'url_extension': '%s|%s|direct' % (ext, page)}
+
+    current_page = _current_page(html, target, pager)
+    if current_page is None:
+        return
+    links = current_page.getparent().getparent().findall('.//a')
+    pages = [int(p) for a in links for p in re.findall(r'Page\$(\d+)', a.get('href', ''))]
+    if not pages:
+        return
+    total = max(pages)
+    try:
+        # 'Last' if there are more pages than the pager shows
+        probe = 'Last' if links[-1].text_content().strip() == '...' else total
+        last_page = _html(scrapeutils.download(retry=False, **request(probe)))
+        last_number = _current_page(last_page, target, pager)
+        if last_number is None or not last_number.text_content().strip().isdigit() or \
+                int(last_number.text_content()) < total or last_number.getparent().getnext() is not None:
+            reject('unexpected last page')
+            return
+        total = int(last_number.text_content())
+
+        chunk_size = 4 * scrapeutils.CONCURRENCY
+        for start in range(2, total, chunk_size):
+            numbers = range(start, min(start + chunk_size, total))
+            contents = scrapeutils.download_all([request(page) for page in numbers])
+            for page, content in zip(numbers, contents):
+                page_html = _html(content)
+                number = _current_page(page_html, target, pager)
+                number = number.text_content().strip() if number is not None else None
+                if number != str(page):
+                    reject('page %s requested, %s received' % (page, number))
+                    return
+                yield page_html
+    except (OSError, scrapeutils.ReplayMiss) as e:
+        reject(e)
+        return
+    yield last_page
+
+
+def _joined(pages):
+    """Join pages yielded by an `iter_*` generator of a paginated list
+    into a single result with all items."""
+    result = None
+    for page in pages:
+        if result is None:
+            result = {'url': page['url'], '_items': []}
+        result['_items'].extend(page['_items'])
+    return result
+
+
+@scrapeutils.memoize
 def current_term():
     url = 'http://www.nrsr.sk/web/default.aspx?sid=poslanci'
     content = scrapeutils.download(url)
-    html = lxml.html.fromstring(content)
+    html = _html(content)
 
     option = html.find('.//select[@id="_sectionLayoutContainer_ctl01__currentTerm"]/option[@selected]')
     return option.get('value')
 
 
+@scrapeutils.memoize
 def mp_list(term=None):
     """Parse list of MPs."""
     if term and term not in terms.keys():
@@ -41,19 +264,20 @@ def mp_list(term=None):
 
     url = 'http://www.nrsr.sk/web/Default.aspx?sid=poslanci/zoznam_abc&ListType=0&CisObdobia=%s' % term
     content = scrapeutils.download(url)
-    html = lxml.html.fromstring(content)
+    html = _html(content)
 
     result = {
         'url': url,
         '_items': [{
             'id': re.search(r'PoslanecID=(\d+)', mp.get('href')).group(1),
             'meno': mp.text,
-        } for mp in html.findall('.//div[@class="mps_list"]//li/a')]
+        } for mp in MP_LIST.mps(html)]
     }
 
     return scrapeutils.plaintext(result)
 
 
+@scrapeutils.memoize
 def mp(id, term):
     """Parse MP from his profile webpage."""
     if term and term not in terms.keys():
@@ -63,7 +287,7 @@ def mp(id, term):
     content = scrapeutils.download(url)
     if 'Unexpected error!' in content:
         raise RuntimeError("MP with id '%s' does not exist in term '%s'" % (id, term))
-    html = lxml.html.fromstring(content)
+    html = _html(content)
 
     result = {
         'id': str(id),
@@ -75,10 +299,9 @@ def mp(id, term):
         result[label.lower()] = value.text_content() if value is not None else ''
 
     image_url = html.find('.//div[@class="mp_foto"]/img').get('src')
-    image = requests.get(image_url).content
-    with open(os.path.join(BASE_DIR, 'dummy-image.jpg'), 'rb') as f:
-        dummy_image = f.read()
-    result['fotka'] = image_url if image != dummy_image else ''
+    dummy_hash, dummy_size = _dummy_image_fingerprint()
+    image_hash, _ = scrapeutils.fingerprint(image_url, expected_size=dummy_size)
+    result['fotka'] = image_url if image_hash != dummy_hash else ''
 
     result['členstvo'] = []
     ul = html.find('.//span[@id="_sectionLayoutContainer_ctl01_ctlClenstvoLabel"]').getparent().getnext()
@@ -89,6 +312,7 @@ def mp(id, term):
     return scrapeutils.plaintext(result)
 
 
+@scrapeutils.memoize
 def group_list(type, term=None):
     """Parse list of groups of a given type (committee, parliamentary group, delegation, friendship group)."""
     types = {
@@ -116,18 +340,18 @@ def group_list(type, term=None):
         raise ValueError("unknown term '%s'" % term)
 
     content = scrapeutils.download(types[type]['url'])
-    html = lxml.html.fromstring(content)
+    html = _html(content)
 
     # scraping for older terms requires another POST request to emulate selectbox choice
     if term:
         data = {
             types[type]['term_param_name']: term,
-            '__VIEWSTATE': html.find('.//input[@id="__VIEWSTATE"]').get('value'),
-            '__EVENTVALIDATION': html.find('.//input[@id="__EVENTVALIDATION"]').get('value'),
+            '__VIEWSTATE': _first(FORM.viewstate(html)),
+            '__EVENTVALIDATION': _first(FORM.eventvalidation(html)),
         }
         ext = '|%s' % term
         content = scrapeutils.download(types[type]['url'], 'POST', data, ext)
-        html = lxml.html.fromstring(content)
+        html = _html(content)
 
     # pick list items
     result = {
@@ -153,6 +377,7 @@ def group_list(type, term=None):
     return scrapeutils.plaintext(result)
 
 
+@scrapeutils.memoize
 def group(type, id):
     """Parse group of a given type (committee, parliamentary group, delegation, friendship group)
     from its profile webpage."""
@@ -188,7 +413,7 @@ def group(type, id):
         raise RuntimeError("group of type '%s' with id '%s' not found")
 
     content = content.replace('member_vez', 'member')    # exception in committee with id=119
-    html = lxml.html.fromstring(content)
+    html = _html(content)
 
     result = {
         'id': str(id),
@@ -256,42 +481,47 @@ def group(type, id):
     return scrapeutils.plaintext(result, ['opis'])
 
 
+@scrapeutils.memoize
 def change_list(term=None):
     """Parse list of chamber membership changes."""
+    return _joined(iter_change_list(term))
+
+
+def iter_change_list(term=None):
+    """Generator of pages of the list of chamber membership changes as
+    they are downloaded. Each page is a dictionary with URL of the list,
+    page number `strana` and normalized `_items` of the page."""
     term = term or max(terms.keys())
     if term not in terms.keys():
         raise ValueError("unknown term '%s'" % term)
 
     url = 'http://www.nrsr.sk/web/default.aspx?sid=poslanci/zmeny'
     content = scrapeutils.download(url)
-    html = lxml.html.fromstring(content)
+    html = _html(content)
 
     # POST request to emulate term selection
     data = {
         '__EVENTTARGET': '_sectionLayoutContainer$ctl01$_currentTerm',
         '_sectionLayoutContainer$ctl01$_currentTerm': term,
-        '__VIEWSTATE': html.find('.//input[@id="__VIEWSTATE"]').get('value'),
-        '__EVENTVALIDATION': html.find('.//input[@id="__EVENTVALIDATION"]').get('value'),
+        '__VIEWSTATE': _first(FORM.viewstate(html)),
+        '__EVENTVALIDATION': _first(FORM.eventvalidation(html)),
         }
     ext = '|%s|1' % term
     content = scrapeutils.download(url, 'POST', data, ext)
-    html = lxml.html.fromstring(content)
+    html = _html(content)
 
-    result = {
-        'url': url,
-        '_items': []
-    }
-    page = 1
-    while True:
+    fields = {'_sectionLayoutContainer$ctl01$_currentTerm': term}
+    pages = _grid_pages(url, html, '_sectionLayoutContainer$ctl01$_ResultGrid2', fields, '|%s' % term)
+    for page, html in enumerate(pages, 1):
         # extract all changes from the current page
-        for tr in html.findall('.//table[@id="_sectionLayoutContainer_ctl01__ResultGrid2"]/tr'):
-            if tr.get('class') in ('pager', 'tab_zoznam_header'): continue
+        items = []
+        for tr in GRID.rows(html, grid='_sectionLayoutContainer_ctl01__ResultGrid2'):
             date = tr.findtext('td[1]')
             poslanec = tr.find('td[2]')
             text = re.search(r'(\S.*?)\s*\((.*?)\)', poslanec.text_content())
             link = poslanec.find('a').get('href')
             id = re.search(r'PoslanecID=(\d+)', link)
-            result['_items'].append({
+            items.append({
                 'dátum': tr.findtext('td[1]'),
                 'poslanec': {
                     'meno': text.group(1),
@@ -302,33 +532,15 @@ def change_list(term=None):
                 'zmena': tr.findtext('td[3]'),
                 'dôvod': tr.findtext('td[4]'),
             })
-
-        current_page = html.find('.//table[@id="_sectionLayoutContainer_ctl01__ResultGrid2"]/tr[1]//span')
-        if current_page is None: break
-        next_page = current_page.getparent().getnext()
-        if next_page is None: break
-
-        # POST request to emulate pager click
-        page += 1
-        data = {
-            '__EVENTTARGET': '_sectionLayoutContainer$ctl01$_ResultGrid2',
-            '_sectionLayoutContainer$ctl01$_currentTerm': term,
-            '__EVENTARGUMENT': 'Page$%s' % page,
-            '__VIEWSTATE': html.find('.//input[@id="__VIEWSTATE"]').get('value'),
-            '__EVENTVALIDATION': html.find('.//input[@id="__EVENTVALIDATION"]').get('value'),
-        }
-        ext = '|%s|%s' % (term, page)
-        content = scrapeutils.download(url, 'POST', data, ext)
-        html = lxml.html.fromstring(content)
-
-    return scrapeutils.plaintext(result)
+        yield scrapeutils.plaintext({'url': url, 'strana': page, '_items': items})
 
 
+@scrapeutils.memoize
 def speaker():
     """Parse current speaker (predseda) of the chamber."""
     url = 'http://www.nrsr.sk/web/default.aspx?sid=predseda'
     content = scrapeutils.download(url)
-    html = lxml.html.fromstring(content)
+    html = _html(content)
 
     div = html.find(".//div[@id='_sectionLayoutContainer__panelContent']")
     result = {
@@ -351,11 +563,12 @@ def speaker():
     return scrapeutils.plaintext(result)
 
 
+@scrapeutils.memoize
 def deputy_speakers():
     """Parse current deputy speakers (podpredsedovia) of the chamber."""
     url = 'http://www.nrsr.sk/web/default.aspx?sid=podpredsedovia'
     content = scrapeutils.download(url)
-    html = lxml.html.fromstring(content)
+    html = _html(content)
 
     result = []
     for div in html.findall(".//div[@class='vicechairman_bigbox']"):
@@ -377,6 +590,7 @@ def deputy_speakers():
     return scrapeutils.plaintext(result)
 
 
+@scrapeutils.memoize
 def session_list(term=None):
     """Parse list of sessions in one term of office of the parliament."""
     if term and term not in terms.keys():
@@ -384,25 +598,25 @@ def session_list(term=None):
 
     url = 'http://www.nrsr.sk/web/default.aspx?sid=schodze/hlasovanie/schodze'
     content = scrapeutils.download(url)
-    html = lxml.html.fromstring(content)
+    html = _html(content)
 
     # scraping for older terms requires another POST request to emulate selectbox choice
     if term:
         data = {
             '_sectionLayoutContainer$ctl01$_termsCombo': term,
-            '__VIEWSTATE': html.find('.//input[@id="__VIEWSTATE"]').get('value'),
-            '__EVENTVALIDATION': html.find('.//input[@id="__EVENTVALIDATION"]').get('value'),
+            '__VIEWSTATE': _first(FORM.viewstate(html)),
+            '__EVENTVALIDATION': _first(FORM.eventvalidation(html)),
         }
         ext = '|%s' % term
         content = scrapeutils.download(url, 'POST', data, ext)
-        html = lxml.html.fromstring(content)
+        html = _html(content)
 
     # pick list items
     result = {
         'url': url,
         '_items': []
     }
-    for li in html.findall('.//div[@id="_sectionLayoutContainer__panelContent"]//ul//li'):
+    for li in SESSION_LIST.items(html):
         a = li.find('a')
         link = a.get('href')
         session = {
@@ -416,8 +630,15 @@ def session_list(term=None):
     return scrapeutils.plaintext(result)
 
 
+@scrapeutils.memoize
 def session(session_number, term=None):
     """Parse a session, i.e. the list of voted motions."""
+    return _joined(iter_session(session_number, term))
+
+
+def iter_session(session_number, term=None):
+    """Generator of pages of the list of voted motions of a session as
+    they are downloaded, see `iter_change_list`."""
     if term and term not in terms.keys():
         raise ValueError("unknown term '%s'" % term)
     term = term or max(terms.keys())
@@ -428,77 +649,57 @@ def session(session_number, term=None):
         '&ZakZborID=13&CisObdobia=%s&CisSchodze=%s&ShowCisloSchodze=False' % \
         (term, session_number)
     content = scrapeutils.download(url)
-
-    result = {
-        'url': url,
-        '_items': []
-    }
     if 'V systéme nie sú evidované žiadne hlasovania vyhovujúce zadanej požiadavke.' in content:
-        return result
-    html = lxml.html.fromstring(content)
+        yield {'url': url, 'strana': 1, '_items': []}
+        return
+    html = _html(content)
 
-    page = 1
-    while True:
+    pages = _grid_pages(url, html, '_sectionLayoutContainer$ctl01$_resultGrid2', {}, '|%s' % term)
+    for page, html in enumerate(pages, 1):
         # extract all motions from the current page
-        for tr in html.findall('.//table[@id="_sectionLayoutContainer_ctl01__resultGrid2"]/tr'):
-            if tr.get('class') in ('pager', 'tab_zoznam_header'): continue
-            date = tr.find('td[1]')
-            vote_event = tr.find('td[2]/a')
+        items = []
+        for tr in GRID.rows(html, grid='_sectionLayoutContainer_ctl01__resultGrid2'):
+            cells = SESSION.cells(tr)
+            date = cells[0]
+            vote_event = _first(SESSION.link(cells[1]))
             vote_event_link = vote_event.get('href')
             id = re.search(r'ID=(\d+)', vote_event_link)
             motion = {
                 'dátum': date.text_content(),
                 'číslo': vote_event.text_content(),
-                'názov': tr.findtext('td[4]'),
+                'názov': cells[3].text or '',
                 'id': id.group(1),
                 'url': {
                     'výsledok': 'http://www.nrsr.sk/web/' + vote_event_link,
                 }
             }
-            object = tr.find('td[3]/a')
+            object = _first(SESSION.link(cells[2]))
             if object is not None:
                 motion['čpt'] = {
                     'číslo': object.text_content(),
                     'url': 'http://www.nrsr.sk/web/' + object.get('href')
                 }
-            vote_link2 = tr.find('td[5]/a').get('href')
+            vote_link2 = _first(SESSION.link(cells[4])).get('href')
             if vote_link2:
                 motion['url']['kluby'] = 'http://www.nrsr.sk/web/' + vote_link2
-            result['_items'].append(motion)
-
-        current_page = html.find('.//table[@id="_sectionLayoutContainer_ctl01__resultGrid2"]/tr[1]//span')
-        if current_page is None: break
-        next_page = current_page.getparent().getnext()
-        if next_page is None: break
-
-        # POST request to emulate pager click
-        page += 1
-        data = {
-            '__EVENTTARGET': '_sectionLayoutContainer$ctl01$_resultGrid2',
-            '__EVENTARGUMENT': 'Page$%s' % page,
-            '__VIEWSTATE': html.find('.//input[@id="__VIEWSTATE"]').get('value'),
-            '__EVENTVALIDATION': html.find('.//input[@id="__EVENTVALIDATION"]').get('value'),
-        }
-        ext = '|%s|%s' % (term, page)
-        content = scrapeutils.download(url, 'POST', data, ext)
-        html = lxml.html.fromstring(content)
+            items.append(motion)
+        yield scrapeutils.plaintext({'url': url, 'strana': page, '_items': items})
 
 
-    return scrapeutils.plaintext(result)
-
-
-def motion(id):
-    """Parse a motion/vote-event with individual votes cast by MPs."""
+def motion(id, final=False):
+    """Parse a motion/vote-event with individual votes cast by MPs.
+    If `final` is True, the motion page is not expected to change
+    anymore (its session is closed) and it is cached indefinitely."""
     url = 'http://www.nrsr.sk/web/Default.aspx?sid=schodze/hlasovanie/hlasklub&ID=%s' % id
-    content = scrapeutils.download(url)
+    content = scrapeutils.download(url, ttl=scrapeutils.FOREVER if final else None)
     if 'Unexpected error!' in content:
         raise RuntimeError("Motion with id '%s' does not exist" % id)
-    html = lxml.html.fromstring(content)
+    html = _html(content)
 
-    panel = html.find('.//div[@id="_sectionLayoutContainer__panelContent"]')
-    motion = panel.find('.//div[@class="voting_stats_summary_full"]')
-    session_link = motion.find('div[1]//a').get('href')
-    counts = panel.find('.//div[@id="_sectionLayoutContainer_ctl01_ctl00__resultsTablePanel"]/div')
+    panel = _first(MOTION.panel(html))
+    motion = _first(MOTION.summary(panel))
+    session_link = _first(MOTION.session_link(motion))
+    counts = _first(MOTION.counts(panel))
 
     result = {
         'url': url,
@@ -507,34 +708,34 @@ def motion(id):
             'obdobie': re.search(r'CisObdobia=(\d+)', session_link).group(1),
             'url': 'http://www.nrsr.sk/web/' + session_link,
         },
-        'dátum': motion.findtext('div[2]/span'),
-        'číslo': motion.findtext('div[3]/span'),
-        'názov': motion.findtext('div[4]/span'),
+        'dátum': _text(MOTION.field(motion, i=2)),
+        'číslo': _text(MOTION.field(motion, i=3)),
+        'názov': _text(MOTION.field(motion, i=4)),
     }
-    res = motion.findtext('div[5]/span')
+    res = _text(MOTION.field(motion, i=5))
     if res:
         result['výsledok'] = res
     if counts is not None:
         result['súčty'] = {
-            'prítomní': counts.findtext('div[1]/span'),
-            'hlasujúcich': counts.findtext('div[2]/span'),
-            '[z] za': counts.findtext('div[3]/span'),
-            '[p] proti': counts.findtext('div[4]/span'),
-            '[?] zdržalo sa': counts.findtext('div[5]/span'),
-            '[n] nehlasovalo': counts.findtext('div[6]/span'),
-            '[0] neprítomní': counts.findtext('div[7]/span'),
+            'prítomní': _text(MOTION.field(counts, i=1)),
+            'hlasujúcich': _text(MOTION.field(counts, i=2)),
+            '[z] za': _text(MOTION.field(counts, i=3)),
+            '[p] proti': _text(MOTION.field(counts, i=4)),
+            '[?] zdržalo sa': _text(MOTION.field(counts, i=5)),
+            '[n] nehlasovalo': _text(MOTION.field(counts, i=6)),
+            '[0] neprítomní': _text(MOTION.field(counts, i=7)),
         }
 
-    mps = panel.find('.//div[@id="_sectionLayoutContainer_ctl01__bodyPanel"]')
+    mps = _first(MOTION.votes(panel))
     if mps is not None:
         result['hlasy'] = []
-        for td in mps.findall('.//td'):
+        for td in MOTION.cells(mps):
             if td.get('class') == 'hpo_result_block_title':
                 parl_group = td.text.strip()
             else:
                 if not td.text: continue
                 vote = td.text[1].lower()
-                a = td.find('a')
+                a = _first(MOTION.link(td))
                 family_name, _, given_name = a.text.partition(',')
                 link = a.get('href')
                 id = re.search(r'PoslanecID=(\d+)', link)
@@ -547,7 +748,7 @@ def motion(id):
                 }
                 result['hlasy'].append(mp)
 
-    related_docs = panel.findall('./ul/li[img]/a')
+    related_docs = MOTION.documents(panel)
     if related_docs:
         result['dokumenty'] = [{
             'názov': a.text.strip(),
@@ -557,28 +758,33 @@ def motion(id):
     return scrapeutils.plaintext(result)
 
 
+@scrapeutils.memoize
 def old_debates_list(term):
     """Parse list of debates for the given term of office from NRSR
     Digital Library.
     Appropriate for older terms (1.-4.) where debates are not split
     by speaker."""
+    return _joined(iter_old_debates_list(term))
+
+
+def iter_old_debates_list(term):
+    """Generator of pages of the list of debates for the given term of
+    office from NRSR Digital Library as they are downloaded, see
+    `iter_change_list`."""
     if term not in ['1', '2', '3', '4']:
         raise ValueError("Old style transcripts are not available for term '%s'" % term)
 
     base_url = 'http://www.nrsr.sk/dl/Browser/Grid?nodeType=DocType&legId=13&chamberId=0' + \
             '&categoryId=1&committeeId=0&documentTypeId=5&folderId=0&meetingNr=' + \
             '&termNr=%s' % term
-    result = {
-        'url': base_url,
-        '_items': []
-    }
     page = 0
     while True:
         url = base_url + '&pageIndex=%s' % page
         content = scrapeutils.download(url)
-        html = lxml.html.fromstring(content)
+        html = _html(content)
 
         # extract all debates from the current page
+        items = []
         for tr in html.findall('.//table[@class="resultTable"]//tr'):
             sequence_number = tr.findtext('td[1]/a')
             title = tr.find('td[2]/a')
@@ -589,13 +795,39 @@ def old_debates_list(term):
                 'url': 'http://www.nrsr.sk' + title.get('href'),
                 'id': doc_id.group(1)
             }
-            result['_items'].append(debate)
+            items.append(debate)
 
         page += 1
+        yield scrapeutils.plaintext({'url': base_url, 'strana': page, '_items': items})
         pages = html.findtext('.//div[@class="pager"]/span[last()]')
         if page >= int(pages): break
 
-    return scrapeutils.plaintext(result)
+
+_paragraphs = None
+
+
+def _paragraphs_cache():
+    """Return the store of cached paragraphs of transcripts, open it on
+    first use."""
+    global _paragraphs
+    if _paragraphs is None:
+        _paragraphs = webcache.WebCache(PARAGRAPHS_CACHE_PATH)
+        scrapeutils.register_store(_paragraphs)
+    return _paragraphs
+
+
+def _cached_paragraphs(parser, hash, func=None):
+    """Return paragraphs of a transcript as parsed by `func()`, cached by
+    `hash` of its source (see `webcache.fingerprint`) and version of the
+    parser. If `func` is None, return None for a transcript not in the
+    cache."""
+    if not USE_PARAGRAPHS_CACHE:
+        return func() if func else None
+    result = _paragraphs_cache().get_parsed(hash, parser, PARSER_VERSION)
+    if result is None and func:
+        result = func()
+        _paragraphs_cache().put_parsed(hash, parser, PARSER_VERSION, result)
+    return result
 
 
 def debate_of_term1(id):
@@ -611,7 +843,12 @@ def debate_of_term1(id):
         content = scrapeutils.download(url)
         if 'Unexpected error!' in content:
             raise RuntimeError("Debate with id '%s' does not exist" % id)
+    return _cached_paragraphs('term1', webcache.fingerprint(content.encode('utf-8')),
+        lambda: _debate_of_term1(content))
 
+
+def _debate_of_term1(content):
+    """Return list of paragraphs' text content of a term 1 transcript."""
     # fix markup and parse to HTML tree
     content = content.replace('12. 9. 1995<o:p></o:p>', '12. septembra 1995')
     content = content.replace('<o:p></o:p>', '')
@@ -633,29 +870,54 @@ def debate_of_term1(id):
     return scrapeutils.plaintext(result)
 
 
-def debate_of_terms234(id):
-    """Parse a debate transcript in terms 2-4 format and return list of
-    its paragraphs' text content."""
-    # download RTF file or use a local fixed debate if there is one
+def _debate_file_of_terms234(id):
+    """Return filename of the RTF file of a debate transcript in terms
+    2-4, download the file unless there is a local fixed debate."""
     filename = os.path.join('fixed_debates', 'debate_%s.rtf' % id)
     if not os.path.exists(filename):
         url = 'http://www.nrsr.sk/dl/Browser/Document?documentId=%s' % id
-        rtf = scrapeutils.download(url)
         filename = os.path.join(scrapeutils.WEBCACHE_PATH, 'debate_%s.rtf' % id)
-        with open(filename, 'w') as f:
-            f.write(rtf)
+        scrapeutils.download_file(url, filename)
+    return filename
 
-    # convert from RTF to HTML using unoconv using LibreOffice
-    content = subprocess.check_output(['unoconv', '-f', 'html', '--stdout', filename])
-    html = lxml.html.fromstring(content)
-
-    result = []
-    for par in html.findall('./body/p'):
-        result.append(par.text_content())
 
-    return scrapeutils.plaintext(result)
+def _converted_paragraphs(content):
+    """Return text content of paragraphs of an RTF document converted to
+    HTML by LibreOffice."""
+    html = lxml.html.fromstring(content)
+    return scrapeutils.plaintext([par.text_content() for par in html.findall('./body/p')])
 
 
+def debate_of_terms234(id):
+    """Parse a debate transcript in terms 2-4 format and return list of
+    its paragraphs' text content."""
+    filename = _debate_file_of_terms234(id)
+    return _cached_paragraphs('terms234-unoconv', webcache.fingerprint_file(filename),
+        lambda: _converted_paragraphs(libreoffice.pool().convert(filename)))
+
+
+def debates_of_terms234(ids, chunk_size=None):
+    """Generator of results of `debate_of_terms234` for the given debate
+    ids in order. Chunks of the documents (default: four times the size
+    of the LibreOffice pool) are downloaded and converted concurrently by
+    all listeners of the pool."""
+    ids = list(ids)
+    pool = libreoffice.pool()
+    chunk_size = chunk_size or 4 * pool.size
+    for i in range(0, len(ids), chunk_size):
+        filenames = scrapeutils.map_concurrent(_debate_file_of_terms234, [(id,) for id in ids[i:i+chunk_size]])
+        # convert only the documents without cached paragraphs
+        hashes = {f: webcache.fingerprint_file(f) for f in filenames}
+        results = {f: _cached_paragraphs('terms234-unoconv', hashes[f]) for f in filenames}
+        missing = [f for f in filenames if results[f] is None]
+        for filename, content in zip(missing, pool.convert_all(missing)):
+            results[filename] = _cached_paragraphs('terms234-unoconv', hashes[filename],
+                lambda: _converted_paragraphs(content))
+        for filename in filenames:
+            yield results[filename]
+
+
+@scrapeutils.memoize
 def new_debates_list(term, since_date=None, until_date=None):
     """Parse list of debate parts for the given term of office from
     NRSR web. Appropriate for newer terms (since 5th) where split
@@ -663,19 +925,26 @@ def new_debates_list(term, since_date=None, until_date=None):
     in ISO format only the debate parts since/until that date are
     returned.
     """
+    return _joined(iter_new_debates_list(term, since_date, until_date))
+
+
+def iter_new_debates_list(term, since_date=None, until_date=None):
+    """Generator of pages of the list of debate parts for the given term
+    of office as they are downloaded, see `new_debates_list` and
+    `iter_change_list`."""
     if term not in ['5', '6', '7']:
         raise ValueError("Parsed transcripts are not available for term '%s'" % term)
 
     url = 'http://www.nrsr.sk/web/Default.aspx?sid=schodze/rozprava'
     content = scrapeutils.download(url)
-    html = lxml.html.fromstring(content)
+    html = _html(content)
 
     # a POST request to emulate choice of term in second selectbox and pressing the button
     data = {
         '_sectionLayoutContainer$ctl01$_termNr': term,
         '_sectionLayoutContainer$ctl01$_search': 'Vyhľadať',
-        '__VIEWSTATE': html.find('.//input[@id="__VIEWSTATE"]').get('value'),
-        '__EVENTVALIDATION': html.find('.//input[@id="__EVENTVALIDATION"]').get('value'),
+        '__VIEWSTATE': _first(FORM.viewstate(html)),
+        '__EVENTVALIDATION': _first(FORM.eventvalidation(html)),
     }
     base_ext = '|new|%s' % term
     if since_date:
@@ -685,40 +954,35 @@ def new_debates_list(term, since_date=None, until_date=None):
         data['_sectionLayoutContainer$ctl01$_dateTo$dateInput'] = since_date + '-00-00-00'
         base_ext += '|u%s' % since_date
     content = scrapeutils.download(url, 'POST', data, base_ext)
-    html = lxml.html.fromstring(content)
+    html = _html(content)
 
-    result = {
-        'url': url,
-        '_items': []
-    }
-    page = 1
-    while True:
+    fields = {'_sectionLayoutContainer$ctl01$_termNr': term}
+    pages = _grid_pages(url, html, '_sectionLayoutContainer$ctl01$_newDebate', fields, base_ext,
+        GRID.nested_current_page)
+    for page, html in enumerate(pages, 1):
         # extract all debate parts from the current page
-        for tr in html.findall('.//table[@id="_sectionLayoutContainer_ctl01__newDebate"]/tr'):
-            if tr.get('class') in ('pager', 'tab_zoznam_header'): continue
-            session_number = tr.find('td[1]')
-            date = tr.find('td[2]')
-            time_interval = tr.find('td[3]')
+        items = []
+        for tr in GRID.rows(html, grid='_sectionLayoutContainer_ctl01__newDebate'):
+            session_number, date, time_interval, speaker = NEW_DEBATES_LIST.cells(tr)[:4]
             time = re.search(r'(.*?) - (.*)', time_interval.text)
             part_type = time_interval.find('em')
-            speaker = tr.find('td[4]')
             speaker_label = speaker.find('br').tail.strip('( ')
             debate_part = {
                 'schôdza': session_number.text.replace('.', ''),
                 'dátum': date.text,
                 'trvanie': {'od': time.group(1), 'do': time.group(2)},
                 'druh': part_type.text or '',
-                'osoba': {'meno': speaker.findtext('strong'), 'funkcia': speaker_label}
+                'osoba': {'meno': _text(NEW_DEBATES_LIST.speaker_name(speaker)), 'funkcia': speaker_label}
             }
-            speaker_link = speaker.find('a')
+            speaker_link = _first(NEW_DEBATES_LIST.speaker_link(speaker))
             if speaker_link is not None:
                 speaker_url = speaker_link.get('href')
                 id = re.search(r'PoslanecID=(\d+)', speaker_url)
                 debate_part['osoba']['url'] = speaker_url
                 debate_part['osoba']['id'] = id.group(1)
-            for a in tr.findall('td[5]/a'):
+            for a in NEW_DEBATES_LIST.links(tr):
                 link = a.get('href')
-                src = a.find('img').get('src')
+                src = _first(NEW_DEBATES_LIST.image(a))
                 if 'speak' in src:
                     id = re.search(r'id=(\d+)', link)
                     debate_part['video'] = {'url': link, 'id': id.group(1)}
@@ -730,41 +994,34 @@ def new_debates_list(term, since_date=None, until_date=None):
                 else:
                     raise RuntimeError('Unrecognized link in section %s/%s/%s' %
                         (session_number.text, date.text, time_interval.text))
-            result['_items'].append(debate_part)
-
-        # test if there is a link to next page
-        current_page = html.find('.//table[@id="_sectionLayoutContainer_ctl01__newDebate"]//tr[1]//span')
-        if current_page is None: break
-        next_page = current_page.getparent().getnext()
-        if next_page is None: break
-        page += 1
+            items.append(debate_part)
+        yield scrapeutils.plaintext({'url': url, 'strana': page, '_items': items})
 
-        # a POST request to emulate pager click
-        data = {
-            '__EVENTTARGET': '_sectionLayoutContainer$ctl01$_newDebate',
-            '__EVENTARGUMENT': 'Page$%s' % page,
-            '_sectionLayoutContainer$ctl01$_termNr': term,
-            '__VIEWSTATE': html.find('.//input[@id="__VIEWSTATE"]').get('value'),
-            '__EVENTVALIDATION': html.find('.//input[@id="__EVENTVALIDATION"]').get('value'),
-        }
-        ext = base_ext + '|%s' % page
-        content = scrapeutils.download(url, 'POST', data, ext)
-        html = lxml.html.fromstring(content)
 
-    return scrapeutils.plaintext(result)
+# line of a transcript in terms 5-6 format as plain text, the line may be
+# a heading with name of the speaker if it starts with a <strong> element,
+# `heading` is then text of the element (without the rest of the line),
+# otherwise None
+TranscriptLine = namedtuple('TranscriptLine', 'text heading')
 
 
-def debate_of_terms56(id):
-    """Parse a debate transcript in terms 5-6 format and return its
-    structure."""
-    # download the debate transcript
+def _transcript_block(id, final):
+    """Return the main block of a transcript in terms 5-6 format or None
+    if the transcript is empty."""
     url = 'http://tv.nrsr.sk/transcript?id=%s' % id
-    content = scrapeutils.download(url)
-
-    # parse to HTML tree
-    html = lxml.html.fromstring(content)
-    main_block = html.find('body/div')
+    content = scrapeutils.download(url, ttl=scrapeutils.FOREVER if final else None)
+    main_block = lxml.html.fromstring(content).find('body/div')
     if not len(main_block) and not main_block.text.strip():
+        return None
+    return main_block
+
+
+def debate_of_terms56(id, final=False):
+    """Parse a debate transcript in terms 5-6 format and return its
+    structure. If `final` is True, the transcript is not expected to
+    change anymore and it is cached indefinitely."""
+    main_block = _transcript_block(id, final)
+    if main_block is None:
         result = {'riadky': []}
     else:
         # parse headings and individual lines used as paragraphs
@@ -774,3 +1031,52 @@ def debate_of_terms56(id):
         result = {'riadky': re.split('<br\s*/?>', main_content)}
 
     return scrapeutils.plaintext(result)
+
+
+def debate_lines_of_terms56(id, final=False):
+    """Parse a debate transcript in terms 5-6 format like
+    `debate_of_terms56` but return its lines as TranscriptLine records
+    with markup resolved by a single walk through the tree."""
+    main_block = _transcript_block(id, final)
+    return {'riadky': _transcript_lines(main_block) if main_block is not None else []}
+
+
+def _transcript_lines(main_block):
+    """Return TranscriptLine records of lines of the main block separated
+    by <br> elements at any depth."""
+    lines = []
+    parts = []
+    # None before any text of the line, False if the line starts with text,
+    # otherwise the <strong> element the line starts with
+    heading = None
+
+    def add(text):
+        nonlocal heading
+        if text:
+            parts.append(text)
+            if heading is None and not text.isspace():
+                heading = False
+
+    def line():
+        text = scrapeutils.plaintext(''.join(parts))
+        if heading is None or heading is False:
+            return TranscriptLine(text, None)
+        return TranscriptLine(text, scrapeutils.plaintext(heading.text_content()))
+
+    def walk(element):
+        nonlocal parts, heading
+        for child in element:
+            if child.tag == 'br':
+                lines.append(line())
+                parts, heading = [], None
+            elif isinstance(child.tag, str):
+                if child.tag == 'strong' and heading is None:
+                    heading = child
+                add(child.text)
+                walk(child)
+            add(child.tail)
+
+    add(main_block.text)
+    walk(main_block)
+    lines.append(line())
+    return lines
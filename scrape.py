@@ -12,43 +12,30 @@ from datetime import date, datetime, timedelta
 import subprocess
 import time
 
-import lxml.html
-import pytz
 import dateutil.parser
 
 import vpapi
 import parse
 import scrapeutils
+import segmentation
 import test
 
 BASE_DIR = os.path.dirname(__file__)
 CONF_DIR = os.path.join(BASE_DIR, 'conf')
 LOGS_DIR = '/var/log/scrapers/sk/nrsr'
 
-SK_MONTHS = {
-    'jan': 1,
-    'feb': 2,
-    'mar': 3,
-    'apr': 4,
-    'máj': 5,
-    'jún': 6,
-    'júl': 7,
-    'aug': 8,
-    'sep': 9,
-    'okt': 10,
-    'nov': 11,
-    'dec': 12,
-}
-SK_MONTHS_REGEX = \
-    'januára?|februára?|mar(ec|ca)|apríla?|mája?|júna?|' + \
-    'júla?|augusta?|septemb(er|ra)|októb(er|ra)|novemb(er|ra)|decemb(er|ra)'
 
 def sk_to_utc(dt_str):
     """Converts Slovak date(-time) string into ISO format in UTC time."""
-    match = re.search(SK_MONTHS_REGEX, dt_str, re.IGNORECASE)
+    result = scrapeutils.parse_sk_date(dt_str)
+    if result is not None:
+        return result
+
+    # strings in other formats are parsed by dateutil
+    match = re.search(scrapeutils.SK_MONTHS_REGEX, dt_str, re.IGNORECASE)
     if match:
         month = match.group(0)
-        dt_str = dt_str.replace(month, '%s.' % SK_MONTHS[month[:3].lower()])
+        dt_str = dt_str.replace(month, '%s.' % scrapeutils.SK_MONTHS[month[:3].lower()])
     dt = dateutil.parser.parse(dt_str, dayfirst=True)
     if ':' in dt_str:
         return vpapi.local_to_utc(dt, to_string=True)
@@ -107,8 +94,13 @@ class Person:
             return 'male'
 
     @staticmethod
-    def scrape(id, term):
+    def scrape(id, term, skip_unchanged=False):
+        """Scrape MP's profile. If `skip_unchanged` is True and the
+        profile did not change since it was saved by a previous run,
+        return None."""
         source = parse.mp(id, term)
+        if skip_unchanged and scrapeutils.processed(source['url']):
+            return None
 
         p = Person()
         p.name = source['meno'] + ' ' + source['priezvisko']
@@ -219,8 +211,13 @@ class Organization:
         return o
 
     @staticmethod
-    def scrape(type, id):
+    def scrape(type, id, skip_unchanged=False):
+        """Scrape group's profile. If `skip_unchanged` is True and the
+        profile did not change since it was saved by a previous run,
+        return None."""
         source = parse.group(type, id)
+        if skip_unchanged and scrapeutils.processed(source['url']):
+            return None
 
         o = Organization()
         o.name = source['názov']
@@ -465,9 +462,11 @@ class Membership:
         return True
 
 
-def scrape_people(term):
+def scrape_people(term, skip_unchanged=False):
     """Scrape and save people, organizations and memberships for the
-    given term.
+    given term. If `skip_unchanged` is True, MPs and groups whose
+    profiles did not change since they were saved by a previous run are
+    not updated. Memberships in groups are updated always.
     """
     logging.info('Scraping people, organizations and memberships of term `%s`' % term)
 
@@ -479,10 +478,14 @@ def scrape_people(term):
 
     # scrape MPs
     mps = parse.mp_list(term)
-    for mp in mps['_items']:
+    people = scrapeutils.iter_concurrent(Person.scrape, [(mp['id'], term, skip_unchanged) for mp in mps['_items']])
+    for mp, p in zip(mps['_items'], people):
+        if p is None:
+            logging.info('Skipping unchanged person `%s` (id=%s)' % (mp['meno'], mp['id']))
+            continue
         logging.info('Scraping person `%s` (id=%s)' % (mp['meno'], mp['id']))
-        p = Person.scrape(mp['id'], term)
         p.save()
+        scrapeutils.mark_processed(parse.mp(mp['id'], term)['url'])
     logging.info('Scraped %s people' % len(mps['_items']))
 
     # scrape memberships of MPs in the chamber
@@ -492,15 +495,20 @@ def scrape_people(term):
     # scrape groups and memberships in them
     for type in ('committee', 'parliamentary group', 'delegation', 'friendship group'):
         groups = parse.group_list(type, term)
-        for group in groups['_items']:
-            if term == '2' and type == 'parliamentary group' and \
-                    ('nie sú členmi' in group['názov'] or 'Nezávislý' in group['názov']):
-                continue
-            logging.info('Scraping %s `%s` (id=%s)' % (type, group['názov'], group['id']))
-            o = Organization.scrape(type, group['id'])
-            o.set_dates(group)
-            o.parent_id = chamber_id
-            o.save()
+        groups_to_scrape = [group for group in groups['_items']
+            if not (term == '2' and type == 'parliamentary group' and
+                ('nie sú členmi' in group['názov'] or 'Nezávislý' in group['názov']))]
+        orgs = scrapeutils.iter_concurrent(Organization.scrape,
+            [(type, g['id'], skip_unchanged) for g in groups_to_scrape])
+        for group, o in zip(groups_to_scrape, orgs):
+            if o is None:
+                logging.info('Skipping unchanged %s `%s` (id=%s)' % (type, group['názov'], group['id']))
+            else:
+                logging.info('Scraping %s `%s` (id=%s)' % (type, group['názov'], group['id']))
+                o.set_dates(group)
+                o.parent_id = chamber_id
+                o.save()
+                scrapeutils.mark_processed(parse.group(type, group['id'])['url'])
             logging.info('Scraping its memberships')
             Membership.scrape_from_group_and_save(type, group['id'], term)
         logging.info('Scraped %s %ss' % (len(groups['_items']), type))
@@ -544,11 +552,12 @@ def scrape_motions(term):
     for k, v in group_corrections.get(term, {}).items():
         parl_groups[k] = parl_groups[v]
 
-    # prepare list of sessions that are not completely scraped yet
+    # prepare list of sessions that are not completely scraped yet; list of
+    # motions of the next session is downloaded while the current one is checked
     sessions_to_scrape = []
     session_list = parse.session_list(term)
-    for session in session_list['_items']:
-        motions = parse.session(session['číslo'], term)
+    sessions = ((session, parse.session(session['číslo'], term)) for session in session_list['_items'])
+    for session, motions in scrapeutils.prefetch(sessions):
         if len(motions['_items']) == 0: continue
         last_motion_id = motions['_items'][-1]['id']
         m_url = 'http://www.nrsr.sk/web/Default.aspx?sid=schodze/hlasovanie/hlasklub&ID=%s' % last_motion_id
@@ -577,21 +586,26 @@ def scrape_motions(term):
         key = ('organization_id', 'type', 'identifier')
         session_id, _ = get_or_create('events', session, key)
 
+        # find motions that are not present yet
+        motions_to_scrape = []
         for i, m in enumerate(motions['_items']):
-            # check if the motion is already present
             m_id = re.search(r'ID=(\d+)', m['url']['výsledok']).group(1)
             # we not use directly m['url']['kluby'] because it is not always present
             m_url = 'http://www.nrsr.sk/web/Default.aspx?sid=schodze/hlasovanie/hlasklub&ID=%s' % m_id
             existing = vpapi.getfirst('motions', where={'sources.url': m_url})
-            if existing: continue
+            if not existing:
+                motions_to_scrape.append((i, m))
 
+        # download and parse the motions concurrently; motions of the last session may be amended yet
+        final = s is not session_list['_items'][0]
+        parsed_motions = scrapeutils.iter_concurrent(parse.motion, [(m['id'], final) for _, m in motions_to_scrape])
+        for (i, m), parsed_motion in zip(motions_to_scrape, parsed_motions):
             try:
                 motion_id = None
                 vote_event_id = None
 
                 # insert motion
                 logging.info('Scraping motion %s of %s (voted at %s)' % (i+1, len(motions['_items']), m['dátum']))
-                parsed_motion = parse.motion(m['id'])
                 motion = {
                     'organization_id': chamber_id,
                     'legislative_session_id': session_id,
@@ -684,34 +698,28 @@ def scrape_old_debates(term):
     Returns number of scraped speeches.
     """
 
-    def insert_speech(type):
-        """Insert a speech entity with the given type and data
-        from parent scope variables and update end date of the
-        corresponding session and sitting. Delete `text`
-        variable."""
-        nonlocal text, position
-        if not text: return
-        position = position + 1
-        speech = {
-            'text': text.strip().replace('[', '(').replace(']', ')'),
-            'type': type,
-            'position': position,
-            'event_id': sitting_id,
-            'sources' : [{
-                'url': debate['url'],
-                'note': 'Prepis debaty v Digitálnej knižnici na webe NRSR'
-            }]
-        }
-        if type != 'scene':
-            speech['creator_id'] = speaker_id
-            speech['attribution_text'] = attribution.strip()
-        speeches.append(speech)
-        text = ''
-
-        if date > session_end_date:
-            vpapi.patch('events', session_id, {'end_date': date})
-        if date > sitting_end_date:
-            vpapi.patch('events', sitting_id, {'end_date': date})
+    def speaker_id(speech):
+        """Return id of the speaker of the speech record, create unknown
+        speakers."""
+        name = speech.speaker_name
+        if name is None: return None
+        id = speech.speaker_id or mps.get(name)
+        if not id:
+            logging.warn('Speaker `%s, %s` not found, creating new Person' % (name, speech.attribution))
+            name_parts = re.match(r'(\w)\. ((\w)\. )?(\w+)', name)
+            person = {
+                'name': name,
+                'family_name': name_parts.group(4),
+                'given_name': name_parts.group(1)
+            }
+            person['sort_name'] = '%s, %s.' % (person['family_name'], person['given_name'])
+            if name_parts.group(3):
+                person['additional_name'] = name_parts.group(3)
+                person['sort_name'] += ' %s.' % person['additional_name']
+            resp = vpapi.post('people', person)
+            id = resp['id']
+            mps[name] = id
+        return id
 
     logging.info('Scraping debates of term `%s`' % term)
     chamber_id = get_chamber_id(term)
@@ -741,10 +749,9 @@ def scrape_old_debates(term):
             'url': 'http://www.nrsr.sk/dl/Browser/DsDocument?documentId=391413'
         })
 
-    speech_count = 0
-    session_identifier = None
+    # skip obsolete debates in the list
+    debates_to_scrape = []
     for debate in debates['_items']:
-        # skip obsolete debates in the list
         if term == '1':
             if (debate['názov'] == 'Stenozáznam' and debate['id'] != '198550' or
                     debate['id'] in ('65890', '65945', '65949')):
@@ -755,85 +762,29 @@ def scrape_old_debates(term):
         elif term == '3':
             if debate['id'] == '181047':
                 continue
+        debates_to_scrape.append(debate)
 
-        logging.info('Scraping debate `%s` (id=%s)' % (debate['názov'], debate['id']))
-        if term == '1':
-            paragraphs = parse.debate_of_term1(debate['id'])
-        else:
-            paragraphs = parse.debate_of_terms234(debate['id'])
-
-        # normalize header of the debate transcript
-        if term == '2':
-            # join first 4 paragraphs and add trailing underscores to mark the header
-            paragraphs = ['%s %s %s %s\n___' % (paragraphs[0], paragraphs[1], paragraphs[2],
-                paragraphs[3])] + paragraphs[4:]
-        elif term in ('3', '4'):
-            # join first paragraphs until " hodine" ending is found
-            # and add trailing underscores to mark the header
-            p = ''
-            while True:
-                p += ' ' + paragraphs.pop(0)
-                if p.endswith('hodine'): break
-            if paragraphs[0].startswith('___'):
-                paragraphs.pop(0)
-            paragraphs.insert(0, p + '\n___')
-
-        # extract speeches from the debate
-        speeches = []
-        text = ''
-        within_scene = False
-        for par in paragraphs:
-            par = par.replace('\n', ' ').strip()
-            if not par: continue
-
-            # fix last scene
-            if re.search(r'\b(skončil.|skončené|prerušené|Prerušenie rokovani[ae])\s+o\s+(.*?)\s+hodine.', par):
-                if not par[0] in ('(', '[', '/'):
-                    par = '(%s)' % par
-
-            # convert brackets to parentheses
-            par = re.sub(r'\[(.*?)\]', r'(\1)', par)
-            # slash pairs are converted to parentheses too in term 1
-            if term == '1':
-                par = re.sub(r'(^|\s)/(.*?)/(\s|$)', r'\1(\2)\3', par)
-            # convert all inner nested parentheses to brackets
-            n = 1
-            while n >= 1:
-                (par, n) = re.subn(r'\((.*?)\((.*?)\)(.*?)\)', r'(\1[\2]\3)', par, flags=re.DOTALL)
-
-            # process eventual multiparagraph scene
-            if par.startswith('(') and par.count('(') > par.count(')'):
-                # save eventual previous speech
-                insert_speech('speech')
-
-                text = '<p>%s</p>' % par[1:]
-                within_scene = True
-                continue
-            if within_scene:
-                if par.endswith(')') and par.count(')') > par.count('('):
-                    text += '\n\n<p>%s</p>' % par[:-1]
-                    insert_speech('scene')
-                    within_scene = False
-                else:
-                    text += '\n\n<p>%s</p>' % par
-                continue
+    # transcripts of terms 2-4 are converted ahead in batches across cores
+    ids = [debate['id'] for debate in debates_to_scrape]
+    if term == '1':
+        transcripts = (parse.debate_of_term1(id) for id in ids)
+    else:
+        transcripts = parse.debates_of_terms234(ids)
 
-            # process eventual header
-            header_pattern = r'((\(?(\d+)\.\)?\s+schôdz)|slávnostn).*?(\d+)\..*\b(\w{3,})\s+(\d{4})(.*?)_{3,}$'
-            hd = re.search(header_pattern, par, re.DOTALL)
-            if hd:
-                # save eventual previous speech
-                insert_speech('speech')
-
-                sk_date = '%s. %s %s' % (hd.group(4), hd.group(5), hd.group(6))
-                initial_time = re.search(r'\s+o\s+(.*?)\s+hodine', hd.group(7), re.DOTALL)
-                if initial_time and initial_time.group(1) != '??':
-                    h, m = initial_time.group(1).strip('.').split('.')
-                    date = sk_to_utc(sk_date + ' %s:%s:00' % (h.strip().zfill(2), m.strip().zfill(2)))
-                else:
-                    date = sk_to_utc(sk_date) + 'T00:00:00'
+    # segment the debates into records in parallel processes
+    segments = scrapeutils.iter_parallel(segmentation.segment_old_debate,
+        ((paragraphs, term, mps.get, sk_to_utc, name_corrections) for paragraphs in transcripts))
 
-                if hd.group(1).startswith('sláv'):
+    # resolve events and speakers of the records sequentially
+    speech_count = 0
+    session_identifier = None
+    for debate, records in zip(debates_to_scrape, segments):
+        logging.info('Scraping debate `%s` (id=%s)' % (debate['názov'], debate['id']))
+        speeches = []
+        for record in records:
+            if isinstance(record, segmentation.Header):
+                date = record.date
+                if record.session_number is None:
                     new_session_name = 'Mimoriadna schôdza'
                     if term == '1':
                         new_session_identifier = debate['časť']
@@ -844,8 +795,8 @@ def scrape_old_debates(term):
                         d = '%s. %s. %s' % (int(date[8:10]), int(date[5:7]), int(date[0:4]))
                         new_session_identifier = next((s['číslo'] for s in sl['_items'] if s['trvanie'] == d))
                 else:
-                    new_session_name = '%s. schôdza' % hd.group(3)
-                    new_session_identifier = hd.group(3)
+                    new_session_name = '%s. schôdza' % record.session_number
+                    new_session_identifier = record.session_number
 
                 if new_session_identifier != session_identifier:
                     # create new session event
@@ -865,7 +816,7 @@ def scrape_old_debates(term):
                 # create new sitting event
                 sitting_count += 1
                 sitting = {
-                    'name': '%s. deň rokovania, %s' % (sitting_count, sk_date),
+                    'name': '%s. deň rokovania, %s' % (sitting_count, record.sk_date),
                     'identifier': str(sitting_count),
                     'organization_id': chamber_id,
                     'type': 'sitting',
@@ -882,100 +833,33 @@ def scrape_old_debates(term):
                     obsolete = vpapi.getall('speeches', where={'event_id': sitting_id})
                     for speech in obsolete:
                         vpapi.delete('speeches', speech['id'])
-                continue
 
-            # process eventual start of a speech
-            if date < '2001-09-04':
-                # format `Foreign minister J. Doe:`
-                speech_start_pattern = r'(.*?)\b([^\W\d])\.[\s_]+((\w)\.[\s_]+)?([\w-]+):$'
-            else:
-                # format `J. Doe, foreign minister: speech`
-                speech_start_pattern = r'([^\W\d])\.[\s_]+((\w)\.[\s_]+)?([\w-]+),\s+(.+?):(.+)$'
-            sp = re.match(speech_start_pattern, par, re.DOTALL)
-            if sp:
-                # save eventual previous speech
-                insert_speech('speech')
-
-                # identify speaker
-                if date < '2001-09-04':
-                    name = '%s. %s' % (sp.group(2), sp.group(5))
-                    if (sp.group(4)):
-                        name = name.replace(' ', ' %s. ' % sp.group(4))
-                    attribution = sp.group(1)
-                    par = ''
-                else:
-                    name = '%s. %s' % (sp.group(1), sp.group(4))
-                    if (sp.group(3)):
-                        name = name.replace(' ', ' %s. ' % sp.group(3))
-                    attribution = sp.group(5)
-                    par = sp.group(6)
-
-                if name in name_corrections:
-                    name = name_corrections[name]
-                attribution = attribution[0].lower() + attribution[1:].strip()
-                speaker_id = mps.get(name)
-
-                # create unknown speakers
-                if not speaker_id:
-                    logging.warn('Speaker `%s, %s` not found, creating new Person' % (name, attribution))
-                    name_parts = re.match(r'(\w)\. ((\w)\. )?(\w+)', name)
-                    person = {
-                        'name': name,
-                        'family_name': name_parts.group(4),
-                        'given_name': name_parts.group(1)
-                    }
-                    person['sort_name'] = '%s, %s.' % (person['family_name'], person['given_name'])
-                    if name_parts.group(3):
-                        person['additional_name'] = name_parts.group(3)
-                        person['sort_name'] += ' %s.' % person['additional_name']
-                    resp = vpapi.post('people', person)
-                    speaker_id = resp['id']
-                    mps[name] = speaker_id
-
-            # recognize date(-time) stamps in transcripts
-            ds = re.match(r'^\s*(\d+\.\s\w+\s\d{4})(.*hodine)?\s*$', par)
-            if ds:
-                dt = ds.group(1).strip()
-                tm = re.search(r'o\s+(.*?)\s+', ds.group(2) or '')
-                try:
-                    if tm:
-                        h, m = tm.group(1).strip('.').split('.')
-                        date = sk_to_utc('%s %s:%s:00' % (dt, h.strip().zfill(2), m.strip().zfill(2)))
-                    else:
-                        date = sk_to_utc(dt) + 'T00:00:00'
-                    continue
-                except ValueError:
-                    pass
-
-            # process eventual scene in this paragraph
-            scene_pattern = r'(.*?)\(\s*([\d%s][^\(\)]{2,}[\.?!“])\s*\)(.*)$' % scrapeutils.CS_UPPERS
-            while True:
-                scene = re.match(scene_pattern, par, re.DOTALL)
-                if not scene: break
-                if scene.group(1):
-                    text += '\n\n<p>%s</p>' % scene.group(1).strip()
-                insert_speech('speech')
-                text = '<p>%s</p>' % scene.group(2).strip()
-                insert_speech('scene')
-                par = scene.group(3)
-
-            if par:
-                text += '\n\n<p>%s</p>' % par.strip()
-
-        insert_speech('speech')
-
-        # extract end time of the session
-        final_time = re.search(
-            r'\b(skončil.|skončené|prerušené|Prerušenie rokovani[ae])\s+o\s+(.*?)\s+hodine.',
-            speeches[-1]['text'])
-        if final_time:
-            tm = final_time.group(2)
-            tm = tm.replace('O', '0').replace(',', '.')
-            h, m = tm.strip('.').split('.')
-            final_date = '%s.%s.%s %s:%s:00' % (date[8:10], date[5:7], date[0:4], h.strip().zfill(2), m.strip().zfill(2))
-            final_date = sk_to_utc(final_date)
-            vpapi.patch('events', session_id, {'end_date': final_date})
-            vpapi.patch('events', sitting_id, {'end_date': final_date})
+            elif isinstance(record, (segmentation.Speech, segmentation.Scene)):
+                position = position + 1
+                speech = {
+                    'text': record.text,
+                    'type': 'scene' if isinstance(record, segmentation.Scene) else record.type,
+                    'position': position,
+                    'event_id': sitting_id,
+                    'sources' : [{
+                        'url': debate['url'],
+                        'note': 'Prepis debaty v Digitálnej knižnici na webe NRSR'
+                    }]
+                }
+                if isinstance(record, segmentation.Speech):
+                    speech['creator_id'] = speaker_id(record)
+                    speech['attribution_text'] = record.attribution
+                speeches.append(speech)
+
+                if record.date > session_end_date:
+                    vpapi.patch('events', session_id, {'end_date': record.date})
+                if record.date > sitting_end_date:
+                    vpapi.patch('events', sitting_id, {'end_date': record.date})
+
+            elif isinstance(record, segmentation.End):
+                # end time of the session
+                vpapi.patch('events', session_id, {'end_date': record.date})
+                vpapi.patch('events', sitting_id, {'end_date': record.date})
 
         vpapi.post('speeches', speeches)
         logging.info('Scraped %s speeches' % len(speeches))
@@ -1007,15 +891,37 @@ def scrape_new_debates(term):
         'scene': 'scene'
     }
 
-    def insert_speech(kind):
-        """Insert a speech entity for the given debate part kind
-        and data from parent scope variables and update end date
-        of the corresponding session and sitting. Delete `text`
-        variable."""
-        nonlocal text, last_speech_enddatetime
-        if not text: return
+    def speaker_id(speech):
+        """Return id of the speaker of the speech record, create unknown
+        speakers."""
+        name = speech.speaker_name
+        if name is None: return None
+        id = speech.speaker_id or mps.get(name)
+        if not id:
+            logging.warn('Speaker `%s, %s` not found, creating new Person' % (name, speech.attribution))
+            name_parts = re.match(r'(\w+\.?)( (\w+\.?))? (\w+)', name)
+            person = {
+                'name': name,
+                'family_name': name_parts.group(4),
+                'given_name': name_parts.group(1)
+            }
+            person['sort_name'] = '%s, %s' % (person['family_name'], person['given_name'])
+            if name_parts.group(3):
+                person['additional_name'] = name_parts.group(3)
+                person['sort_name'] += ' %s' % person['additional_name']
+            resp = vpapi.post('people', person)
+            id = resp['id']
+            mps[name] = id
+        return id
+
+    def insert_speech(record):
+        """Insert a speech entity for the speech or scene record and
+        data of the debate part from parent scope variables and update
+        end date of the corresponding session and sitting."""
+        nonlocal last_speech_enddatetime
+        kind = 'scene' if isinstance(record, segmentation.Scene) else record.type
         speech = {
-            'text': text.strip().replace('[', '(').replace(']', ')'),
+            'text': record.text,
             'date': start_datetime,
             'type': debate_part_kinds.get(kind, 'speech'),
             'position': len(speeches) + 1,
@@ -1028,10 +934,9 @@ def scrape_new_debates(term):
         if dpart_video:
             speech['video'] = dpart_video
         if kind != 'scene':
-            speech['creator_id'] = speaker_id
-            speech['attribution_text'] = attribution.strip()
+            speech['creator_id'] = speaker_id(record)
+            speech['attribution_text'] = record.attribution
         speeches.append(speech)
-        text = ''
 
         if end_datetime > session_end_date:
             vpapi.patch('events', session_id, {'end_date': end_datetime})
@@ -1056,26 +961,40 @@ def scrape_new_debates(term):
         sort='-start_date')
     since_date = last_sitting['start_date'][:10] if last_sitting else None
 
-    # scrape list of debate parts
-    debate_parts = parse.new_debates_list(term, since_date)
+    def scraped_parts():
+        """Generator of debate parts that are not scraped yet with their
+        parsed transcripts. Transcripts of each page of the list of debate
+        parts are downloaded concurrently while the next page of the list
+        is being downloaded."""
+        for page in scrapeutils.prefetch(parse.iter_new_debates_list(term, since_date)):
+            # find debate parts that are not scraped yet
+            parts_to_scrape = []
+            recent = False
+            for dp in page['_items']:
+                # stop at very recent debate parts (may be incomplete)
+                start_datetime = sk_to_utc('%s %s' % (dp['dátum'], dp['trvanie']['od']))
+                sd = datetime.strptime(start_datetime, '%Y-%m-%dT%H:%M:%S')
+                if datetime.utcnow() - sd < timedelta(days=5):
+                    recent = True
+                    break
+
+                # skip already scraped debate parts
+                existing = vpapi.getfirst('speeches', where={'sources.url': dp['prepis']['url']})
+                if existing: continue
+                parts_to_scrape.append((dp, start_datetime, sd))
+
+            # download and parse transcripts of the debate parts concurrently; transcripts older than a week are final
+            dparts = scrapeutils.map_concurrent(parse.debate_lines_of_terms56,
+                [(dp['prepis']['id'], datetime.utcnow() - sd > timedelta(days=7)) for dp, _, sd in parts_to_scrape])
+            yield from zip(parts_to_scrape, dparts)
+            if recent: return
 
     speech_count = 0
     session_name = ''
     speeches = []
-    for dp in debate_parts['_items']:
-        # stop at very recent debate parts (may be incomplete)
-        start_datetime = sk_to_utc('%s %s' % (dp['dátum'], dp['trvanie']['od']))
-        sd = datetime.strptime(start_datetime, '%Y-%m-%dT%H:%M:%S')
-        if datetime.utcnow() - sd < timedelta(days=5):
-            break
-
-        # skip already scraped debate parts
-        existing = vpapi.getfirst('speeches', where={'sources.url': dp['prepis']['url']})
-        if existing: continue
-
+    for n, ((dp, start_datetime, sd), dpart) in enumerate(scraped_parts()):
         logging.info('Scraping debate part %s %s-%s (id=%s)' %
             (dp['dátum'], dp['trvanie']['od'], dp['trvanie']['do'], dp['prepis']['id']))
-        dpart = parse.debate_of_terms56(dp['prepis']['id'])
         if not dpart['riadky']: continue
 
         end_datetime = sk_to_utc('%s %s' % (dp['dátum'], dp['trvanie']['do']))
@@ -1132,106 +1051,17 @@ def scrape_new_debates(term):
             if len(speeches) > 0:
                 vpapi.post('speeches', speeches)
                 speech_count += len(speeches)
-            if dp != debate_parts['_items'][0]:
+            if n > 0:
                 logging.info('Scraped %s speeches from previous sitting' % len(speeches))
             speeches = []
 
         # add the first speaker name that is sometimes missing
-        first_speaker = '<strong>%s, %s</strong>' % (dp['osoba']['meno'], dp['osoba']['funkcia'])
-        dpart['riadky'].insert(0, first_speaker)
+        first_speaker = '%s, %s' % (dp['osoba']['meno'], dp['osoba']['funkcia'])
+        dpart['riadky'].insert(0, parse.TranscriptLine(first_speaker, first_speaker))
 
         # extract speeches from the debate part
-        text = ''
-        within_scene = False
-        for par in dpart['riadky']:
-            if not par: continue
-            par = par.replace('\n', ' ').strip()
-
-            # skip eventual speech number
-            if re.match('^(\d+)\.$', par): continue
-
-            # convert brackets to parentheses
-            par = re.sub(r'\[(.*?)\]', r'(\1)', par)
-            # convert all inner nested parentheses to brackets
-            n = 1
-            while n >= 1:
-                (par, n) = re.subn(r'\((.*?)\((\.*?)\)(.*?)\)', r'(\1[\2]\3)', par, flags=re.DOTALL)
-
-            # process eventual multiparagraph scene
-            if par.startswith('(') and par.count('(') > par.count(')'):
-                # save eventual previous speech
-                insert_speech(dpart_kind)
-
-                try:    #quickfix because of http://tv.nrsr.sk/transcript?id=163252
-                    text = '<p>%s</p>' % lxml.html.fromstring(par[1:]).text_content()
-                except Exception:
-                    text = "<p></p>"
-                within_scene = True
-                continue
-            if within_scene:
-                if par.endswith(')') and par.count(')') > par.count('('):
-                    text += '\n\n<p>%s</p>' % lxml.html.fromstring(par[:-1]).text_content()
-                    insert_speech('scene')
-                    within_scene = False
-                else:
-                    text += '\n\n<p>%s</p>' % lxml.html.fromstring(par).text_content()
-                continue
-
-            # process eventual new speaker
-            # format `Doe, John, foreign minister`
-            speech_start_pattern = r'<strong>(\w+), (\w+\.?)( (\w+\.?))?, (.*)</strong>'
-            sp = re.match(speech_start_pattern, par, re.DOTALL)
-            if sp:
-                # save eventual previous speech
-                insert_speech(dpart_kind)
-
-                # identify speaker
-                name = '%s %s' % (sp.group(2), sp.group(1))
-                if (sp.group(4)):
-                    name = name.replace(' ', ' %s ' % sp.group(4))
-                attribution = sp.group(5)
-                if name in name_corrections:
-                    name = name_corrections[name]
-                if len(name) == 0: continue
-                speaker_id = mps.get(name)
-
-                # create unknown speakers
-                if not speaker_id:
-                    logging.warn('Speaker `%s, %s` not found, creating new Person' % (name, attribution))
-                    name_parts = re.match(r'(\w+\.?)( (\w+\.?))? (\w+)', name)
-                    person = {
-                        'name': name,
-                        'family_name': name_parts.group(4),
-                        'given_name': name_parts.group(1)
-                    }
-                    person['sort_name'] = '%s, %s' % (person['family_name'], person['given_name'])
-                    if name_parts.group(3):
-                        person['additional_name'] = name_parts.group(3)
-                        person['sort_name'] += ' %s' % person['additional_name']
-                    resp = vpapi.post('people', person)
-                    speaker_id = resp['id']
-                    mps[name] = speaker_id
-                continue
-
-            # remove HTML tags
-            par = lxml.html.fromstring(par).text_content()
-
-            # process eventual scene in this paragraph
-            scene_pattern = r'(.*?)\(\s*([\d%s][^\(\)]{2,}[\.?!“])\s*\)(.*)$' % scrapeutils.CS_UPPERS
-            while True:
-                scene = re.match(scene_pattern, par, re.DOTALL)
-                if not scene: break
-                if scene.group(1):
-                    text += '\n\n<p>%s</p>' % scene.group(1).strip()
-                insert_speech(dpart_kind)
-                text = '<p>%s</p>' % scene.group(2).strip()
-                insert_speech('scene')
-                par = scene.group(3)
-
-            if par:
-                text += '\n\n<p>%s</p>' % par
-
-        insert_speech(dpart_kind)
+        for record in segmentation.segment_debate_part(dpart['riadky'], dpart_kind, mps.get, name_corrections):
+            insert_speech(record)
 
     if len(speeches) > 0:
         vpapi.post('speeches', speeches)
@@ -1248,6 +1078,10 @@ def main():
     ap.add_argument('--votes', choices=['initial', 'recent', 'none'], default='recent', help='scrape of motions and votes')
     ap.add_argument('--debates', choices=['initial', 'recent', 'none'], default='recent', help='scrape of speeches from debates')
     ap.add_argument('--term', help='term to scrape recent data from; current term is used when omitted')
+    ap.add_argument('--webcache', action='store_true', help='cache downloaded pages on disk for subsequent runs')
+    ap.add_argument('--time-budget', type=float, metavar='MINUTES', help='stop downloading when the run takes longer')
+    ap.add_argument('--record', metavar='ARCHIVE', help='record all downloaded pages into the archive file')
+    ap.add_argument('--replay', metavar='ARCHIVE', help='serve pages from the archive file instead of downloading them')
     args = ap.parse_args()
 
     # set-up logging to a local file
@@ -1263,7 +1097,7 @@ def main():
     try:
         # set-up the API access
         vpapi.parliament('sk/nrsr')
-        vpapi.timezone('Europe/Bratislava')
+        vpapi.timezone(scrapeutils.TIMEZONE)
         with open(os.path.join(CONF_DIR, 'private.json'), encoding='utf8') as f:
             creds = json.load(f)
         vpapi.authorize(creds['api_user'], creds['password'])
@@ -1271,10 +1105,9 @@ def main():
         # indicate that the scraper has started
         db_log = vpapi.post('logs', {'status': 'running', 'file': logname, 'params': args.__dict__})
 
-        # clear cached source files
-        if scrapeutils.USE_WEBCACHE:
-            logging.info('Clearing cached files')
-            scrapeutils.clear_cache()
+        # cache source files on disk; stale files are refreshed according to cache policies
+        if args.webcache:
+            scrapeutils.USE_WEBCACHE = True
 
         # test parser functions
         logging.info('Testing parser functions')
@@ -1285,6 +1118,14 @@ def main():
         if result.errors or result.failures:
             raise RuntimeError('Unit tests of parser functions failed, update canceled.')
 
+        # the time budget and the archive apply to the scrape itself, not to the tests
+        if args.time_budget:
+            scrapeutils.set_run_budget(args.time_budget * 60)
+        if args.record:
+            scrapeutils.use_archive('record', args.record)
+        elif args.replay:
+            scrapeutils.use_archive('replay', args.replay)
+
         if args.people == 'initial':
             # initial scrape of all history of people and organizations
             logging.info('Initial scrape - deleting people, organizations and memberships')
@@ -1299,7 +1140,7 @@ def main():
             term = args.term or parse.current_term()
             if term not in parse.terms:
                 raise Exception('Unknown term `%s`. Scrape canceled. Add it to the terms list in parse.py an rerun for the recently finished term once more.' % term)
-            scrape_people(term)
+            scrape_people(term, skip_unchanged=True)
 
         terms_with_old_debates = ('1', '2', '3', '4')
         if args.debates == 'initial':
@@ -1352,6 +1193,9 @@ def main():
         print('Scraping of parliament sk/nrsr failed, see\n\n' + logname + '\n\nfor details.')
 
     finally:
+        logging.info('Downloaded %(bytes)s bytes (%(decoded_bytes)s decompressed) in %(requests)s requests '
+            'over %(connections)s connections, %(retries)s retries, %(failures)s failed requests, '
+            '%(circuit_opens)s paused hosts, %(hedged)s hedged requests' % scrapeutils.stats())
         logging.info(status.capitalize())
         if 'db_log' in locals():
             vpapi.patch('logs', db_log['id'], {'status': status})
@@ -1,78 +1,1100 @@
 import os.path
-import hashlib
+import asyncio
+import concurrent.futures
+import functools
+import collections
+import copy
+import inspect
+import math
+import queue
+import time
+import random
+import logging
+import urllib.parse
 import requests
+import requests.adapters
+import pytz
+import datetime
 import shutil
 import html
 import re
+import threading
+import weakref
+
+import webcache
 
 USE_WEBCACHE = False
 WEBCACHE_PATH = os.path.join(os.path.dirname(__file__), 'webcache')
+# form fields carrying just the page state of ASP.NET that are not part of cache keys
+IGNORED_FORM_FIELDS = ('__VIEWSTATE', '__VIEWSTATEGENERATOR', '__EVENTVALIDATION')
+# maximal size of the cache in memory and on disk (in bytes)
+MEMORY_CACHE_SIZE = 64 * 2**20
+WEBCACHE_MAX_SIZE = 4 * 2**30
+
+HOUR = 3600
+DAY = 24 * HOUR
+FOREVER = math.inf
+# time to live of cached content by URL classes, the first matching
+# regular expression applies
+CACHE_POLICIES = [
+	# immutable documents in the Digital Library
+	(r'/dl/Browser/(Ds)?Document\?', FOREVER),
+	# motions and transcripts may be amended shortly after a vote or debate,
+	# callers pass FOREVER explicitly for the final ones
+	(r'sid=schodze/hlasovanie/hlasklub&', DAY),
+	(r'tv\.nrsr\.sk/transcript\?', DAY),
+	# volatile lists
+	(r'sid=poslanci(/zoznam_abc|/zmeny|$)', HOUR),
+	(r'sid=schodze/hlasovanie/(schodze|vyhladavanie_vysledok)', HOUR),
+	(r'sid=schodze/rozprava', HOUR),
+	(r'/dl/Browser/Grid\?', HOUR),
+]
+CACHE_DEFAULT_TTL = DAY
+
+# mode of the archive of requests and responses: 'record' stores all
+# responses into the archive, 'replay' serves responses from the archive
+# only, None disables the archive (see `use_archive`)
+ARCHIVE_MODE = None
+ARCHIVE_PATH = os.path.join(os.path.dirname(__file__), 'archive.sqlite')
 CS_LOWERS = 'aáäbcčdďeéěfghiíjklĺľmnňoóôpqrŕřsštťuúůvwxyýzž'
 CS_UPPERS = 'ÁÄBCČDĎEÉĚFGHIÍJKLĹĽMNŇOÓÔPQRŔŘSŠTŤUÚŮVWXYÝZŽ'
 
+# time zone of dates and times on the website
+TIMEZONE = 'Europe/Bratislava'
+SK_MONTHS = {
+	'jan': 1,
+	'feb': 2,
+	'mar': 3,
+	'apr': 4,
+	'máj': 5,
+	'jún': 6,
+	'júl': 7,
+	'aug': 8,
+	'sep': 9,
+	'okt': 10,
+	'nov': 11,
+	'dec': 12,
+}
+SK_MONTHS_REGEX = \
+	'januára?|februára?|mar(ec|ca)|apríla?|mája?|júna?|' + \
+	'júla?|augusta?|septemb(er|ra)|októb(er|ra)|novemb(er|ra)|decemb(er|ra)'
+
+# number of hosts to keep connection pools for and connections kept per host
+HTTP_POOL_HOSTS = 10
+HTTP_POOL_SIZE = 10
+# maximal number of downloads running at once in concurrent functions
+CONCURRENCY = 8
+# limits of requests per host or URL prefix (the longest matching one
+# applies): sustained rate in requests per second, burst of requests
+# allowed above that rate and maximal number of concurrent requests
+RATE_LIMITS = {
+	'http://www.nrsr.sk/': {'rate': 10, 'burst': 10, 'concurrency': 8},
+	'http://www.nrsr.sk/dl/': {'rate': 2, 'burst': 4, 'concurrency': 2},
+	'http://tv.nrsr.sk/': {'rate': 5, 'burst': 5, 'concurrency': 4},
+}
+DEFAULT_RATE_LIMIT = {'rate': 5, 'burst': 5, 'concurrency': 4}
+# number of retries of a failed request and bounds of the delay before
+# a retry (in seconds), the delay grows exponentially with random jitter
+RETRIES = 5
+RETRY_BASE_DELAY = 1
+RETRY_MAX_DELAY = 60
+# requests safe to repeat; POST requests of the parsers are ASP.NET
+# postbacks that only read data
+RETRY_METHODS = ('GET', 'HEAD', 'POST')
+# number of consecutive failures that open the circuit breaker of a host
+# and the initial and maximal time the host is paused for (in seconds);
+# the whole run fails if the host keeps failing after the longest pause
+CIRCUIT_FAILURES = 10
+CIRCUIT_PAUSE = 60
+CIRCUIT_MAX_PAUSE = 30 * 60
+# connect and read timeouts of requests (in seconds) by URL classes, the
+# first matching regular expression applies
+TIMEOUTS = [
+	(r'/dl/Browser/(Ds)?Document\?', (10, 300)),
+	(r'tv\.nrsr\.sk/transcript\?', (10, 60)),
+]
+DEFAULT_TIMEOUT = (10, 60)
+# if True, a GET request that takes longer than the 95th percentile of
+# latency of its host is hedged by a duplicate request and the first
+# response is used
+HEDGING = False
+# number of latency samples of a host required before its requests are hedged
+HEDGE_MIN_SAMPLES = 20
+
+_session = None
+_session_lock = threading.Lock()
+_cache = None
+_memory_cache = webcache.MemoryCache(MEMORY_CACHE_SIZE)
+_unchanged = {}
+_archive = None
+_recorded = set()
+_run_started = time.time()
+_policies = None
+_stats = {'requests': 0, 'bytes': 0, 'decoded_bytes': 0, 'retries': 0, 'failures': 0, 'circuit_opens': 0,
+	'hedged': 0}
+_stats_lock = threading.Lock()
+_limiters = {}
+_limiters_lock = threading.Lock()
+_breakers = {}
+_timeouts = None
+_deadline = None
+_hedge_executor = None
+_memoized = []
+_fingerprints = {}
+# open disk stores of other modules, e.g. cache of parsed paragraphs
+_stores = weakref.WeakSet()
 
-def download(url, method='GET', data=None, url_extension=''):
-	"""Downloads and returns content from the given URL.
 
-	If global variable USE_WEBCACHE is True, caches all received content
-	and uses cached file for subsequent requests.
+def session():
+	"""Returns the HTTP session shared by all downloads.
 
-	In case of POST request use `url_extension` to make URLs of requests
-	with different data unique.
+	The session keeps alive connections in a pool per host and
+	negotiates gzip/deflate compression of responses. It is created on
+	first use and may be used from multiple threads.
 	"""
-	if USE_WEBCACHE:
-		key = method.lower() + url + url_extension
-		hash = hashlib.md5(key.encode('utf-8')).hexdigest()
-		pathname = os.path.join(WEBCACHE_PATH, hash)
-		if os.path.exists(pathname):
-			with open(pathname, 'r', encoding='utf-8', newline='') as f:
-				return f.read()
-
-	if method.upper() == 'GET':
-		resp = requests.get(url)
-	elif method.upper() == 'POST':
-		resp = requests.post(url, data)
+	global _session
+	if _session is None:
+		with _session_lock:
+			if _session is None:
+				s = requests.Session()
+				adapter = requests.adapters.HTTPAdapter(
+					pool_connections=HTTP_POOL_HOSTS, pool_maxsize=HTTP_POOL_SIZE)
+				s.mount('http://', adapter)
+				s.mount('https://', adapter)
+				s.headers['Accept-Encoding'] = 'gzip, deflate'
+				_session = s
+	return _session
+
+
+class ReplayMiss(RuntimeError):
+	"""Raised in replay mode for a request missing in the archive."""
+	pass
+
+
+class DeadlineExceeded(RuntimeError):
+	"""Raised when a request is to be sent after the run time budget is
+	exhausted."""
+	pass
+
+
+def set_run_budget(seconds):
+	"""Sets time budget of the current run (in seconds from now). Requests
+	after the budget is exhausted raise DeadlineExceeded and no request
+	waits for a response beyond the budget. None removes the budget."""
+	global _deadline
+	_deadline = time.monotonic() + seconds if seconds is not None else None
+
+
+def _remaining_budget():
+	"""Returns remaining time of the run budget in seconds or None if
+	there is no budget. Raises DeadlineExceeded if it is exhausted."""
+	if _deadline is None:
+		return None
+	remaining = _deadline - time.monotonic()
+	if remaining <= 0:
+		raise DeadlineExceeded('time budget of the run is exhausted')
+	return remaining
+
+
+def request_timeout(url):
+	"""Returns tuple of connect and read timeouts (in seconds) for the
+	given URL according to TIMEOUTS, shortened to fit the run budget."""
+	global _timeouts
+	if _timeouts is None:
+		_timeouts = [(re.compile(pattern), timeout) for pattern, timeout in TIMEOUTS]
+	timeout = next((t for pattern, t in _timeouts if pattern.search(url)), DEFAULT_TIMEOUT)
+	remaining = _remaining_budget()
+	if remaining is not None:
+		timeout = tuple(min(t, remaining) for t in timeout)
+	return timeout
+
+
+def use_archive(mode, path=None):
+	"""Sets mode of the archive of requests and responses ('record',
+	'replay' or None) and optionally its path.
+
+	In record mode every response returned by `download` is stored into
+	the archive keyed by the request (see `cache_key`). In replay mode
+	responses are served purely from the archive without any network
+	access and ReplayMiss is raised for requests not recorded.
+	"""
+	global ARCHIVE_MODE, ARCHIVE_PATH, _archive
+	if mode not in (None, 'record', 'replay'):
+		raise ValueError("unknown archive mode '%s'" % mode)
+	ARCHIVE_MODE = mode
+	if path:
+		ARCHIVE_PATH = path
+	_archive = webcache.WebCache(ARCHIVE_PATH) if mode else None
+	_recorded.clear()
+
+
+def stats():
+	"""Returns counters of the current run: number of requests sent,
+	bytes received over the wire and after decompression, number of
+	connections opened, retried and finally failed requests and openings
+	of circuit breakers."""
+	with _stats_lock:
+		result = dict(_stats)
+	result['connections'] = 0
+	if _session is not None:
+		for adapter in set(_session.adapters.values()):
+			pools = adapter.poolmanager.pools
+			for key in pools.keys():
+				pool = pools.get(key)
+				if pool is not None:
+					result['connections'] += pool.num_connections
+	return result
+
+
+class HostLimiter:
+	"""Limits requests to one host by a token bucket and an adaptive
+	limit of concurrent requests.
+
+	The token bucket allows `rate` requests per second on average with
+	bursts up to `burst` requests. The concurrency limit follows AIMD:
+	it is increased by one per round of successful fast responses up to
+	`concurrency` and halved when the host responds with an error
+	(5xx, 429) or its latency rises well above the lowest one observed.
+	"""
+
+	# latency higher than this multiple of the base latency is considered congestion
+	LATENCY_FACTOR = 2.0
+	# weight of a new sample in the smoothed latency
+	SMOOTHING = 0.2
+
+	def __init__(self, rate, burst, concurrency):
+		self.rate = rate
+		self.burst = burst
+		self.max_concurrency = concurrency
+		self.limit = max(1.0, concurrency / 2)
+		self.active = 0
+		self.latency = None
+		self.base_latency = None
+		self.samples = collections.deque(maxlen=200)
+		self._tokens = float(burst)
+		self._updated = time.monotonic()
+		self._cond = threading.Condition()
+
+	def acquire(self):
+		"""Wait until a request may be sent."""
+		with self._cond:
+			while self.active >= int(self.limit):
+				self._cond.wait()
+			self.active += 1
+			while True:
+				now = time.monotonic()
+				self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+				self._updated = now
+				if self._tokens >= 1:
+					self._tokens -= 1
+					break
+				self._cond.wait((1 - self._tokens) / self.rate)
+
+	def release(self, latency, ok):
+		"""Account a finished request with its latency (in seconds) and
+		whether the host handled it well."""
+		with self._cond:
+			self.active -= 1
+			if ok:
+				self.samples.append(latency)
+				self.latency = latency if self.latency is None else \
+					(1 - self.SMOOTHING) * self.latency + self.SMOOTHING * latency
+				if self.base_latency is None or self.latency < self.base_latency:
+					self.base_latency = self.latency
+			if not ok or self.latency > self.LATENCY_FACTOR * self.base_latency:
+				self.limit = max(1.0, self.limit / 2)
+			else:
+				self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+			self._cond.notify_all()
+
+	def percentile(self, p):
+		"""Return the `p`-th quantile of recent latencies or None if there
+		are not enough samples."""
+		with self._cond:
+			if len(self.samples) < HEDGE_MIN_SAMPLES:
+				return None
+			samples = sorted(self.samples)
+		return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+
+def limiter(url):
+	"""Returns HostLimiter for the host of the given URL configured by
+	RATE_LIMITS."""
+	prefix = max((p for p in RATE_LIMITS if url.startswith(p)), key=len, default=None)
+	if prefix is None:
+		parts = urllib.parse.urlsplit(url)
+		prefix = '%s://%s/' % (parts.scheme, parts.netloc)
+	with _limiters_lock:
+		if prefix not in _limiters:
+			_limiters[prefix] = HostLimiter(**RATE_LIMITS.get(prefix, DEFAULT_RATE_LIMIT))
+		return _limiters[prefix]
+
+
+class CircuitBreaker:
+	"""Pauses requests to a host that keeps failing.
+
+	After `failures` consecutive failed requests the circuit opens and
+	all requests to the host wait for `pause` seconds. The pause doubles
+	(up to `max_pause`) each time the circuit opens again without a
+	successful request in between.
+	"""
+
+	def __init__(self, failures, pause, max_pause):
+		self.failures = failures
+		self.initial_pause = pause
+		self.max_pause = max_pause
+		self.pause = pause
+		self.consecutive_failures = 0
+		self.opened_until = 0
+		self._lock = threading.Lock()
+
+	def wait(self):
+		"""Wait while the circuit is open."""
+		while True:
+			with self._lock:
+				remaining = self.opened_until - time.monotonic()
+			if remaining <= 0:
+				return
+			time.sleep(remaining)
+
+	def success(self):
+		with self._lock:
+			self.consecutive_failures = 0
+			self.pause = self.initial_pause
+
+	def failure(self):
+		"""Account a failed request. Return False if the circuit should open
+		but the host has been paused for the longest time already."""
+		with self._lock:
+			self.consecutive_failures += 1
+			if self.consecutive_failures < self.failures:
+				return True
+			if self.pause > self.max_pause:
+				return False
+			self.opened_until = time.monotonic() + self.pause
+			logging.warning('Host keeps failing, pausing requests to it for %s s' % self.pause)
+			self.pause *= 2
+			self.consecutive_failures = 0
+		with _stats_lock:
+			_stats['circuit_opens'] += 1
+		return True
+
+
+def _breaker(url):
+	"""Returns CircuitBreaker for the host of the given URL."""
+	host = urllib.parse.urlsplit(url).netloc
+	with _limiters_lock:
+		if host not in _breakers:
+			_breakers[host] = CircuitBreaker(CIRCUIT_FAILURES, CIRCUIT_PAUSE, CIRCUIT_MAX_PAUSE)
+		return _breakers[host]
+
+
+def _retry_delay(attempt, resp):
+	"""Returns delay (in seconds) before the given retry attempt: random
+	value up to an exponentially growing bound or the delay requested
+	by the server in Retry-After header."""
+	delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+	retry_after = resp.headers.get('Retry-After', '') if resp is not None else ''
+	if retry_after.isdigit():
+		delay = max(delay, min(RETRY_MAX_DELAY, int(retry_after)))
+	return delay
+
+
+def _send(method, url, data, host_limiter, **kwargs):
+	"""Sends a single request within the limits of its host. Slow GET
+	requests are hedged if HEDGING is enabled."""
+	global _hedge_executor
+	kwargs.setdefault('timeout', request_timeout(url))
+	hedge = HEDGING and method == 'GET' and not kwargs.get('stream')
+	threshold = host_limiter.percentile(0.95) if hedge else None
+	if threshold is None:
+		return _send_limited(method, url, data, host_limiter, **kwargs)
+
+	with _session_lock:
+		if _hedge_executor is None:
+			_hedge_executor = concurrent.futures.ThreadPoolExecutor(HTTP_POOL_SIZE)
+	primary = _hedge_executor.submit(_send_limited, method, url, data, host_limiter, **kwargs)
+	try:
+		return primary.result(timeout=threshold)
+	except concurrent.futures.TimeoutError:
+		pass
+	# the duplicate request is not counted in the concurrency limit of the host
+	hedge = _hedge_executor.submit(session().request, method, url, data=data, **kwargs)
+	with _stats_lock:
+		_stats['hedged'] += 1
+	pending = {primary, hedge}
+	while True:
+		done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+		for future in done:
+			if future.exception() is None or not pending:
+				return future.result()
+
+
+def _send_limited(method, url, data, host_limiter, **kwargs):
+	"""Sends a single request and accounts it in the limiter of its host."""
+	host_limiter.acquire()
+	start = time.monotonic()
+	ok = False
+	try:
+		resp = session().request(method, url, data=data, **kwargs)
+		ok = resp.status_code < 500 and resp.status_code != 429
+		return resp
+	finally:
+		host_limiter.release(time.monotonic() - start, ok)
+
+
+def _request(url, method='GET', data=None, retry=True, **kwargs):
+	"""Sends a request through the shared session within the rate limits
+	of the host, checks its status and updates the counters.
+
+	Requests failed due to network errors or server errors (5xx, 429)
+	are retried with exponential backoff if their method is safe to
+	repeat. Requests time out according to TIMEOUTS and the run budget.
+
+	If `retry` is False, a failed request is neither retried nor counted
+	by the circuit breaker of the host, e.g. a probe the server may
+	legitimately reject.
+	"""
+	method = method.upper()
+	host_limiter = limiter(url)
+	breaker = _breaker(url)
+	attempt = 0
+	while True:
+		breaker.wait()
+		_remaining_budget()
+		resp = None
+		ok = False
+		try:
+			resp = _send(method, url, data, host_limiter, **kwargs)
+			ok = resp.status_code < 500 and resp.status_code != 429
+		except (requests.ConnectionError, requests.Timeout) as e:
+			error = e
+		if ok:
+			breaker.success()
+			break
+
+		can_continue = breaker.failure() if retry else False
+		if not can_continue or attempt >= RETRIES or method not in RETRY_METHODS:
+			with _stats_lock:
+				_stats['failures'] += 1
+			if resp is None:
+				raise error
+			break
+		delay = _retry_delay(attempt, resp)
+		remaining = _remaining_budget()
+		if remaining is not None and remaining < delay:
+			raise DeadlineExceeded('time budget of the run is exhausted before retry of %s' % url)
+		attempt += 1
+		logging.warning('Request %s %s failed (%s), retry %s in %.1f s' %
+			(method, url, resp.status_code if resp is not None else error, attempt, delay))
+		with _stats_lock:
+			_stats['retries'] += 1
+		if resp is not None:
+			# return the connection to the pool instead of holding it over the delay
+			resp.close()
+		time.sleep(delay)
+
+	if not resp.ok and kwargs.get('stream'):
+		# body of a failed streamed response is never read, release its connection
+		resp.close()
 	resp.raise_for_status()
+	with _stats_lock:
+		_stats['requests'] += 1
+	if not kwargs.get('stream'):
+		_count_bytes(resp, len(resp.content))
+	return resp
+
+
+def _count_bytes(resp, size):
+	"""Accounts bytes of a received response body of given decoded size."""
+	with _stats_lock:
+		_stats['bytes'] += resp.raw.tell() or size
+		_stats['decoded_bytes'] += size
+
+
+def cache_key(url, method='GET', data=None, url_extension=''):
+	"""Returns canonical key of a request used by the cache.
+
+	The key consists of the method, URL and form fields of the request
+	except those that only carry ASP.NET page state (see
+	IGNORED_FORM_FIELDS). Form fields are sorted, so the key does not
+	depend on their order.
+	"""
+	key = '%s %s' % (method.upper(), url)
+	if data:
+		fields = sorted((k, str(v)) for k, v in data.items() if k not in IGNORED_FORM_FIELDS)
+		key += ' ' + urllib.parse.urlencode(fields)
+	return key + url_extension
+
+
+def cache_ttl(url):
+	"""Returns time to live in seconds of cached content from the given
+	URL according to CACHE_POLICIES."""
+	global _policies
+	if _policies is None:
+		_policies = [(re.compile(pattern), ttl) for pattern, ttl in CACHE_POLICIES]
+	for pattern, ttl in _policies:
+		if pattern.search(url):
+			return ttl
+	return CACHE_DEFAULT_TTL
+
+
+def _webcache():
+	"""Returns the shared disk cache store, opens it on first use."""
+	global _cache
+	if _cache is None:
+		with _session_lock:
+			if _cache is None:
+				_cache = webcache.WebCache(
+					os.path.join(WEBCACHE_PATH, 'webcache.sqlite'), WEBCACHE_MAX_SIZE)
+	return _cache
+
+
+def _cached(key):
+	"""Returns cache Entry for the key from memory or disk cache
+	regardless of its age."""
+	entry = _memory_cache.get(key)
+	if entry is None and USE_WEBCACHE:
+		entry = _webcache().get(key)
+		if entry is not None:
+			_memory_cache.put(key, entry)
+	return entry
+
+
+def download(url, method='GET', data=None, url_extension='', binary=False, ttl=None, retry=True):
+	"""Downloads and returns content from the given URL.
+
+	Received content is cached in memory and reused for subsequent
+	requests until its time to live expires. The time to live is given
+	by CACHE_POLICIES for the URL unless `ttl` (in seconds) is specified.
+	If global variable USE_WEBCACHE is True, content is also cached on
+	disk and reused by subsequent runs. Requests are identified by
+	method, URL and form fields (see `cache_key`).
+
+	Expired content is revalidated by a conditional request using
+	validators (ETag, Last-Modified) received with it. Whether the
+	content changed is then available from `unchanged`.
+
+	In record or replay mode (see `use_archive`) responses are stored
+	into or served from the archive.
+
+	`url_extension` is appended to the cache key and may be used to
+	distinguish POST requests whose form fields are the same.
+
+	If `binary` is True, content is returned as bytes instead of text.
+	If `retry` is False, a failed request is not retried (see `_request`).
+	"""
+	key = cache_key(url, method, data, url_extension)
+	if ARCHIVE_MODE == 'replay':
+		entry = _archive.get(key)
+		if entry is None:
+			raise ReplayMiss("request `%s` is not recorded in the archive" % key)
+		content = entry.content
+	else:
+		content = _fetch(key, url, method, data, binary, ttl, retry)
+		if ARCHIVE_MODE == 'record' and key not in _recorded:
+			_archive.put(key, content)
+			_recorded.add(key)
+	return content if binary else content.decode('utf-8')
+
+
+def download_file(url, filename, chunk_size=2**16):
+	"""Downloads content from the given URL as bytes into a file with the
+	given filename and returns the filename.
 
+	The content is streamed to disk in chunks without keeping it in
+	memory, so it is appropriate for large documents. An existing file
+	is reused without any request. In record or replay mode the content
+	is stored into or served from the archive like by `download`.
+	"""
+	if os.path.exists(filename):
+		return filename
+	os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+	key = cache_key(url)
+	tmp_filename = '%s.%s.part' % (filename, threading.get_ident())
+	if ARCHIVE_MODE == 'replay':
+		entry = _archive.get(key)
+		if entry is None:
+			raise ReplayMiss("request `%s` is not recorded in the archive" % key)
+		with open(tmp_filename, 'wb') as f:
+			f.write(entry.content)
+	else:
+		resp = _request(url, stream=True)
+		size = 0
+		try:
+			with open(tmp_filename, 'wb') as f:
+				for chunk in resp.iter_content(chunk_size):
+					f.write(chunk)
+					size += len(chunk)
+		except BaseException:
+			os.remove(tmp_filename)
+			raise
+		finally:
+			resp.close()
+		_count_bytes(resp, size)
+		if ARCHIVE_MODE == 'record' and key not in _recorded:
+			with open(tmp_filename, 'rb') as f:
+				_archive.put(key, f.read())
+			_recorded.add(key)
+	os.replace(tmp_filename, filename)
+	return filename
+
+
+def _fetch(key, url, method, data, binary, ttl, retry=True):
+	"""Returns content for the request as bytes from cache or network,
+	see `download`. Text content is encoded in UTF-8."""
+	ttl = cache_ttl(url) if ttl is None else ttl
+	entry = _cached(key)
+	if entry is not None and time.time() - entry.fetched_at <= ttl:
+		# content cached by a previous run has not changed since then
+		if entry.fetched_at < _run_started:
+			_unchanged.setdefault(key, True)
+		return entry.content
+
+	headers = {}
+	if entry is not None:
+		if entry.etag:
+			headers['If-None-Match'] = entry.etag
+		if entry.last_modified:
+			headers['If-Modified-Since'] = entry.last_modified
+	resp = _request(url, method, data, retry, headers=headers)
+
+	if resp.status_code == 304 and entry is not None:
+		entry = entry._replace(fetched_at=time.time())
+		if USE_WEBCACHE:
+			_webcache().touch(key)
+		_unchanged[key] = True
+	else:
+		content = resp.content if binary else resp.text.encode('utf-8')
+		etag = resp.headers.get('ETag')
+		last_modified = resp.headers.get('Last-Modified')
+		# servers ignoring conditional requests are detected by content fingerprint
+		_unchanged[key] = entry is not None and entry.hash == webcache.fingerprint(content)
+		if USE_WEBCACHE:
+			entry = _webcache().put(key, content, etag, last_modified)
+		else:
+			entry = webcache.Entry(content, time.time(), webcache.fingerprint(content), etag, last_modified)
+	_memory_cache.put(key, entry)
+	return entry.content
+
+
+def fingerprint(url, expected_size=None, ttl=None):
+	"""Returns tuple of fingerprint (SHA-256 hash) and size of content at
+	the given URL without keeping the content, e.g. to recognize a known
+	image.
+
+	If `expected_size` is given and the server reports another size of
+	the content by a HEAD (or single byte range) request, the content is
+	not downloaded at all and None is returned as the hash, as the
+	content cannot be the expected one. The same holds for content
+	missing on the server (e.g. 404), its size is None.
+
+	Fingerprints are kept by URL (on disk if USE_WEBCACHE is True) and
+	revalidated by a HEAD request after their time to live expires (see
+	`download`), the content is downloaded again only if it changed.
+	"""
+	if ARCHIVE_MODE:
+		content = download(url, binary=True)
+		return webcache.fingerprint(content), len(content)
+
+	ttl = cache_ttl(url) if ttl is None else ttl
+	stored = _fingerprints.get(url)
+	if stored is None and USE_WEBCACHE:
+		stored = _webcache().get_fingerprint(url)
+
+	def sufficient(fp):
+		return fp.hash is not None or expected_size is not None and fp.size != expected_size
+
+	if stored is not None and sufficient(stored) and time.time() - stored.checked_at <= ttl:
+		return stored.hash, stored.size
+
+	probe = _probe(url)
+	size, etag, last_modified = probe or (None, None, None)
+	if probe is None:
+		result = webcache.Fingerprint(None, None, None, None, time.time())
+	elif stored is not None and sufficient(stored) and size == stored.size and \
+			(etag and etag == stored.etag or last_modified and last_modified == stored.last_modified):
+		result = stored._replace(checked_at=time.time())
+	elif expected_size is not None and size is not None and size != expected_size:
+		result = webcache.Fingerprint(None, size, etag, last_modified, time.time())
+	else:
+		resp = _request(url)
+		result = webcache.Fingerprint(webcache.fingerprint(resp.content), len(resp.content),
+			resp.headers.get('ETag'), resp.headers.get('Last-Modified'), time.time())
+
+	_fingerprints[url] = result
 	if USE_WEBCACHE:
-		if not os.path.exists(WEBCACHE_PATH):
-			os.makedirs(WEBCACHE_PATH)
-		with open(pathname, 'w', encoding='utf-8', newline='') as f:
-			f.write(resp.text)
+		_webcache().put_fingerprint(url, result)
+	return result.hash, result.size
+
+
+def _probe(url):
+	"""Returns size of content at the URL (or None if unknown) and its
+	validators (ETag, Last-Modified) without downloading the content, or
+	None if there is no content at the URL."""
+	try:
+		resp = _request(url, 'HEAD')
+		length = resp.headers.get('Content-Length')
+	except requests.HTTPError:
+		resp, length = None, None
+	if length is None:
+		# the server does not support HEAD requests, ask for the first byte only
+		try:
+			resp = _request(url, headers={'Range': 'bytes=0-0'}, stream=True)
+		except requests.HTTPError:
+			return None
+		resp.close()
+		match = re.search(r'/(\d+)$', resp.headers.get('Content-Range', ''))
+		length = match.group(1) if match else resp.headers.get('Content-Length') if resp.status_code == 200 else None
+	return int(length) if length is not None else None, resp.headers.get('ETag'), resp.headers.get('Last-Modified')
+
+
+def unchanged(url, method='GET', data=None, url_extension=''):
+	"""Returns True if content of the request downloaded in this run is
+	the same as the content cached by a previous run, i.e. it was not
+	changed on the server since then. Requires USE_WEBCACHE to recognize
+	content of previous runs.
+
+	Callers may use it to skip processing of pages that did not change.
+	"""
+	return _unchanged.get(cache_key(url, method, data, url_extension), False)
+
+
+def processed(url, method='GET', data=None, url_extension=''):
+	"""Returns True if content of the request downloaded in this run was
+	already processed by a previous run, i.e. `mark_processed` was called
+	for the same content. Requires USE_WEBCACHE.
+
+	Unlike `unchanged`, a page is not considered processed if a previous
+	run downloaded it but failed before its processing finished.
+	"""
+	if not USE_WEBCACHE:
+		return False
+	key = cache_key(url, method, data, url_extension)
+	entry = _cached(key)
+	return entry is not None and _webcache().get_processed(key) == entry.hash
+
+
+def mark_processed(url, method='GET', data=None, url_extension=''):
+	"""Records that the content of the request downloaded in this run was
+	processed successfully (e.g. saved into the API)."""
+	if not USE_WEBCACHE:
+		return
+	key = cache_key(url, method, data, url_extension)
+	entry = _cached(key)
+	if entry is not None:
+		_webcache().put_processed(key, entry.hash)
+
+
+async def download_async(url, method='GET', data=None, url_extension='', binary=False, semaphore=None):
+	"""Coroutine variant of `download` with the same arguments and
+	cache semantics. If `semaphore` is given, the download waits for it
+	to bound the number of concurrent requests."""
+	loop = asyncio.get_running_loop()
+	call = functools.partial(download, url, method, data, url_extension, binary)
+	if semaphore is None:
+		return await loop.run_in_executor(None, call)
+	async with semaphore:
+		return await loop.run_in_executor(None, call)
+
+
+async def _gather(func, args_list, concurrency):
+	"""Runs `func` for all arguments in `args_list` in worker threads,
+	at most `concurrency` at once, and returns their results in order."""
+	loop = asyncio.get_running_loop()
+	semaphore = asyncio.Semaphore(concurrency)
+
+	async def run(args):
+		async with semaphore:
+			return await loop.run_in_executor(executor, functools.partial(func, *args))
+
+	with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+		return await asyncio.gather(*(run(args) for args in args_list))
+
+
+def map_concurrent(func, args_list, concurrency=None):
+	"""Calls `func(*args)` for each tuple of arguments in `args_list`
+	concurrently and returns the list of results in the same order.
+
+	Appropriate for independent downloads and parsing of pages, e.g.
+	`map_concurrent(parse.motion, [(id,) for id in ids])`. At most
+	`concurrency` calls (default: global CONCURRENCY) run at once.
+	"""
+	args_list = [tuple(args) for args in args_list]
+	if not args_list:
+		return []
+	return asyncio.run(_gather(func, args_list, concurrency or CONCURRENCY))
+
+
+def iter_concurrent(func, args_list, concurrency=None, chunk_size=None):
+	"""Generator variant of `map_concurrent` that yields results in
+	order while processing arguments in chunks (default: four times the
+	concurrency), so that only a chunk of results is kept in memory."""
+	concurrency = concurrency or CONCURRENCY
+	chunk_size = chunk_size or 4 * concurrency
+	args_list = list(args_list)
+	for i in range(0, len(args_list), chunk_size):
+		yield from map_concurrent(func, args_list[i:i+chunk_size], concurrency)
+
+
+def iter_parallel(func, args_list, processes=None, ahead=None):
+	"""Generator variant of `iter_concurrent` for CPU bound work, e.g.
+	segmentation of many transcripts, that calls `func(*args)` in a pool
+	of processes (default: one per core) and yields results in order.
+	Arguments are consumed lazily at most `ahead` calls (default: four
+	times the number of processes) before the yielded result. `func`,
+	its arguments and results must be picklable."""
+	processes = processes or os.cpu_count() or 1
+	ahead = ahead or 4 * processes
+	with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+		pending = collections.deque()
+		for args in args_list:
+			pending.append(executor.submit(func, *args))
+			if len(pending) >= ahead:
+				yield pending.popleft().result()
+		while pending:
+			yield pending.popleft().result()
 
-	return resp.text
+
+def prefetch(iterable, size=1):
+	"""Generator of items of `iterable` that are produced by a background
+	thread at most `size` items ahead of the consumer, e.g. to download
+	further pages of a list while items of the current page are being
+	processed. Exceptions of the iterable are raised to the consumer."""
+	items = queue.Queue(size)
+	stopped = threading.Event()
+	end = object()
+
+	def put(item, error=None):
+		"""Waits for space in the queue, returns False if the consumer
+		has stopped meanwhile."""
+		while not stopped.is_set():
+			try:
+				items.put((item, error), timeout=0.1)
+				return True
+			except queue.Full:
+				pass
+		return False
+
+	def produce():
+		try:
+			for item in iterable:
+				if not put(item):
+					return
+			put(end)
+		except BaseException as e:
+			put(end, e)
+
+	thread = threading.Thread(target=produce, daemon=True)
+	thread.start()
+	try:
+		while True:
+			item, error = items.get()
+			if item is end:
+				if error is not None:
+					raise error
+				return
+			yield item
+	finally:
+		stopped.set()
+
+
+async def _download_all(requests_list, concurrency):
+	semaphore = asyncio.Semaphore(concurrency)
+	return await asyncio.gather(*(download_async(semaphore=semaphore, **request) for request in requests_list))
+
+
+def download_all(requests_list, concurrency=None):
+	"""Downloads many URLs concurrently and returns their contents in
+	order. Each item of `requests_list` is either a URL or a dictionary
+	of `download` keyword arguments, e.g. for a form POST
+	`{'url': url, 'method': 'POST', 'data': data, 'url_extension': ext}`.
+	"""
+	requests_list = [{'url': r} if isinstance(r, str) else r for r in requests_list]
+	if not requests_list:
+		return []
+	return asyncio.run(_download_all(requests_list, concurrency or CONCURRENCY))
+
+
+def memoize(func):
+	"""Decorator that caches results of `func` by its arguments for the
+	rest of the run, so that a page is parsed at most once even if the
+	function is called from several places or threads at once.
+
+	Results are returned as deep copies that callers may modify.
+	Exceptions are not cached. A cached result is dropped by
+	`func.invalidate(*args, **kwargs)`, all of them by `func.cache_clear()`
+	and results of all memoized functions by `clear_memoized()`.
+	"""
+	signature = inspect.signature(func)
+	results = {}
+	locks = {}
+	lock = threading.Lock()
+
+	def make_key(args, kwargs):
+		bound = signature.bind(*args, **kwargs)
+		bound.apply_defaults()
+		return tuple(bound.arguments.items())
+
+	@functools.wraps(func)
+	def wrapper(*args, **kwargs):
+		key = make_key(args, kwargs)
+		with lock:
+			key_lock = locks.setdefault(key, threading.Lock())
+		with key_lock:
+			if key not in results:
+				results[key] = func(*args, **kwargs)
+			return copy.deepcopy(results[key])
+
+	def invalidate(*args, **kwargs):
+		results.pop(make_key(args, kwargs), None)
+
+	def cache_clear():
+		results.clear()
+
+	wrapper.invalidate = invalidate
+	wrapper.cache_clear = cache_clear
+	_memoized.append(wrapper)
+	return wrapper
+
+
+def clear_memoized():
+	"""Drops results cached by all memoized functions."""
+	for func in _memoized:
+		func.cache_clear()
+
+
+def register_store(store):
+	"""Registers an open WebCache of another module, so that
+	`clear_cache` clears it in place instead of deleting its files that
+	are in use."""
+	_stores.add(store)
 
 
 def clear_cache():
-	"""Clears the cache directory."""
-	shutil.rmtree(WEBCACHE_PATH + '/', ignore_errors=True)
+	"""Clears the cache."""
+	clear_memoized()
+	_memory_cache.clear()
+	_fingerprints.clear()
+	# files of open stores are cleared in place
+	in_use = []
+	for store in [_webcache()] + list(_stores):
+		store.clear()
+		in_use.append(os.path.basename(store.path))
+	for name in os.listdir(WEBCACHE_PATH):
+		if not name.startswith(tuple(in_use)):
+			pathname = os.path.join(WEBCACHE_PATH, name)
+			if os.path.isdir(pathname):
+				shutil.rmtree(pathname, ignore_errors=True)
+			else:
+				os.remove(pathname)
+
+
+_WHITESPACE_RUN = re.compile(r'\s{2,}')
+
+
+def _normalize_text(text):
+	"""Returns the text normalized as described in `plaintext`."""
+	# most strings contain neither entities nor non-breakable spaces
+	if '&' in text:
+		text = html.unescape(text)
+	if '\xa0' in text:
+		text = text.replace('\xa0', ' ')
+	return _WHITESPACE_RUN.sub(' ', text.strip())
+
+
+# short strings (names, clubs, links) recur on many pages, so their
+# normalized forms are cached
+_normalize_short_text = functools.lru_cache(maxsize=2**14)(_normalize_text)
+
+
+def _plaintext_str(text):
+	if len(text) <= 256:
+		return _normalize_short_text(text)
+	return _normalize_text(text)
 
 
 def plaintext(obj, skip=None):
 	"""Checks all fields of `obj` structure and converts HTML entities
 	to the respective characters, strips leading and trailing
-	whitespace and turns non-breakable spaces to normal ones.
+	whitespace, turns non-breakable spaces to normal ones and collapses
+	runs of whitespace to a single space.
 
 	If `obj` is a dictionary, a list of keys to skip may be passed
-	in the `skip` argument.
+	in the `skip` argument. Lists and dictionaries are updated in place.
 	"""
 	if isinstance(obj, str):
-		obj = html.unescape(obj).replace('\xa0', ' ').strip()
-		obj = re.sub(r'\s{2,}', ' ', obj)
-	elif isinstance(obj, list):
-		for i, v in enumerate(obj):
-			obj[i] = plaintext(v)
-	elif isinstance(obj, dict):
-		for k, v in obj.items():
-			if isinstance(skip, (tuple, list)) and k in skip: continue
-			obj[k] = plaintext(v)
+		return _plaintext_str(obj)
+	if isinstance(obj, dict) and isinstance(skip, (tuple, list)):
+		items = [(k, v) for k, v in obj.items() if k not in skip]
+	elif isinstance(obj, (list, dict)):
+		items = None
+	else:
+		return obj
+
+	# walk the structure iteratively to avoid a call per field
+	stack = [(obj, items)]
+	while stack:
+		container, items = stack.pop()
+		if items is None:
+			items = enumerate(container) if isinstance(container, list) else container.items()
+		for k, v in items:
+			if isinstance(v, str):
+				container[k] = _plaintext_str(v)
+			elif isinstance(v, (list, dict)):
+				stack.append((v, None))
 	return obj
 
 
+@functools.lru_cache(maxsize=None)
+def _hyphen_pattern(eol, lowers):
+	return re.compile(r'([%s])-%s([%s])' % (lowers, eol, lowers))
+
+
 def clear_hyphens(text, eol=''):
 	"""Clear hyphen characters from the text.
 	The hyphen is removed only if followed by the given end-of-line
 	mark (default: empty)."""
-	pattern = r'([%s])-%s([%s])' % (CS_LOWERS, eol, CS_LOWERS)
-	result = re.sub(pattern, r'\1\2', text)
-	return result
+	if '-' not in text:
+		return text
+	return _hyphen_pattern(eol, CS_LOWERS).sub(r'\1\2', text)
+
+
+# formats of dates used by the website: `12. 9. 1995`, `3. februára 2010`,
+# `18.4.2016 13:05:20` or `2. 7. 2013 9:00`
+_SK_DATE = re.compile(r'(\d{1,2})\.(?:(\d{1,2})\.|\s+(?:(\d{1,2})\.|([^\W\d]+))\s+)(\d{4})(?:\s+(\d{1,2}):(\d{2})(?::(\d{2}))?)?')
+_SK_MONTH = re.compile(SK_MONTHS_REGEX, re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=2**12)
+def _utc_offset(year, month, day, hour):
+	"""Returns offset of the local time from UTC at the given hour; offset
+	changes at whole hours only."""
+	return pytz.timezone(TIMEZONE).localize(datetime.datetime(year, month, day, hour)).utcoffset()
+
+
+@functools.lru_cache(maxsize=2**14)
+def parse_sk_date(dt_str):
+	"""Converts Slovak date(-time) string in one of the formats used by
+	the website into ISO format, date-times into UTC time. Returns None
+	for strings in other formats or with invalid values, so that the
+	caller may use a generic parser."""
+	match = _SK_DATE.fullmatch(dt_str.strip())
+	if not match:
+		return None
+	day, month, spaced_month, month_name, year, hour, minute, second = match.groups()
+	month = month or spaced_month
+	if month_name:
+		name = _SK_MONTH.match(month_name)
+		if not name or name.end() < len(month_name):
+			return None
+		month = SK_MONTHS[month_name[:3].lower()]
+	try:
+		dt = datetime.datetime(int(year), int(month), int(day),
+			int(hour or 0), int(minute or 0), int(second or 0))
+	except ValueError:
+		return None
+	if hour is None:
+		return dt.strftime('%Y-%m-%d')
+	dt -= _utc_offset(dt.year, dt.month, dt.day, dt.hour)
+	return dt.strftime('%Y-%m-%dT%H:%M:%S')
@@ -0,0 +1,400 @@
+"""
+    Segmentation of debate transcripts into records of speeches, scenes,
+    sitting headers and timestamps free of side effects, so that debates
+    may be segmented in parallel processes and events and people are
+    resolved afterwards
+"""
+
+import re
+from collections import namedtuple
+
+import scrapeutils
+
+# speech of a speaker; speaker_id is None if the speaker lookup did not
+# find the (name corrected) speaker_name
+Speech = namedtuple('Speech', 'type text speaker_id speaker_name attribution date')
+# scene (applause, interruption, etc.) between speeches
+Scene = namedtuple('Scene', 'text date')
+# header of a transcript starting a new sitting of the given session
+# (number of the session is None for a solemn session)
+Header = namedtuple('Header', 'date sk_date session_number')
+# date(-time) stamp in a transcript
+Timestamp = namedtuple('Timestamp', 'date')
+# end of the sitting at the time announced in the last speech
+End = namedtuple('End', 'date')
+
+# old transcripts use different format of speech start since this date
+NEW_SPEECH_START_DATE = '2001-09-04'
+
+_FINAL_TIME = re.compile(r'\b(skončil.|skončené|prerušené|Prerušenie rokovani[ae])\s+o\s+(.*?)\s+hodine.')
+_BRACKETS = re.compile(r'\[(.*?)\]')
+_SLASH_PAIRS = re.compile(r'(^|\s)/(.*?)/(\s|$)')
+_PARENTHESES = re.compile(r'[()]')
+_HEADER = re.compile(r'((\(?(\d+)\.\)?\s+schôdz)|slávnostn).*?(\d+)\..*\b(\w{3,})\s+(\d{4})(.*?)_{3,}$', re.DOTALL)
+_INITIAL_TIME = re.compile(r'\s+o\s+(.*?)\s+hodine', re.DOTALL)
+# format `Foreign minister J. Doe:`
+_OLD_SPEECH_START = re.compile(r'(.*?)\b([^\W\d])\.[\s_]+((\w)\.[\s_]+)?([\w-]+):$', re.DOTALL)
+# format `J. Doe, foreign minister: speech`
+_SPEECH_START = re.compile(r'([^\W\d])\.[\s_]+((\w)\.[\s_]+)?([\w-]+),\s+(.+?):(.+)$', re.DOTALL)
+_DATESTAMP = re.compile(r'^\s*(\d+\.\s\w+\s\d{4})(.*hodine)?\s*$')
+# scene within a paragraph, e.g. `(Potlesk.)`
+_SCENE = re.compile(r'\(\s*([\d%s][^\(\)]{2,}[\.?!“])\s*\)' % scrapeutils.CS_UPPERS)
+
+_SPEECH_NUMBER = re.compile(r'^(\d+)\.$')
+# format `Doe, John, foreign minister`
+_SPEAKER_HEADING = re.compile(r'(\w+), (\w+\.?)( (\w+\.?))?, (.*)', re.DOTALL)
+
+
+def _normalized_parentheses(par):
+    """Convert all inner nested parentheses to brackets like the original
+    repeated substitution of `\\((.*?)\\((.*?)\\)(.*?)\\)` does.
+
+    Passes of the substitution are replayed on positions of the remaining
+    parentheses only: from the first opening parenthesis, the next opening
+    one and the first closing one after it become brackets, provided that
+    another closing parenthesis follows, and the pass continues after it.
+    Passes are repeated until nothing is converted.
+    """
+    if par.count('(') < 2:
+        return par
+    parens = [m.start() for m in _PARENTHESES.finditer(par)]
+    converted = []
+    while True:
+        kept = []
+        n = len(parens)
+        i = 0
+        while True:
+            a = i
+            while a < n and par[parens[a]] != '(':
+                a += 1
+            b = a + 1
+            while b < n and par[parens[b]] != '(':
+                b += 1
+            c = b + 1
+            while c < n and par[parens[c]] != ')':
+                c += 1
+            d = c + 1
+            while d < n and par[parens[d]] != ')':
+                d += 1
+            if d >= n:
+                break
+            kept.extend(parens[i:b])
+            kept.extend(parens[b + 1:c])
+            kept.extend(parens[c + 1:d + 1])
+            converted.append(parens[b])
+            converted.append(parens[c])
+            i = d + 1
+        if i == 0:
+            break
+        kept.extend(parens[i:])
+        parens = kept
+    if not converted:
+        return par
+    chars = list(par)
+    for pos in converted:
+        chars[pos] = '[' if par[pos] == '(' else ']'
+    return ''.join(chars)
+
+
+def _classified(par, old_format):
+    """Return kind of a paragraph of an old transcript ('header', 'speech'
+    or 'datestamp') and the match of its pattern, or None and None for
+    a plain paragraph. Patterns are tried only for paragraphs starting
+    or ending with the characters they require."""
+    if par.endswith('___'):
+        hd = _HEADER.search(par)
+        if hd:
+            return 'header', hd
+    if old_format:
+        sp = par.endswith(':') and _OLD_SPEECH_START.match(par)
+    else:
+        sp = par[1:2] == '.' and _SPEECH_START.match(par)
+    if sp:
+        return 'speech', sp
+    ds = _datestamp(par)
+    if ds:
+        return 'datestamp', ds
+    return None, None
+
+
+def _datestamp(par):
+    """Return match of a date(-time) stamp paragraph or None."""
+    if par.lstrip()[:1].isdigit():
+        return _DATESTAMP.match(par)
+    return None
+
+
+def _split_scenes(par):
+    """Return text parts of a paragraph and texts of the scenes among
+    them as a list of (is_scene, text) pairs."""
+    if '(' not in par:
+        return [(False, par)]
+    result = []
+    pos = 0
+    for scene in _SCENE.finditer(par):
+        result.append((False, par[pos:scene.start()]))
+        result.append((True, scene.group(1)))
+        pos = scene.end()
+    result.append((False, par[pos:]))
+    return result
+
+
+def _join_header(paragraphs, term):
+    """Return paragraphs of an old transcript with the header joined into
+    the first paragraph ending by underscores."""
+    if term == '2':
+        # join first 4 paragraphs and add trailing underscores to mark the header
+        return ['%s %s %s %s\n___' % tuple(paragraphs[:4])] + paragraphs[4:]
+    if term in ('3', '4'):
+        # join first paragraphs until " hodine" ending is found
+        # and add trailing underscores to mark the header
+        paragraphs = list(paragraphs)
+        p = ''
+        while True:
+            p += ' ' + paragraphs.pop(0)
+            if p.endswith('hodine'): break
+        if paragraphs[0].startswith('___'):
+            paragraphs.pop(0)
+        return [p + '\n___'] + paragraphs
+    return paragraphs
+
+
+def segment_old_debate(paragraphs, term, speakers, to_utc, name_corrections=None):
+    """Return list of records of a debate transcript of terms 1-4 given
+    by its paragraphs.
+
+    `speakers` is a lookup of speaker id by name in format `J. Doe` (or
+    `J. R. Doe`), `to_utc` converts a Slovak date(-time) string into ISO
+    format in UTC and `name_corrections` maps misspelled names to the
+    right ones. All arguments must be picklable to segment debates in
+    a process pool.
+    """
+    name_corrections = name_corrections or {}
+    records = []
+    # HTML paragraphs of the current speech or scene
+    parts = []
+    date = ''
+    speaker_id = speaker_name = attribution = None
+    last_speech = None
+
+    def flush(type):
+        nonlocal last_speech
+        if not parts: return
+        text = ''.join(parts).strip().replace('[', '(').replace(']', ')')
+        if type == 'scene':
+            records.append(Scene(text, date))
+        else:
+            records.append(Speech(type, text, speaker_id, speaker_name, attribution and attribution.strip(), date))
+        last_speech = text
+        parts.clear()
+
+    within_scene = False
+    for par in _join_header(paragraphs, term):
+        par = par.replace('\n', ' ').strip()
+        if not par: continue
+
+        # fix last scene
+        if 'hodine' in par and _FINAL_TIME.search(par):
+            if not par[0] in ('(', '[', '/'):
+                par = '(%s)' % par
+
+        # convert brackets to parentheses
+        par = _BRACKETS.sub(r'(\1)', par)
+        # slash pairs are converted to parentheses too in term 1
+        if term == '1':
+            par = _SLASH_PAIRS.sub(r'\1(\2)\3', par)
+        par = _normalized_parentheses(par)
+
+        # process eventual multiparagraph scene
+        if par.startswith('(') and par.count('(') > par.count(')'):
+            # save eventual previous speech
+            flush('speech')
+
+            parts.append('<p>%s</p>' % par[1:])
+            within_scene = True
+            continue
+        if within_scene:
+            if par.endswith(')') and par.count(')') > par.count('('):
+                parts.append('\n\n<p>%s</p>' % par[:-1])
+                flush('scene')
+                within_scene = False
+            else:
+                parts.append('\n\n<p>%s</p>' % par)
+            continue
+
+        old_format = date < NEW_SPEECH_START_DATE
+        kind, match = _classified(par, old_format)
+
+        # process eventual header
+        if kind == 'header':
+            hd = match
+            # save eventual previous speech
+            flush('speech')
+
+            sk_date = '%s. %s %s' % (hd.group(4), hd.group(5), hd.group(6))
+            initial_time = _INITIAL_TIME.search(hd.group(7))
+            if initial_time and initial_time.group(1) != '??':
+                h, m = initial_time.group(1).strip('.').split('.')
+                date = to_utc(sk_date + ' %s:%s:00' % (h.strip().zfill(2), m.strip().zfill(2)))
+            else:
+                date = to_utc(sk_date) + 'T00:00:00'
+            session_number = None if hd.group(1).startswith('sláv') else hd.group(3)
+            records.append(Header(date, sk_date, session_number))
+            continue
+
+        # process eventual start of a speech
+        if kind == 'speech':
+            sp = match
+            # save eventual previous speech
+            flush('speech')
+
+            # identify speaker
+            if old_format:
+                name = '%s. %s' % (sp.group(2), sp.group(5))
+                if (sp.group(4)):
+                    name = name.replace(' ', ' %s. ' % sp.group(4))
+                attribution = sp.group(1)
+                par = ''
+            else:
+                name = '%s. %s' % (sp.group(1), sp.group(4))
+                if (sp.group(3)):
+                    name = name.replace(' ', ' %s. ' % sp.group(3))
+                attribution = sp.group(5)
+                par = sp.group(6)
+
+            speaker_name = name_corrections.get(name, name)
+            attribution = attribution[0].lower() + attribution[1:].strip()
+            speaker_id = speakers(speaker_name)
+            # the rest of the speech start paragraph may be a date(-time) stamp
+            kind, match = ('datestamp', _datestamp(par)) if par else (None, None)
+
+        # recognize date(-time) stamps in transcripts
+        ds = match if kind == 'datestamp' else None
+        if ds:
+            dt = ds.group(1).strip()
+            tm = re.search(r'o\s+(.*?)\s+', ds.group(2) or '')
+            try:
+                if tm:
+                    h, m = tm.group(1).strip('.').split('.')
+                    date = to_utc('%s %s:%s:00' % (dt, h.strip().zfill(2), m.strip().zfill(2)))
+                else:
+                    date = to_utc(dt) + 'T00:00:00'
+                records.append(Timestamp(date))
+                continue
+            except ValueError:
+                pass
+
+        # process eventual scenes in this paragraph
+        for is_scene, part in _split_scenes(par):
+            if is_scene:
+                flush('speech')
+                parts.append('<p>%s</p>' % part.strip())
+                flush('scene')
+            elif part:
+                parts.append('\n\n<p>%s</p>' % part.strip())
+
+    flush('speech')
+
+    # extract end time of the sitting
+    final_time = _FINAL_TIME.search(last_speech) if last_speech else None
+    if final_time:
+        tm = final_time.group(2)
+        tm = tm.replace('O', '0').replace(',', '.')
+        h, m = tm.strip('.').split('.')
+        final_date = '%s.%s.%s %s:%s:00' % (date[8:10], date[5:7], date[0:4], h.strip().zfill(2), m.strip().zfill(2))
+        records.append(End(to_utc(final_date)))
+
+    return records
+
+
+def segment_debate_part(lines, kind, speakers, name_corrections=None):
+    """Return list of Speech and Scene records of a debate part of terms
+    5+ given by its TranscriptLine records (see
+    `parse.debate_lines_of_terms56`). Speeches have type `kind` of the
+    debate part and no date.
+
+    `speakers` is a lookup of speaker id by full name and
+    `name_corrections` maps misspelled names to the right ones.
+
+    The speaker is matched on the heading of a line only, text after the
+    heading is dropped like by the original scraper. Scenes are matched
+    on text of lines without markup, so a scene starting by an emphasized
+    parenthesis (`<em>(Hlasy z pléna.`) spans the following lines until
+    the closing one like a scene without markup does, while the original
+    scraper took it for speech text.
+    """
+    name_corrections = name_corrections or {}
+    records = []
+    # HTML paragraphs of the current speech or scene
+    parts = []
+    speaker_id = speaker_name = attribution = None
+
+    def flush(type):
+        if not parts: return
+        text = ''.join(parts).strip().replace('[', '(').replace(']', ')')
+        if type == 'scene':
+            records.append(Scene(text, None))
+        else:
+            records.append(Speech(type, text, speaker_id, speaker_name, attribution and attribution.strip(), None))
+        parts.clear()
+
+    within_scene = False
+    for par, heading in lines:
+        if not par: continue
+        par = par.replace('\n', ' ').strip()
+
+        # skip eventual speech number
+        if _SPEECH_NUMBER.match(par): continue
+
+        # convert brackets to parentheses
+        par = _BRACKETS.sub(r'(\1)', par)
+        par = _normalized_parentheses(par)
+
+        # process eventual multiparagraph scene
+        if par.startswith('(') and par.count('(') > par.count(')'):
+            # save eventual previous speech
+            flush(kind)
+
+            parts.append('<p>%s</p>' % par[1:])
+            within_scene = True
+            continue
+        if within_scene:
+            if par.endswith(')') and par.count(')') > par.count('('):
+                parts.append('\n\n<p>%s</p>' % par[:-1])
+                flush('scene')
+                within_scene = False
+            else:
+                parts.append('\n\n<p>%s</p>' % par)
+            continue
+
+        # process eventual new speaker
+        sp = heading and _SPEAKER_HEADING.match(_normalized_parentheses(
+            _BRACKETS.sub(r'(\1)', heading.replace('\n', ' ').strip())))
+        if sp:
+            # save eventual previous speech
+            flush(kind)
+
+            # identify speaker
+            name = '%s %s' % (sp.group(2), sp.group(1))
+            if (sp.group(4)):
+                name = name.replace(' ', ' %s ' % sp.group(4))
+            attribution = sp.group(5)
+            name = name_corrections.get(name, name)
+            if len(name) == 0: continue
+            speaker_name = name
+            speaker_id = speakers(name)
+            continue
+
+        # process eventual scenes in this paragraph
+        split = _split_scenes(par)
+        for i, (is_scene, part) in enumerate(split):
+            if is_scene:
+                flush(kind)
+                parts.append('<p>%s</p>' % part.strip())
+                flush('scene')
+            elif part:
+                # the text after the last scene is not stripped as in the original scraper
+                parts.append('\n\n<p>%s</p>' % (part if i == len(split) - 1 else part.strip()))
+
+    flush(kind)
+    return records
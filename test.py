@@ -1,10 +1,19 @@
 #!/usr/bin/env python3
 
 import os
+import re
 import json
+import random
+import tempfile
 import unittest
+import contextlib
+
+import lxml.html
+import dateutil.parser
+import pytz
 
 import parse
+import segmentation
 import scrapeutils
 
 BASE_DIR = os.path.dirname(__file__)
@@ -17,6 +26,22 @@ def load_samples(filename):
         return json.load(f)
 
 
+@contextlib.contextmanager
+def replayed(pages):
+    """Serve the given pages (URL -> HTML) by `scrapeutils.download`
+    from a temporary archive in replay mode, the previous archive mode is
+    restored afterwards."""
+    saved = scrapeutils.ARCHIVE_MODE, scrapeutils.ARCHIVE_PATH
+    with tempfile.TemporaryDirectory() as tmpdir:
+        scrapeutils.use_archive('replay', os.path.join(tmpdir, 'archive.sqlite'))
+        try:
+            for url, content in pages.items():
+                scrapeutils._archive.put(scrapeutils.cache_key(url), content.encode('utf-8'))
+            yield
+        finally:
+            scrapeutils.use_archive(*saved)
+
+
 class MaxDiffTestCase(unittest.TestCase):
     maxDiff = None
 
@@ -196,15 +221,234 @@ class ParseDebateOfTerms56(MaxDiffTestCase):
             result['riadky'] = [result['riadky'][sample['line_index']]]
             self.assertEqual(result, sample['expected'])
 
+    def test_sample_debate_lines(self):
+        """parse.debate_lines_of_terms56 should give text of lines of parse.debate_of_terms56 on sample debates"""
+        for sample in load_samples('debate_of_terms_56'):
+            line = parse.debate_lines_of_terms56(sample['id'])['riadky'][sample['line_index']]
+            self.assertEqual(line, (lxml.html.fromstring(sample['expected']['riadky'][0]).text_content(), None))
+
     def test_nonexistent_debate(self):
         """parse.debates_of_terms56 should return empty result for debate that does not exist"""
         result = parse.debate_of_terms56('1')
         self.assertEqual(result, {'riadky': []})
 
 
+class TranscriptLines(MaxDiffTestCase):
+    PAGE = """<html><body><div>
+        <p><strong>Dzurinda, Mikuláš, predseda vlády SR</strong><br>
+        Vážený pán predseda, &nbsp;dámy a&nbsp;páni, <em>ďakujem</em> (Potlesk.)<br>
+        1.<br>
+        (Hlasy  z&nbsp;pléna.<br>
+        <span>Pokračovanie</span> hlasov.)<br>
+        <a href="x">Odkaz</a> na koniec<br></p>
+        <p><!-- poznámka -->Text po poznámke<br>
+        <strong>Text</strong> tučný na začiatku<br>
+        (Hymna Slovenskej republiky.)</p>
+        </div></body></html>"""
+
+    @staticmethod
+    def heading(line):
+        heading = re.match(r'<strong>(.*?)</strong>', line)
+        return scrapeutils.plaintext(lxml.html.fromstring(heading.group(1)).text_content()) if heading else None
+
+    def test_lines(self):
+        """parse.debate_lines_of_terms56 should give the lines of parse.debate_of_terms56 without markup"""
+        with replayed({'http://tv.nrsr.sk/transcript?id=1': self.PAGE}):
+            lines = parse.debate_of_terms56('1')['riadky']
+            records = parse.debate_lines_of_terms56('1')['riadky']
+        self.assertEqual(records, [
+            (scrapeutils.plaintext(lxml.html.fromstring(line).text_content()) if line else '', self.heading(line))
+            for line in lines])
+        self.assertEqual(records[0], ('Dzurinda, Mikuláš, predseda vlády SR', 'Dzurinda, Mikuláš, predseda vlády SR'))
+        self.assertEqual(records[1], ('Vážený pán predseda, dámy a páni, ďakujem (Potlesk.)', None))
+        self.assertEqual(records[7], ('Text tučný na začiatku', 'Text'))
+
+
 # no tests for scraping of old debates as they are no more scraped after initial load
 
 
+class Segmentation(MaxDiffTestCase):
+    DATES = {
+        '12. októbra 2006 09:00:00': '2006-10-12T07:00:00',
+        '13. októbra 2006': '2006-10-13',
+        '13.10.2006 18:30:00': '2006-10-13T16:30:00',
+    }
+
+    def test_old_debate(self):
+        """segmentation.segment_old_debate should split paragraphs into records without side effects"""
+        paragraphs = ['Tretí deň rokovania', '5. schôdze Národnej rady Slovenskej republiky',
+            '12. októbra 2006 o 9.00 hodine', '',
+            'J. Novák, poslanec: Vážený pán predseda, (Potlesk.) ďakujem.',
+            '(Hlasy z pléna.', 'Pokračovanie hlasov.)',
+            '13. októbra 2006',
+            'P. Paška, predseda NR SR: Ďakujem.', 'Rokovanie skončilo o 18.30 hodine.']
+        records = segmentation.segment_old_debate(paragraphs, '4', {'J. Novák': 'mp1'}.get, self.DATES.get,
+            {'P. Paška': 'P. Paška'})
+        S = segmentation
+        self.assertEqual(records, [
+            S.Header('2006-10-12T07:00:00', '12. októbra 2006', '5'),
+            S.Speech('speech', '<p>Vážený pán predseda,</p>', 'mp1', 'J. Novák', 'poslanec', '2006-10-12T07:00:00'),
+            S.Scene('<p>Potlesk.</p>', '2006-10-12T07:00:00'),
+            S.Speech('speech', '<p>ďakujem.</p>', 'mp1', 'J. Novák', 'poslanec', '2006-10-12T07:00:00'),
+            S.Scene('<p>Hlasy z pléna.</p>\n\n<p>Pokračovanie hlasov.</p>', '2006-10-12T07:00:00'),
+            S.Timestamp('2006-10-13T00:00:00'),
+            S.Speech('speech', '<p>Ďakujem.</p>', None, 'P. Paška', 'predseda NR SR', '2006-10-13T00:00:00'),
+            S.Scene('<p>Rokovanie skončilo o 18.30 hodine.</p>', '2006-10-13T00:00:00'),
+            S.End('2006-10-13T16:30:00'),
+        ])
+
+    def test_debate_part(self):
+        """segmentation.segment_debate_part should split transcript lines into records without side effects"""
+        lines = [parse.TranscriptLine('Novák, Ján, poslanec', 'Novák, Ján, poslanec'), parse.TranscriptLine('1.', None),
+            parse.TranscriptLine('Ďakujem [Potlesk.] pekne.', None), parse.TranscriptLine('(Hymna.)', None)]
+        self.assertEqual(segmentation.segment_debate_part(lines, 'Vystúpenie', {}.get), [
+            segmentation.Speech('Vystúpenie', '<p>Ďakujem</p>', None, 'Ján Novák', 'poslanec', None),
+            segmentation.Scene('<p>Potlesk.</p>', None),
+            segmentation.Speech('Vystúpenie', '<p> pekne.</p>', None, 'Ján Novák', 'poslanec', None),
+            segmentation.Scene('<p>Hymna.</p>', None),
+        ])
+
+    def test_transcript_markup(self):
+        """segmentation.segment_debate_part should match speakers on headings only and scenes on text without markup"""
+        page = """<html><body><div><p><strong>Novák, Ján, poslanec</strong> Ďakujem za slovo.<br>
+            Text prejavu.<br>
+            <em>(Hlasy z pléna.</em><br>
+            <em>Pokračovanie hlasov.)</em><br>
+            Koniec.</p></div></body></html>"""
+        with replayed({'http://tv.nrsr.sk/transcript?id=1': page}):
+            lines = parse.debate_lines_of_terms56('1')['riadky']
+        self.assertEqual(segmentation.segment_debate_part(lines, 'Vystúpenie', {}.get), [
+            segmentation.Speech('Vystúpenie', '<p>Text prejavu.</p>', None, 'Ján Novák', 'poslanec', None),
+            segmentation.Scene('<p>Hlasy z pléna.</p>\n\n<p>Pokračovanie hlasov.</p>', None),
+            segmentation.Speech('Vystúpenie', '<p>Koniec.</p>', None, 'Ján Novák', 'poslanec', None),
+        ])
+
+    def test_split_scenes(self):
+        """segmentation._split_scenes should split text parts and scenes of a paragraph"""
+        self.assertEqual(segmentation._split_scenes('Ďakujem. (Potlesk.) (Smiech.) Áno (tlač 391).'), [
+            (False, 'Ďakujem. '), (True, 'Potlesk.'), (False, ' '), (True, 'Smiech.'), (False, ' Áno (tlač 391).')])
+        self.assertEqual(segmentation._split_scenes('Bez scény.'), [(False, 'Bez scény.')])
+
+
+class NestedParentheses(MaxDiffTestCase):
+    @staticmethod
+    def regex_normalized(par):
+        """The original conversion by repeated substitution of a regex."""
+        n = 1
+        while n >= 1:
+            (par, n) = re.subn(r'\((.*?)\((.*?)\)(.*?)\)', r'(\1[\2]\3)', par, flags=re.DOTALL)
+        return par
+
+    def random_parts(self, rnd, depth=0):
+        parts = []
+        for _ in range(rnd.randint(0, 4)):
+            if depth < 6 and rnd.random() < 0.4:
+                parts.append('(%s)' % self.random_parts(rnd, depth + 1))
+            else:
+                parts.append(rnd.choice(['Potlesk.', ' ', 'tlač 391', '\n', '[Smiech.]', 'o 9.00 hodine']))
+        return ''.join(parts)
+
+    def test_matches_regex(self):
+        """segmentation._normalized_parentheses should convert nested and sibling parentheses like the original regex"""
+        rnd = random.Random(0)
+        for _ in range(2000):
+            # sibling groups at any level, possibly with unpaired parentheses around
+            par = '%s%s%s' % (rnd.choice(['', 'Ďakujem ', ')']), self.random_parts(rnd), rnd.choice(['', ' pekne.', '(', ')']))
+            self.assertEqual(segmentation._normalized_parentheses(par), self.regex_normalized(par), par)
+
+    def test_invariants(self):
+        """segmentation._normalized_parentheses should convert only pairs of inner parentheses"""
+        rnd = random.Random(0)
+        for _ in range(2000):
+            par = ''.join(rnd.choice('()[]a ') for _ in range(rnd.randint(0, 30)))
+            normalized = segmentation._normalized_parentheses(par)
+            self.assertEqual(re.sub(r'[()\[\]]', '', normalized), re.sub(r'[()\[\]]', '', par))
+            self.assertEqual(normalized.count('(') - normalized.count(')'), par.count('(') - par.count(')'))
+            self.assertEqual(normalized.count('[') - normalized.count(']'), par.count('[') - par.count(']'))
+            self.assertEqual(segmentation._normalized_parentheses(normalized), normalized)
+
+    def test_siblings(self):
+        """segmentation._normalized_parentheses should bracket sibling groups like the original regex"""
+        self.assertEqual(segmentation._normalized_parentheses('(Potlesk.) a (Smiech.) b (Ruch v sále.)'),
+            '(Potlesk.) a [Smiech.] b (Ruch v sále.)')
+        self.assertEqual(segmentation._normalized_parentheses('x (a) (b (c)) y'), 'x (a) [b (c]) y')
+        self.assertEqual(segmentation._normalized_parentheses('(a (b (c) d) e)'), '(a [b [c] d] e)')
+
+
+class PlainText(MaxDiffTestCase):
+    def test_plaintext(self):
+        """scrapeutils.plaintext should normalize all strings in the structure except the skipped keys"""
+        obj = {
+            'a': ' Klub&nbsp;SMER \xa0 &ndash; SD\n',
+            'b': [' x  y ', {'c': 'p\n\nq', 'opis': ' kept '}, 1, None],
+            'opis': '  skipped  ',
+        }
+        result = scrapeutils.plaintext(obj, ['opis'])
+        self.assertIs(result, obj)
+        self.assertEqual(result, {
+            'a': 'Klub SMER – SD',
+            'b': ['x y', {'c': 'p q', 'opis': 'kept'}, 1, None],
+            'opis': '  skipped  ',
+        })
+        self.assertEqual(scrapeutils.plaintext('a\nb'), 'a\nb')
+
+    def test_clear_hyphens(self):
+        """scrapeutils.clear_hyphens should remove hyphens splitting words only"""
+        self.assertEqual(scrapeutils.clear_hyphens('roko-\nvanie a 2-3 A-\nB', '\n'), 'rokovanie a 2-3 A-\nB')
+        self.assertEqual(scrapeutils.clear_hyphens('roko-vanie'), 'rokovanie')
+
+
+class SkDates(MaxDiffTestCase):
+    @staticmethod
+    def dateutil_to_utc(dt_str):
+        """The original conversion of a Slovak date(-time) string by dateutil."""
+        match = re.search(scrapeutils.SK_MONTHS_REGEX, dt_str, re.IGNORECASE)
+        if match:
+            month = match.group(0)
+            dt_str = dt_str.replace(month, '%s.' % scrapeutils.SK_MONTHS[month[:3].lower()])
+        dt = dateutil.parser.parse(dt_str, dayfirst=True)
+        if ':' in dt_str:
+            dt = pytz.timezone(scrapeutils.TIMEZONE).localize(dt).astimezone(pytz.utc)
+            return dt.strftime('%Y-%m-%dT%H:%M:%S')
+        return dt.strftime('%Y-%m-%d')
+
+    def test_fixture_dates(self):
+        """scrapeutils.parse_sk_date should convert all dates in fixtures like dateutil"""
+        dates = []
+        def collect(obj):
+            if isinstance(obj, dict):
+                obj = list(obj.values())
+            if isinstance(obj, list):
+                for v in obj: collect(v)
+            elif isinstance(obj, str) and re.match(r'\d+\.\s*\d+\.\s*\d{4}', obj):
+                dates.append(obj)
+        for filename in os.listdir(FIXTURES_DIR):
+            collect(load_samples(filename[:-len('.json')]))
+        self.assertGreater(len(dates), 10)
+        for date in dates:
+            converted = scrapeutils.parse_sk_date(date)
+            if ' v ' not in date:
+                self.assertIsNotNone(converted, date)
+            if converted is not None:
+                self.assertEqual(converted, self.dateutil_to_utc(date), date)
+
+    def test_transcript_dates(self):
+        """scrapeutils.parse_sk_date should convert dates of transcripts and daylight saving time changes like dateutil"""
+        for date in ('12. októbra 2006', '3. februára 2010', '17. Marca 2005 09:01', '13.10.2006 18:30:00',
+                '2. 7. 2013 9:00', '28. 3. 2010 2:30', '31. 10. 2010 2:30', '31. 10. 2010 3:00'):
+            self.assertEqual(scrapeutils.parse_sk_date(date), self.dateutil_to_utc(date), date)
+        self.assertEqual(scrapeutils.parse_sk_date('12. októbra 2006 9:00'), '2006-10-12T07:00:00')
+
+    def test_other_formats(self):
+        """scrapeutils.parse_sk_date should leave unknown formats and invalid dates to dateutil"""
+        for date in ('18. - 26. 4. 2016', '23. 2. 1958 v Košiciach', '31. 2. 2010', '5. 13. 2010',
+                '3. februára2010', '1. jari 2010', '2010-02-03'):
+            self.assertIsNone(scrapeutils.parse_sk_date(date), date)
+
+
 if __name__ == '__main__':
     scrapeutils.USE_WEBCACHE = True
+    # ARCHIVE_MODE=record|replay runs the tests recording or replaying responses
+    if os.environ.get('ARCHIVE_MODE'):
+        scrapeutils.use_archive(os.environ['ARCHIVE_MODE'], os.environ.get('ARCHIVE_PATH'))
     unittest.main()
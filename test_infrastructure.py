@@ -0,0 +1,761 @@
+#!/usr/bin/env python3
+
+# Tests of downloading, caching and conversion infrastructure, they are run
+# by pytest or unittest only, not by the self-test of the scraper (see test.py).
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import http.server
+import urllib.parse
+import unittest
+from unittest import mock
+
+import lxml.html
+import requests
+
+import parse
+import segmentation
+import libreoffice
+import scrapeutils
+import webcache
+from test import BASE_DIR, MaxDiffTestCase
+
+
+class LocalServerTestCase(MaxDiffTestCase):
+    """Runs a local HTTP server serving pages from `self.pages`
+    dictionary (path -> (status, headers, body)) and logging received
+    requests into `self.requests`."""
+    def setUp(self):
+        self.pages = {}
+        self.requests = []
+        test = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                test.requests.append((self.command, self.path, dict(self.headers), getattr(self, 'body', None)))
+                status, headers, body = test.pages[self.path](self) if callable(test.pages[self.path]) \
+                    else test.pages[self.path]
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_HEAD(self):
+                test.requests.append((self.command, self.path, dict(self.headers), None))
+                status, headers, body = test.pages[self.path](self) if callable(test.pages[self.path]) \
+                    else test.pages[self.path]
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+
+            def do_POST(self):
+                self.body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+                self.do_GET()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = 'http://127.0.0.1:%s' % self.server.server_port
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self._saved = scrapeutils.USE_WEBCACHE, scrapeutils.WEBCACHE_PATH
+        # requests go to the local server even if the archive is used by the run
+        self._saved_archive = scrapeutils.ARCHIVE_MODE, scrapeutils.ARCHIVE_PATH
+        scrapeutils.use_archive(None)
+        scrapeutils.USE_WEBCACHE = True
+        scrapeutils.WEBCACHE_PATH = self.tmpdir.name
+        scrapeutils._cache = None
+        scrapeutils._memory_cache.clear()
+        scrapeutils._fingerprints.clear()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        scrapeutils.USE_WEBCACHE, scrapeutils.WEBCACHE_PATH = self._saved
+        scrapeutils.use_archive(*self._saved_archive)
+        scrapeutils._cache = None
+        scrapeutils._memory_cache.clear()
+        self.tmpdir.cleanup()
+
+
+class ParagraphsCache(MaxDiffTestCase):
+    # HTML as converted by unoconv, LibreOffice is not needed to test the cache
+    CONVERTED = '<html><body><p>Pr\u00edhovor</p><p>\u010eakujem.</p></body></html>'
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.saved = parse.PARAGRAPHS_CACHE_PATH, parse.PARSER_VERSION
+        parse.PARAGRAPHS_CACHE_PATH = os.path.join(self.tmpdir.name, 'paragraphs.sqlite')
+        parse._paragraphs = None
+        patcher = mock.patch('libreoffice.pool')
+        self.convert = patcher.start().return_value.convert
+        self.convert.return_value = self.CONVERTED
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        parse.PARAGRAPHS_CACHE_PATH, parse.PARSER_VERSION = self.saved
+        parse._paragraphs = None
+        self.tmpdir.cleanup()
+
+    def test_cached_paragraphs(self):
+        """parse.debate_of_terms234 and parse.debate_of_term1 should reuse paragraphs cached for the same source and parser version"""
+        expected = parse.debate_of_terms234('181217')
+        self.assertEqual(expected, ['Príhovor', 'Ďakujem.'])
+        expected_term1 = parse.debate_of_term1('198550')
+        self.convert.side_effect = AssertionError('converted again')
+        with mock.patch('parse._debate_of_term1', side_effect=AssertionError('parsed again')):
+            self.assertEqual(parse.debate_of_terms234('181217'), expected)
+            self.assertEqual(parse.debate_of_term1('198550'), expected_term1)
+        parse.PARSER_VERSION += 1
+        self.convert.side_effect = None
+        self.convert.reset_mock()
+        self.assertEqual(parse.debate_of_terms234('181217'), expected)
+        self.assertEqual(self.convert.call_count, 1)
+
+    def test_file_fingerprint(self):
+        """webcache.fingerprint_file should hash the file in chunks like webcache.fingerprint its content"""
+        filename = os.path.join(BASE_DIR, 'fixed_debates', 'debate_181217.rtf')
+        with open(filename, 'rb') as f:
+            content = f.read()
+        self.assertEqual(webcache.fingerprint_file(filename, 61), webcache.fingerprint(content))
+
+    def test_clear_cache(self):
+        """scrapeutils.clear_cache should clear the open cache of paragraphs in place"""
+        saved = scrapeutils.WEBCACHE_PATH, scrapeutils._cache
+        scrapeutils.WEBCACHE_PATH, scrapeutils._cache = self.tmpdir.name, None
+        try:
+            expected = parse.debate_of_terms234('181217')
+            open(os.path.join(self.tmpdir.name, 'debate_1.rtf'), 'w').close()
+            scrapeutils.clear_cache()
+            self.assertEqual(sorted(n for n in os.listdir(self.tmpdir.name) if n.endswith('.sqlite')),
+                ['paragraphs.sqlite', 'webcache.sqlite'])
+            self.assertFalse(os.path.exists(os.path.join(self.tmpdir.name, 'debate_1.rtf')))
+            self.convert.reset_mock()
+            self.assertEqual(parse.debate_of_terms234('181217'), expected)
+            self.assertEqual(self.convert.call_count, 1)
+        finally:
+            scrapeutils.WEBCACHE_PATH, scrapeutils._cache = saved
+
+
+class LibreOfficePool(MaxDiffTestCase):
+    ids = ['181217', '181218', '181219', '181246']
+
+    @unittest.skipUnless(shutil.which('unoconv') and shutil.which(libreoffice.SOFFICE),
+        'LibreOffice or unoconv is not installed')
+    def test_debates_in_order(self):
+        """parse.debates_of_terms234 should give results of parse.debate_of_terms234 in order"""
+        self.assertEqual(list(parse.debates_of_terms234(self.ids, 3)),
+            [parse.debate_of_terms234(id) for id in self.ids])
+
+    def test_ports(self):
+        """libreoffice.Pool should start a listener on the lowest port not used by another listener"""
+        with libreoffice.Pool(3, first_port=2102) as pool:
+            failed = []
+
+            def start(listener):
+                if listener.port == 2103 and not failed:
+                    # another listener is started while this one fails
+                    failed.append(listener)
+                    pool._acquire()
+                    raise libreoffice.ConversionError('failed to start')
+
+            with mock.patch.object(libreoffice.Listener, 'start', autospec=True, side_effect=start):
+                pool._acquire()
+                with self.assertRaises(libreoffice.ConversionError):
+                    pool._acquire()
+                pool._acquire()
+            self.assertEqual(sorted(l.port for l in pool._listeners), [2102, 2103, 2104])
+
+    @unittest.skipUnless(shutil.which('unoconv') and shutil.which(libreoffice.SOFFICE),
+        'LibreOffice or unoconv is not installed')
+    def test_batch_conversion(self):
+        """libreoffice.Pool should convert documents concurrently and restart a dead listener"""
+        filenames = [os.path.join(BASE_DIR, 'fixed_debates', 'debate_%s.rtf' % id) for id in self.ids]
+        with libreoffice.Pool(2, first_port=2102) as pool:
+            contents = pool.convert_all(filenames)
+            self.assertEqual(len(pool._listeners), 2)
+            pool._listeners[0].process.kill()
+            pool._listeners[0].process.wait()
+            self.assertEqual(pool.convert_all(filenames), contents)
+        self.assertEqual([parse._converted_paragraphs(c) for c in contents],
+            [parse.debate_of_terms234(id) for id in self.ids])
+
+
+class ParallelSegmentation(MaxDiffTestCase):
+    def test_parallel_segmentation(self):
+        """scrapeutils.iter_parallel should segment debates in a process pool in order"""
+        paragraphs = [parse.debate_of_term1(id) for id in ('198550', '65799')]
+        args = [(p, '1', {}.get, str, None) for p in paragraphs]
+        self.assertEqual(list(scrapeutils.iter_parallel(segmentation.segment_old_debate, args, 2, 1)),
+            [segmentation.segment_old_debate(*a) for a in args])
+
+
+class ConcurrentCalls(MaxDiffTestCase):
+    def test_order_of_results(self):
+        """scrapeutils.map_concurrent should return results in order of arguments"""
+        args = [(i, i % 3) for i in range(50)]
+        self.assertEqual(scrapeutils.map_concurrent(pow, args, 4), [pow(*a) for a in args])
+        self.assertEqual(list(scrapeutils.iter_concurrent(pow, args, 4, 7)), [pow(*a) for a in args])
+
+    def test_empty_arguments(self):
+        """scrapeutils.map_concurrent should return empty list for no arguments"""
+        self.assertEqual(scrapeutils.map_concurrent(pow, []), [])
+
+
+class Prefetch(MaxDiffTestCase):
+    def test_order(self):
+        """scrapeutils.prefetch should yield all items in order"""
+        self.assertEqual(list(scrapeutils.prefetch(iter(range(100)), 3)), list(range(100)))
+
+    def test_ahead(self):
+        """scrapeutils.prefetch should produce items ahead of the consumer but not further than its size"""
+        produced = []
+
+        def pages():
+            for i in range(10):
+                produced.append(i)
+                yield i
+
+        items = scrapeutils.prefetch(pages(), 2)
+        self.assertEqual(next(items), 0)
+        time.sleep(0.2)
+        self.assertEqual(produced, [0, 1, 2, 3])
+        items.close()
+        time.sleep(0.2)
+        self.assertLess(len(produced), 10)
+
+    def test_exception(self):
+        """scrapeutils.prefetch should raise exceptions of the iterable to the consumer"""
+        def pages():
+            yield 1
+            raise ValueError('broken page')
+
+        items = scrapeutils.prefetch(pages())
+        self.assertEqual(next(items), 1)
+        self.assertRaises(ValueError, next, items)
+
+
+class Memoization(MaxDiffTestCase):
+    def test_memoize(self):
+        """scrapeutils.memoize should call the function once per arguments and return copies"""
+        calls = []
+
+        @scrapeutils.memoize
+        def func(a, b=None):
+            calls.append((a, b))
+            return {'items': [a, b]}
+
+        self.assertEqual(func(1), {'items': [1, None]})
+        func(1, None)['items'].append(2)
+        self.assertEqual(func(a=1), {'items': [1, None]})
+        self.assertEqual(calls, [(1, None)])
+        func(2)
+        func.invalidate(1)
+        func(1)
+        self.assertEqual(calls, [(1, None), (2, None), (1, None)])
+        scrapeutils.clear_memoized()
+        func(2)
+        self.assertEqual(len(calls), 4)
+
+    def test_concurrent_calls(self):
+        """scrapeutils.memoize should not call the function repeatedly from concurrent threads"""
+        calls = []
+
+        @scrapeutils.memoize
+        def slow(a):
+            calls.append(a)
+            time.sleep(0.05)
+            return a
+
+        self.assertEqual(scrapeutils.map_concurrent(slow, [(1,)] * 4), [1] * 4)
+        self.assertEqual(calls, [1])
+
+
+class CacheKey(MaxDiffTestCase):
+    def test_ignored_page_state(self):
+        """scrapeutils.cache_key should not depend on ASP.NET page state and order of fields"""
+        url = 'http://www.nrsr.sk/web/default.aspx?sid=poslanci/zmeny'
+        key1 = scrapeutils.cache_key(url, 'POST', {'__VIEWSTATE': 'a', '__EVENTARGUMENT': 'Page$2', 'term': '5'})
+        key2 = scrapeutils.cache_key(url, 'post', {'term': '5', '__EVENTARGUMENT': 'Page$2', '__VIEWSTATE': 'b'})
+        self.assertEqual(key1, key2)
+
+    def test_meaningful_fields(self):
+        """scrapeutils.cache_key should distinguish requests with different form fields"""
+        url = 'http://www.nrsr.sk/web/default.aspx?sid=poslanci/zmeny'
+        key1 = scrapeutils.cache_key(url, 'POST', {'__EVENTARGUMENT': 'Page$2'})
+        key2 = scrapeutils.cache_key(url, 'POST', {'__EVENTARGUMENT': 'Page$3'})
+        self.assertNotEqual(key1, key2)
+        self.assertNotEqual(scrapeutils.cache_key(url), key1)
+
+
+class WebCacheStore(MaxDiffTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache = webcache.WebCache(os.path.join(self.tmpdir.name, 'cache.sqlite'))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_put_and_get(self):
+        """webcache.WebCache should return stored content"""
+        self.assertIsNone(self.cache.get('a'))
+        self.cache.put('a', 'Návrh prešiel'.encode('utf-8'))
+        self.assertEqual(self.cache.get('a').content.decode('utf-8'), 'Návrh prešiel')
+        self.cache.put('a', b'changed', '"v2"')
+        self.assertEqual(self.cache.get('a').content, b'changed')
+        self.assertEqual(self.cache.get('a').etag, '"v2"')
+        self.cache.clear()
+        self.assertIsNone(self.cache.get('a'))
+
+    def test_deduplication(self):
+        """webcache.WebCache should store identical content only once"""
+        for key in ('a', 'b', 'c'):
+            self.cache.put(key, b'Unexpected error!' * 100)
+        self.cache.put('c', b'other')
+        conn = self.cache._connection()
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM bodies').fetchone()[0], 2)
+        self.cache.put('a', b'other')
+        self.cache.put('b', b'other')
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM bodies').fetchone()[0], 1)
+
+    def test_eviction(self):
+        """webcache.WebCache should evict least recently used entries above its size limit"""
+        for i in range(20):
+            self.cache.put(str(i), os.urandom(1000))
+        with mock.patch('webcache.EVICTION_BATCH', 3):
+            self.cache.evict(5000)
+        self.assertLessEqual(self.cache.size(), 5000)
+        self.assertIsNone(self.cache.get('0'))
+        self.assertIsNotNone(self.cache.get('19'))
+
+    def test_tracked_size(self):
+        """webcache.WebCache should keep the size of stored bodies in step when content is replaced"""
+        cache = webcache.WebCache(os.path.join(self.tmpdir.name, 'bounded.sqlite'), max_size=10**6)
+        for i in range(20):
+            cache.put('a', os.urandom(1000))
+            cache.put(str(i % 3), b'shared')
+        self.assertEqual(cache._size, cache.size())
+
+    def test_writes_from_new_threads(self):
+        """webcache.WebCache should write from a thread that has not used the cache yet"""
+        self.cache.put('a', b'content')
+        calls = [
+            lambda: self.cache.touch('a'),
+            lambda: self.cache.put_fingerprint('url', webcache.Fingerprint('hash', 7, None, None, 0)),
+            lambda: self.cache.put_parsed('hash', 'parser', 1, ['paragraph']),
+            lambda: self.cache.put_processed('a', 'hash'),
+        ]
+        for call in calls:
+            # a deadlocked thread must not keep the tests from exiting
+            thread = threading.Thread(target=call, daemon=True)
+            thread.start()
+            thread.join(10)
+            self.assertFalse(thread.is_alive())
+        self.assertEqual(self.cache.get_fingerprint('url').size, 7)
+        self.assertEqual(self.cache.get_parsed('hash', 'parser', 1), ['paragraph'])
+        self.assertEqual(self.cache.get_processed('a'), 'hash')
+
+
+class MemoryCacheStore(MaxDiffTestCase):
+    def test_lru_eviction(self):
+        """webcache.MemoryCache should keep recently used items within its size limit"""
+        def entry(content):
+            return webcache.Entry(content, 0, webcache.fingerprint(content), None, None)
+        cache = webcache.MemoryCache(30)
+        cache.put('a', entry(b'a' * 10))
+        cache.put('b', entry(b'b' * 10))
+        cache.put('c', entry(b'c' * 10))
+        cache.get('a')
+        cache.put('d', entry(b'd' * 10))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a').content, b'a' * 10)
+        self.assertLessEqual(cache.size, 30)
+
+
+class CachePolicies(MaxDiffTestCase):
+    def test_url_classes(self):
+        """scrapeutils.cache_ttl should keep documents forever and lists for a short time"""
+        self.assertEqual(scrapeutils.cache_ttl('http://www.nrsr.sk/dl/Browser/Document?documentId=181459'),
+            scrapeutils.FOREVER)
+        self.assertEqual(scrapeutils.cache_ttl(
+            'http://www.nrsr.sk/web/Default.aspx?sid=poslanci/zoznam_abc&ListType=0&CisObdobia=7'), scrapeutils.HOUR)
+        self.assertEqual(scrapeutils.cache_ttl('http://www.nrsr.sk/web/default.aspx?sid=poslanci/zmeny'),
+            scrapeutils.HOUR)
+        self.assertEqual(scrapeutils.cache_ttl(
+            'http://www.nrsr.sk/web/Default.aspx?sid=poslanci/poslanec&PoslanecID=773&CisObdobia=7'),
+            scrapeutils.CACHE_DEFAULT_TTL)
+
+
+class RateLimits(MaxDiffTestCase):
+    def test_token_bucket(self):
+        """scrapeutils.HostLimiter should not exceed its rate after a burst"""
+        limiter = scrapeutils.HostLimiter(rate=50, burst=5, concurrency=1)
+        start = time.monotonic()
+        for i in range(15):
+            limiter.acquire()
+            limiter.release(0.01, True)
+        self.assertGreaterEqual(time.monotonic() - start, 10 / 50 * 0.9)
+
+    def test_adaptive_concurrency(self):
+        """scrapeutils.HostLimiter should back off on errors and ramp up on fast responses"""
+        limiter = scrapeutils.HostLimiter(rate=1000, burst=1000, concurrency=8)
+        for i in range(100):
+            limiter.acquire()
+            limiter.release(0.01, True)
+        self.assertEqual(limiter.limit, 8)
+        limiter.acquire()
+        limiter.release(0.01, False)
+        self.assertEqual(limiter.limit, 4)
+        limiter.acquire()
+        limiter.release(1.0, True)
+        self.assertEqual(limiter.limit, 2)
+
+    def test_limits_by_prefix(self):
+        """scrapeutils.limiter should pick limits of the longest matching URL prefix"""
+        dl = scrapeutils.limiter('http://www.nrsr.sk/dl/Browser/Document?documentId=1')
+        web = scrapeutils.limiter('http://www.nrsr.sk/web/default.aspx?sid=poslanci')
+        self.assertIsNot(dl, web)
+        self.assertEqual(dl.rate, scrapeutils.RATE_LIMITS['http://www.nrsr.sk/dl/']['rate'])
+
+
+class Retries(LocalServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self._saved_delay = scrapeutils.RETRY_BASE_DELAY
+        scrapeutils.RETRY_BASE_DELAY = 0.01
+
+    def tearDown(self):
+        scrapeutils.RETRY_BASE_DELAY = self._saved_delay
+        super().tearDown()
+
+    def test_transient_error(self):
+        """scrapeutils.download should retry requests failed by a transient server error"""
+        responses = [(503, {}, b'busy'), (503, {}, b'busy'), (200, {}, b'ok')]
+        self.pages['/flaky'] = lambda handler: responses.pop(0)
+        retries = scrapeutils.stats()['retries']
+        self.assertEqual(scrapeutils.download(self.base_url + '/flaky'), 'ok')
+        self.assertEqual(scrapeutils.stats()['retries'] - retries, 2)
+
+    def test_permanent_error(self):
+        """scrapeutils.download should fail after the retries are exhausted"""
+        self.pages['/down'] = (500, {}, b'error')
+        failures = scrapeutils.stats()['failures']
+        self.assertRaises(Exception, scrapeutils.download, self.base_url + '/down')
+        self.assertEqual(len(self.requests), scrapeutils.RETRIES + 1)
+        self.assertEqual(scrapeutils.stats()['failures'] - failures, 1)
+
+    def test_closed_responses(self):
+        """scrapeutils._request should close failed responses before a retry and failed streamed responses"""
+        closed = []
+        close = requests.Response.close
+
+        def record(resp):
+            closed.append(resp.status_code)
+            close(resp)
+
+        responses = [(503, {}, b'busy'), (200, {}, b'ok')]
+        self.pages['/flaky'] = lambda handler: responses.pop(0)
+        self.pages['/missing'] = (404, {}, b'missing')
+        with mock.patch.object(requests.Response, 'close', autospec=True, side_effect=record):
+            filename = os.path.join(self.tmpdir.name, 'flaky.rtf')
+            scrapeutils.download_file(self.base_url + '/flaky', filename)
+            self.assertEqual(closed, [503, 200])
+            self.assertRaises(requests.HTTPError, scrapeutils.download_file, self.base_url + '/missing',
+                os.path.join(self.tmpdir.name, 'missing.rtf'))
+            self.assertEqual(closed, [503, 200, 404])
+
+
+class Deadlines(LocalServerTestCase):
+    def setUp(self):
+        super().setUp()
+        # budget of the run executing the tests
+        self._saved_deadline = scrapeutils._deadline
+        scrapeutils.set_run_budget(None)
+
+    def tearDown(self):
+        scrapeutils._deadline = self._saved_deadline
+        super().tearDown()
+
+    def test_timeouts(self):
+        """scrapeutils.request_timeout should apply the timeout of the URL class and the run budget"""
+        self.assertEqual(scrapeutils.request_timeout('http://www.nrsr.sk/dl/Browser/Document?documentId=1'),
+            (10, 300))
+        self.assertEqual(scrapeutils.request_timeout('http://www.nrsr.sk/web/Default.aspx?sid=poslanci'),
+            scrapeutils.DEFAULT_TIMEOUT)
+        scrapeutils.set_run_budget(5)
+        self.assertLessEqual(scrapeutils.request_timeout('http://www.nrsr.sk/dl/Browser/Document?documentId=1')[1], 5)
+
+    def test_exhausted_budget(self):
+        """scrapeutils.download should fail without a request when the run budget is exhausted"""
+        self.pages['/page'] = (200, {}, b'ok')
+        scrapeutils.set_run_budget(0)
+        self.assertRaises(scrapeutils.DeadlineExceeded, scrapeutils.download, self.base_url + '/page')
+        self.assertEqual(self.requests, [])
+
+    def test_hedging(self):
+        """scrapeutils.download should hedge a request slower than usual by a duplicate one"""
+        def slow_first(handler):
+            if len(self.requests) == 1:
+                time.sleep(1)
+            return 200, {}, b'ok'
+        self.pages['/slow'] = slow_first
+        host_limiter = scrapeutils.limiter(self.base_url + '/slow')
+        host_limiter.samples.extend([0.01] * scrapeutils.HEDGE_MIN_SAMPLES)
+        saved, scrapeutils.HEDGING = scrapeutils.HEDGING, True
+        try:
+            hedged = scrapeutils.stats()['hedged']
+            start = time.monotonic()
+            self.assertEqual(scrapeutils.download(self.base_url + '/slow'), 'ok')
+            self.assertLess(time.monotonic() - start, 0.9)
+            self.assertEqual(scrapeutils.stats()['hedged'] - hedged, 1)
+        finally:
+            scrapeutils.HEDGING = saved
+
+
+class DownloadFile(LocalServerTestCase):
+    def test_streaming(self):
+        """scrapeutils.download_file should store binary content into the file and reuse it"""
+        body = bytes(range(256)) * 1000
+        self.pages['/doc'] = (200, {'Content-Type': 'application/rtf'}, body)
+        filename = os.path.join(self.tmpdir.name, 'doc.rtf')
+        self.assertEqual(scrapeutils.download_file(self.base_url + '/doc', filename), filename)
+        self.assertEqual(scrapeutils.download_file(self.base_url + '/doc', filename), filename)
+        with open(filename, 'rb') as f:
+            self.assertEqual(f.read(), body)
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(os.listdir(self.tmpdir.name), ['doc.rtf'])
+
+    def test_error(self):
+        """scrapeutils.download_file should not leave a file after a failed download"""
+        self.pages['/missing'] = (404, {}, b'not found')
+        filename = os.path.join(self.tmpdir.name, 'missing.rtf')
+        self.assertRaises(Exception, scrapeutils.download_file, self.base_url + '/missing', filename)
+        self.assertFalse(os.path.exists(filename))
+
+
+class GridPaging(LocalServerTestCase):
+    """Simulates an ASP.NET grid of 25 pages with a pager showing 10
+    pages at once. If `self.validate` is set, the server accepts only
+    postbacks to pages linked from the page the view state belongs to."""
+    TARGET = '_sectionLayoutContainer$ctl01$_grid'
+    PAGES = 25
+
+    def setUp(self):
+        super().setUp()
+        self.validate = False
+        self.pages['/grid'] = self.grid
+        self._saved_retries = scrapeutils.RETRIES, scrapeutils.RETRY_BASE_DELAY
+        scrapeutils.RETRIES, scrapeutils.RETRY_BASE_DELAY = 1, 0.01
+        scrapeutils.RATE_LIMITS[self.base_url + '/'] = {'rate': 1000, 'burst': 100, 'concurrency': 8}
+        parse._serial_grids.clear()
+
+    def tearDown(self):
+        scrapeutils.RETRIES, scrapeutils.RETRY_BASE_DELAY = self._saved_retries
+        del scrapeutils.RATE_LIMITS[self.base_url + '/']
+        parse._serial_grids.clear()
+        super().tearDown()
+
+    def pager(self, page):
+        """Return list of (page, text) of pager links on the given page."""
+        window = (page - 1) // 10 * 10
+        links = [(n, str(n)) for n in range(window + 1, min(window + 10, self.PAGES) + 1)]
+        if window > 0:
+            links.insert(0, (window, '...'))
+        if window + 10 < self.PAGES:
+            links.append((window + 11, '...'))
+        return links
+
+    def render(self, page):
+        cells = []
+        for n, text in self.pager(page):
+            if n == page:
+                cells.append('<td><span>%s</span></td>' % n)
+            else:
+                cells.append('<td><a href="javascript:__doPostBack(\'%s\',\'Page$%s\')">%s</a></td>' %
+                    (self.TARGET, n, text))
+        return ('<html><body><input id="__VIEWSTATE" value="%s"/><input id="__EVENTVALIDATION" value=""/>'
+            '<table id="%s"><tr class="pager"><td><table><tr>%s</tr></table></td></tr>%s</table></body></html>' %
+            (page, self.TARGET.replace('$', '_'), ''.join(cells),
+            ''.join('<tr><td>item %s</td></tr>' % (page * 10 + i) for i in range(10)))).encode('utf-8')
+
+    def grid(self, handler):
+        if handler.command == 'GET':
+            return 200, {}, self.render(1)
+        data = urllib.parse.parse_qs(handler.body)
+        argument = data['__EVENTARGUMENT'][0].replace('Page$', '')
+        page = self.PAGES if argument == 'Last' else int(argument)
+        if self.validate and page not in [n for n, _ in self.pager(int(data['__VIEWSTATE'][0]))]:
+            return 500, {}, b'Invalid postback or callback argument'
+        return 200, {}, self.render(page)
+
+    def items(self):
+        html = lxml.html.fromstring(scrapeutils.download(self.base_url + '/grid'))
+        return [td.text for html in parse._grid_pages(self.base_url + '/grid', html, self.TARGET, {}, '')
+            for td in html.findall('.//table[@id="%s"]/tr/td' % self.TARGET.replace('$', '_'))
+            if td.text and td.text.startswith('item')]
+
+    def test_direct_jumps(self):
+        """parse._grid_pages should request pages directly from the first page"""
+        self.assertEqual(self.items(), ['item %s' % i for i in range(10, 10 * (self.PAGES + 1))])
+        view_states = [urllib.parse.parse_qs(body)['__VIEWSTATE'][0] for _, _, _, body in self.requests if body]
+        self.assertEqual(set(view_states), {'1'})
+        self.assertEqual(parse._serial_grids, set())
+
+    def test_rejected_jumps(self):
+        """parse._grid_pages should fall back to serial walk if the server rejects direct jumps"""
+        self.validate = True
+        breaker = scrapeutils._breaker(self.base_url)
+        breaker.consecutive_failures = 0
+        self.assertEqual(self.items(), ['item %s' % i for i in range(10, 10 * (self.PAGES + 1))])
+        self.assertEqual(parse._serial_grids, {self.TARGET})
+        # the rejected probe is neither retried nor counted by the circuit breaker
+        arguments = [urllib.parse.parse_qs(body)['__EVENTARGUMENT'][0] for _, _, _, body in self.requests if body]
+        self.assertEqual(arguments, ['Page$Last'] + ['Page$%s' % page for page in range(2, self.PAGES + 1)])
+        self.assertEqual(breaker.consecutive_failures, 0)
+
+
+class Fingerprints(LocalServerTestCase):
+    def test_different_size(self):
+        """scrapeutils.fingerprint should not download content of other than expected size"""
+        self.pages['/photo.jpg'] = (200, {}, b'photo')
+        self.assertEqual(scrapeutils.fingerprint(self.base_url + '/photo.jpg', expected_size=3), (None, 5))
+        self.assertEqual([r[0] for r in self.requests], ['HEAD'])
+
+    def test_store(self):
+        """scrapeutils.fingerprint should download content once and revalidate it later"""
+        self.pages['/photo.jpg'] = (200, {'ETag': '"v1"'}, b'dummy')
+        expected = (webcache.fingerprint(b'dummy'), 5)
+        self.assertEqual(scrapeutils.fingerprint(self.base_url + '/photo.jpg', expected_size=5), expected)
+        self.assertEqual(scrapeutils.fingerprint(self.base_url + '/photo.jpg', expected_size=5), expected)
+        self.assertEqual([r[0] for r in self.requests], ['HEAD', 'GET'])
+
+        # a new run with the persistent store revalidates the fingerprint by a HEAD request only
+        scrapeutils._fingerprints.clear()
+        self.assertEqual(scrapeutils.fingerprint(self.base_url + '/photo.jpg', expected_size=5, ttl=0), expected)
+        self.assertEqual([r[0] for r in self.requests], ['HEAD', 'GET', 'HEAD'])
+
+        self.pages['/photo.jpg'] = (200, {'ETag': '"v2"'}, b'photo')
+        self.assertEqual(scrapeutils.fingerprint(self.base_url + '/photo.jpg', expected_size=5, ttl=0),
+            (webcache.fingerprint(b'photo'), 5))
+        self.assertEqual([r[0] for r in self.requests], ['HEAD', 'GET', 'HEAD', 'HEAD', 'GET'])
+
+    def test_missing(self):
+        """scrapeutils.fingerprint should give no hash for missing content without downloading it"""
+        self.pages['/photo.jpg'] = (404, {}, b'Not Found')
+        self.assertEqual(scrapeutils.fingerprint(self.base_url + '/photo.jpg', expected_size=5), (None, None))
+        self.assertEqual([r[0] for r in self.requests], ['HEAD', 'GET'])
+        self.assertEqual(scrapeutils.fingerprint(self.base_url + '/photo.jpg', expected_size=5), (None, None))
+        self.assertEqual(len(self.requests), 2)
+
+
+class CircuitBreakers(MaxDiffTestCase):
+    def test_pause_after_failures(self):
+        """scrapeutils.CircuitBreaker should pause a failing host and give up after the longest pause"""
+        breaker = scrapeutils.CircuitBreaker(failures=2, pause=0.05, max_pause=0.1)
+        self.assertTrue(breaker.failure())
+        self.assertTrue(breaker.failure())
+        start = time.monotonic()
+        breaker.wait()
+        self.assertGreaterEqual(time.monotonic() - start, 0.04)
+        breaker.failure()
+        self.assertTrue(breaker.failure())
+        breaker.failure()
+        self.assertFalse(breaker.failure())
+        breaker.success()
+        self.assertTrue(breaker.failure())
+
+
+class Revalidation(LocalServerTestCase):
+    def test_not_modified(self):
+        """scrapeutils.download should revalidate expired content by ETag"""
+        def page(handler):
+            if handler.headers.get('If-None-Match') == '"v1"':
+                return 304, {}, b''
+            return 200, {'ETag': '"v1"', 'Content-Type': 'text/html; charset=utf-8'}, 'Schôdza'.encode('utf-8')
+        self.pages['/a'] = page
+        url = self.base_url + '/a'
+        self.assertEqual(scrapeutils.download(url), 'Schôdza')
+        self.assertFalse(scrapeutils.unchanged(url))
+        self.assertEqual(scrapeutils.download(url, ttl=0), 'Schôdza')
+        self.assertTrue(scrapeutils.unchanged(url))
+        self.assertEqual(self.requests[1][2].get('If-None-Match'), '"v1"')
+
+    def test_not_modified_in_worker(self):
+        """scrapeutils.map_concurrent should revalidate content cached in memory by a worker thread"""
+        self.pages['/a'] = lambda handler: (304, {}, b'') if handler.headers.get('If-None-Match') == '"v1"' \
+            else (200, {'ETag': '"v1"'}, b'content')
+        url = self.base_url + '/a'
+        scrapeutils.download(url)
+        results = []
+        thread = threading.Thread(daemon=True, target=lambda: results.extend(
+            scrapeutils.map_concurrent(scrapeutils.download, [(url, 'GET', None, '', False, 0)])))
+        thread.start()
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(results, ['content'])
+        self.assertTrue(scrapeutils.unchanged(url))
+
+    def test_content_fingerprint(self):
+        """scrapeutils.download should recognize unchanged content without validators"""
+        self.pages['/b'] = (200, {}, b'same')
+        url = self.base_url + '/b'
+        scrapeutils.download(url)
+        scrapeutils.download(url, ttl=0)
+        self.assertTrue(scrapeutils.unchanged(url))
+        self.pages['/b'] = (200, {}, b'different')
+        self.assertEqual(scrapeutils.download(url, ttl=0), 'different')
+        self.assertFalse(scrapeutils.unchanged(url))
+
+    def test_processed_content(self):
+        """scrapeutils.processed should recognize content processed by a previous run only"""
+        self.pages['/d'] = (200, {}, b'profile')
+        url = self.base_url + '/d'
+        scrapeutils.download(url)
+        self.assertFalse(scrapeutils.processed(url))
+        # the previous run failed before processing the page
+        scrapeutils._memory_cache.clear()
+        scrapeutils.download(url, ttl=0)
+        self.assertTrue(scrapeutils.unchanged(url))
+        self.assertFalse(scrapeutils.processed(url))
+        scrapeutils.mark_processed(url)
+        self.assertTrue(scrapeutils.processed(url))
+        self.pages['/d'] = (200, {}, b'changed profile')
+        scrapeutils.download(url, ttl=0)
+        self.assertFalse(scrapeutils.processed(url))
+
+    def test_fresh_content(self):
+        """scrapeutils.download should not send requests for fresh cached content"""
+        self.pages['/c'] = (200, {}, b'content')
+        url = self.base_url + '/c'
+        scrapeutils.download(url)
+        scrapeutils.download(url)
+        self.assertEqual(len(self.requests), 1)
+
+
+class RecordReplay(LocalServerTestCase):
+    def test_replay_recorded_requests(self):
+        """scrapeutils.download should replay recorded responses without network access"""
+        self.pages['/list'] = (200, {}, 'Zoznam poslancov'.encode('utf-8'))
+        url = self.base_url + '/list'
+        archive = os.path.join(self.tmpdir.name, 'archive.sqlite')
+        # the previous archive mode is restored by tearDown
+        scrapeutils.use_archive('record', archive)
+        self.assertEqual(scrapeutils.download(url, 'POST', {'__VIEWSTATE': 'x', 'Page': '2'}), 'Zoznam poslancov')
+        scrapeutils.use_archive('replay', archive)
+        self.server.shutdown()
+        self.assertEqual(scrapeutils.download(url, 'POST', {'__VIEWSTATE': 'y', 'Page': '2'}), 'Zoznam poslancov')
+        self.assertRaises(scrapeutils.ReplayMiss, scrapeutils.download, url, 'POST', {'Page': '3'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,325 @@
+"""
+    Cache of downloaded web content: a bounded in-memory LRU tier and
+    a disk tier stored in a single SQLite file
+"""
+
+import os.path
+import json
+import sqlite3
+import threading
+import hashlib
+import zlib
+import time
+import fcntl
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+
+# version of the database schema, cache with an older schema is recreated
+SCHEMA_VERSION = 3
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS bodies (
+        hash TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        stored_size INTEGER NOT NULL,
+        data BLOB NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS entries (
+        key TEXT PRIMARY KEY,
+        hash TEXT NOT NULL,
+        fetched_at REAL NOT NULL,
+        accessed_at REAL NOT NULL,
+        etag TEXT,
+        last_modified TEXT
+    );
+    CREATE INDEX IF NOT EXISTS entries_hash ON entries (hash);
+    CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at);
+    CREATE TABLE IF NOT EXISTS fingerprints (
+        url TEXT PRIMARY KEY,
+        hash TEXT,
+        size INTEGER,
+        etag TEXT,
+        last_modified TEXT,
+        checked_at REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS parsed (
+        hash TEXT NOT NULL,
+        parser TEXT NOT NULL,
+        version INTEGER NOT NULL,
+        data BLOB NOT NULL,
+        PRIMARY KEY (hash, parser)
+    );
+    CREATE TABLE IF NOT EXISTS processed (
+        key TEXT PRIMARY KEY,
+        hash TEXT NOT NULL
+    );
+"""
+# how often at most the access time of a cache entry is updated (in seconds)
+ACCESS_RESOLUTION = 3600
+# number of the least recently used entries selected at once by eviction
+EVICTION_BATCH = 100
+
+# cached content with SHA-256 hash of the content and HTTP validators
+# received with it
+Entry = namedtuple('Entry', 'content fetched_at hash etag last_modified')
+# fingerprint of content at a URL without the content itself; hash is None
+# if only the size is known
+Fingerprint = namedtuple('Fingerprint', 'hash size etag last_modified checked_at')
+
+
+def fingerprint(content):
+    """Return fingerprint (SHA-256 hash) of the content given as bytes."""
+    return hashlib.sha256(content).hexdigest()
+
+
+def fingerprint_file(filename, chunk_size=2**16):
+    """Return fingerprint (SHA-256 hash) of content of the file, read in
+    chunks to not hold the whole file in memory."""
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class MemoryCache:
+    """In-process LRU cache of content bounded by total size in bytes."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return cache Entry for the key or None if it is not cached."""
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None:
+                self._items.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        """Store cache Entry for the key, evict the least recently used
+        entries if the size limit is exceeded."""
+        if len(entry.content) > self.max_size:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= len(old.content)
+            self._items[key] = entry
+            self.size += len(entry.content)
+            while self.size > self.max_size:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= len(evicted.content)
+
+    def clear(self):
+        """Delete all cached content."""
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+
+class WebCache:
+    """Key-value store of downloaded content in a single SQLite file.
+
+    Bodies are stored zlib-compressed and deduplicated by SHA-256 hash
+    of their content, so identical pages (e.g. error pages or repeated
+    pager pages) are stored only once. The database runs in WAL mode and
+    writes are serialized by a lock file, so that the cache may be shared
+    by several threads and scraper processes at once.
+
+    If `max_size` is given, the least recently used entries are evicted
+    whenever the total size of stored bodies exceeds it.
+    """
+
+    def __init__(self, path, max_size=None):
+        self.path = path
+        self.max_size = max_size
+        self._size = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        """Return a connection to the database for the current thread,
+        create the database on first use."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            with self._write_lock():
+                conn.execute('PRAGMA journal_mode=WAL')
+                if conn.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+                    conn.executescript('DROP TABLE IF EXISTS entries; DROP TABLE IF EXISTS bodies;')
+                    conn.execute('PRAGMA user_version = %d' % SCHEMA_VERSION)
+                conn.executescript(SCHEMA)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _write_lock(self):
+        """Lock the cache for writing against other threads and processes."""
+        with self._lock:
+            with open(self.path + '.lock', 'a') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def get(self, key):
+        """Return cache Entry for the key with content as bytes or None
+        if it is not cached."""
+        conn = self._connection()
+        row = conn.execute(
+            'SELECT b.data, e.fetched_at, e.hash, e.etag, e.last_modified, e.accessed_at '
+            'FROM entries e JOIN bodies b ON b.hash = e.hash WHERE e.key = ?', (key,)).fetchone()
+        if not row:
+            return None
+        now = time.time()
+        if now - row[5] > ACCESS_RESOLUTION:
+            with self._write_lock():
+                conn.execute('UPDATE entries SET accessed_at = ? WHERE key = ?', (now, key))
+        return Entry(zlib.decompress(row[0]), *row[1:5])
+
+    def touch(self, key):
+        """Mark cached content for the key as fetched now, i.e. still
+        valid after revalidation."""
+        now = time.time()
+        conn = self._connection()
+        with self._write_lock():
+            conn.execute('UPDATE entries SET fetched_at = ?, accessed_at = ? WHERE key = ?', (now, now, key))
+
+    def put(self, key, content, etag=None, last_modified=None):
+        """Store content (bytes) for the key together with its HTTP
+        validators and return the respective cache Entry."""
+        hash = fingerprint(content)
+        now = time.time()
+        conn = self._connection()
+        with self._write_lock():
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                old = conn.execute('SELECT hash FROM entries WHERE key = ?', (key,)).fetchone()
+                if not conn.execute('SELECT 1 FROM bodies WHERE hash = ?', (hash,)).fetchone():
+                    data = zlib.compress(content)
+                    conn.execute('INSERT INTO bodies (hash, size, stored_size, data) VALUES (?, ?, ?, ?)',
+                        (hash, len(content), len(data), data))
+                    if self._size is not None:
+                        self._size += len(data)
+                conn.execute('INSERT OR REPLACE INTO entries '
+                    '(key, hash, fetched_at, accessed_at, etag, last_modified) VALUES (?, ?, ?, ?, ?, ?)',
+                    (key, hash, now, now, etag, last_modified))
+                if old and old[0] != hash:
+                    freed = self._delete_orphan(conn, old[0])
+                    if self._size is not None:
+                        self._size -= freed
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        if self.max_size is not None:
+            if self._size is None:
+                self._size = self.size()
+            if self._size > self.max_size:
+                self.evict(int(self.max_size * 0.9))
+        return Entry(content, now, hash, etag, last_modified)
+
+    def get_fingerprint(self, url):
+        """Return Fingerprint stored for the URL or None."""
+        row = self._connection().execute(
+            'SELECT hash, size, etag, last_modified, checked_at FROM fingerprints WHERE url = ?',
+            (url,)).fetchone()
+        return Fingerprint(*row) if row else None
+
+    def put_fingerprint(self, url, fingerprint):
+        """Store Fingerprint of content at the URL."""
+        conn = self._connection()
+        with self._write_lock():
+            conn.execute('INSERT OR REPLACE INTO fingerprints '
+                '(url, hash, size, etag, last_modified, checked_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (url,) + tuple(fingerprint))
+
+    def get_parsed(self, hash, parser, version):
+        """Return result of the given version of the parser stored for
+        content with the hash or None."""
+        row = self._connection().execute('SELECT version, data FROM parsed WHERE hash = ? AND parser = ?',
+            (hash, parser)).fetchone()
+        if not row or row[0] != version:
+            return None
+        return json.loads(zlib.decompress(row[1]).decode('utf-8'))
+
+    def put_parsed(self, hash, parser, version, result):
+        """Store result (JSON serializable) of the given version of the
+        parser for content with the hash, replacing a result of any other
+        version."""
+        data = zlib.compress(json.dumps(result, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+        conn = self._connection()
+        with self._write_lock():
+            conn.execute('INSERT OR REPLACE INTO parsed (hash, parser, version, data) '
+                'VALUES (?, ?, ?, ?)', (hash, parser, version, data))
+
+    def get_processed(self, key):
+        """Return hash of content for the key that was processed last or
+        None."""
+        row = self._connection().execute('SELECT hash FROM processed WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def put_processed(self, key, hash):
+        """Store hash of content for the key that was processed."""
+        conn = self._connection()
+        with self._write_lock():
+            conn.execute('INSERT OR REPLACE INTO processed (key, hash) VALUES (?, ?)', (key, hash))
+
+    def size(self):
+        """Return total size of stored (compressed) bodies in bytes."""
+        return self._connection().execute('SELECT COALESCE(SUM(stored_size), 0) FROM bodies').fetchone()[0]
+
+    def evict(self, max_size):
+        """Delete the least recently used entries until the total size of
+        stored bodies is at most `max_size` bytes."""
+        conn = self._connection()
+        with self._write_lock():
+            size = self.size()
+            if size > max_size:
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    while size > max_size:
+                        # the deleted entries drop out of the next batch
+                        rows = conn.execute('SELECT key, hash FROM entries ORDER BY accessed_at, rowid LIMIT ?',
+                            (EVICTION_BATCH,)).fetchall()
+                        if not rows:
+                            break
+                        for key, hash in rows:
+                            if size <= max_size:
+                                break
+                            conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+                            size -= self._delete_orphan(conn, hash)
+                    conn.execute('COMMIT')
+                except BaseException:
+                    conn.execute('ROLLBACK')
+                    raise
+            self._size = size
+
+    def clear(self):
+        """Delete all cached content."""
+        conn = self._connection()
+        with self._write_lock():
+            conn.execute('DELETE FROM entries')
+            conn.execute('DELETE FROM bodies')
+            conn.execute('DELETE FROM fingerprints')
+            conn.execute('DELETE FROM parsed')
+            conn.execute('DELETE FROM processed')
+            self._size = 0
+        conn.execute('VACUUM')
+
+    @staticmethod
+    def _delete_orphan(conn, hash):
+        """Delete the body with given hash unless an entry refers to it.
+        Return the stored size of the deleted body or 0 if it was kept."""
+        row = conn.execute('SELECT stored_size FROM bodies WHERE hash = ? AND NOT EXISTS '
+            '(SELECT 1 FROM entries WHERE hash = ?)', (hash, hash)).fetchone()
+        if not row:
+            return 0
+        conn.execute('DELETE FROM bodies WHERE hash = ?', (hash,))
+        return row[0]